@@ -1,10 +1,15 @@
 from utils.monitoring.process_monitor import ProcessMonitor
+from utils.monitoring.multi_cell import MultiCellMonitor
 from utils.interfaces import load_config
 
 # Usage example (to be placed in main.py):
 def main():
     config = load_config('config.yaml')
-    monitor = ProcessMonitor(config)
+    # With a `cells` list one process runs every cell on a shared model
+    if config.get('cells'):
+        monitor = MultiCellMonitor(config, config_path='config.yaml')
+    else:
+        monitor = ProcessMonitor(config, config_path='config.yaml')
     # monitor.setup()
     try:
         print("the monitor is running")
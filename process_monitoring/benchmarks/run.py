@@ -0,0 +1,349 @@
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+from pathlib import Path
+from datetime import datetime as dt
+
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import FRAME_WIDTH, FRAME_HEIGHT, write_gcode, synthetic_frame
+from utils.data_processing.gcode_parser import GCodeParser, ColumnarGCodeParser
+from utils.data_processing.mask_handler import MaskHandler, MaskApplicator
+from utils.data_processing.mask_cache import MaskCache
+from utils.simulation import SimulatedHardware
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Hardware-free benchmarks for the layer path, run from process_monitoring/:
+#   python -m benchmarks.run --output before.json
+#   python -m benchmarks.run --output after.json --compare before.json
+# Every timing is in milliseconds and every memory figure in MiB.
+
+PIX_PER_MM = 56
+BENCHMARKS = ('parse', 'masks', 'apply_mask', 'inference', 'end_to_end')
+
+
+def summarize(samples):
+    samples = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        'runs': int(samples.size),
+        'mean_ms': float(samples.mean()),
+        'median_ms': float(np.median(samples)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'min_ms': float(samples.min()),
+        'max_ms': float(samples.max()),
+    }
+
+
+def timed(func, repeat=5, warmup=1):
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def traced(func):
+    # func's result, its wall time and the peak of Python and NumPy allocations while it ran
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = func()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed * 1000, peak / 2 ** 20
+
+
+def yolo_config(args):
+    # yolov8n.yaml builds an untrained nano model without downloading weights
+    return {
+        'model_path': args.model,
+        'imgsz': args.imgsz,
+        'conf': 0.25,
+        'backend': {'format': 'torch', 'runtime': 'ultralytics', 'threads': args.threads, 'warmup_runs': 1},
+        'roi': {'enabled': True, 'margin': 64},
+        'tiling': {'enabled': False},
+        'correction_enabled': True,
+        'remove_underextrusions': True,
+    }
+
+
+def bench_parse(gcode_path, args):
+    results = {}
+    for name, parser_class in (('GCodeParser', GCodeParser), ('ColumnarGCodeParser', ColumnarGCodeParser)):
+        def parse():
+            parser = parser_class()
+            parser.parse_file(gcode_path)
+            return parser
+
+        parser, _, peak_mb = traced(parse)
+        results[name] = {**timed(parse, args.repeat, warmup=0), 'peak_mb': peak_mb, 'moves': len(parser.get_moves())}
+    return results
+
+
+def bench_masks(layers, args, workdir):
+    handler = MaskHandler(layers, args.width, args.height, PIX_PER_MM, cache_mb=1024)
+    manager = handler.mask_manager
+    samples = []
+
+    def rasterize_all():
+        masks = {}
+        for layer in layers:
+            start = time.perf_counter()
+            masks[layer] = manager._rasterize(layer)
+            samples.append(time.perf_counter() - start)
+        return masks
+
+    masks, total_ms, peak_mb = traced(rasterize_all)
+    retained = sum(mask.nbytes for mask in masks.values() if mask is not None)
+
+    # The pre-cropping full-frame rasterizer, on a few layers for reference
+    sample_layers = list(layers)[:3]
+    coordinates = [manager._extract_coordinates_with_travel(layers[layer]) for layer in sample_layers]
+    full_frame = timed(lambda: [manager.mask_gen.generate_mask(c, manager.thickness) for c in coordinates],
+                       repeat=1, warmup=0)
+
+    cache = MaskCache(workdir / 'mask_cache', workers=args.workers)
+    _, cold_ms, cold_peak_mb = traced(lambda: cache.get_masks(manager, manager.thickness))
+    warm_cache = MaskCache(workdir / 'mask_cache', workers=args.workers)
+    _, warm_ms, _ = traced(lambda: warm_cache.get_masks(manager, manager.thickness))
+    on_disk = sum(f.stat().st_size for f in (workdir / 'mask_cache').rglob('*') if f.is_file())
+    handler.close()
+
+    result = {
+        'layers': len(layers),
+        'rasterize_per_layer': summarize(samples),
+        'rasterize_total_ms': total_ms,
+        'rasterize_peak_mb': peak_mb,
+        'retained_mb': retained / 2 ** 20,
+        'full_frame_per_layer_ms': full_frame['median_ms'] / len(sample_layers),
+        'full_frame_mask_mb': args.width * args.height / 2 ** 20,
+        'cache_cold_ms': cold_ms,
+        'cache_cold_peak_mb': cold_peak_mb,
+        'cache_warm_ms': warm_ms,
+        'cache_disk_mb': on_disk / 2 ** 20,
+        'workers': cache.workers,
+    }
+    return result, masks
+
+
+def bench_apply_mask(frame, mask, args):
+    # Reference full-frame path, the bounding-box path and the fused, pooled one
+    full = mask.to_full()
+    applicator = MaskApplicator()
+    variants = {
+        'full_frame': lambda: MaskApplicator.apply_mask(frame, full),
+        'cropped': lambda: MaskApplicator.apply_mask(frame, mask),
+        'fused': lambda: applicator.apply(frame, mask),
+    }
+    x0, y0, x1, y1 = mask.bbox
+    result = {'bbox_fraction': (x1 - x0) * (y1 - y0) / (frame.shape[0] * frame.shape[1])}
+    for name, func in variants.items():
+        func()  # the fused path allocates its pooled buffers on the first call
+        _, _, peak_mb = traced(func)
+        result[name] = {**timed(func, args.repeat), 'allocated_peak_mb': peak_mb}
+    return result
+
+
+def bench_inference(frame, mask, args, workdir):
+    from utils.monitoring.yolo_inference import YOLOInference
+    try:
+        inference, load_ms, _ = traced(lambda: YOLOInference(yolo_config(args), output_path=workdir))
+    except ImportError as exc:
+        return {'skipped': f"inference dependencies missing: {exc}"}
+    masked = MaskApplicator.apply_mask(frame, mask)
+    return {
+        'model': args.model,
+        'backend': inference.backend.name,
+        'imgsz': args.imgsz,
+        'load_ms': load_ms,
+        'full_frame': timed(lambda: inference.infer(masked), args.repeat),
+        'roi': timed(lambda: inference.infer(masked, roi=mask.bbox), args.repeat),
+    }
+
+
+def bench_end_to_end(layers, frame, args, workdir):
+    # The real ProcessMonitor on simulated hardware: photo pulses on the board stand-in and
+    # frames served by the neoapi stand-in, timed from the debounced trigger to the decision.
+    from utils.monitoring.process_monitor import ProcessMonitor
+    cad_file = workdir / 'toolpath.json'
+    with open(cad_file, 'w') as f:
+        json.dump(layers, f)
+    config = {
+        'output_path': str(workdir / 'e2e'),
+        'part_name': 'benchmark',
+        'mask_cache_dir': str(workdir / 'e2e_mask_cache'),
+        'mask_workers': args.workers,
+        'gpio': {'simulated': False, 'poll_interval': 0.005},
+        'mask_handler': {'parsed_gcode': layers, 'image_width': args.width, 'image_height': args.height,
+                         'pix_per_mm': PIX_PER_MM},
+        'camera': {'masking': True, 'cad_file': str(cad_file), 'pix_per_mm': PIX_PER_MM,
+                   'image_width': args.width, 'image_height': args.height},
+        'yolo': yolo_config(args),
+    }
+
+    with SimulatedHardware(frames=[frame]) as hardware:
+        monitor = ProcessMonitor(config)
+        try:
+            try:
+                monitor.startup.get('pipeline')
+            except ImportError as exc:
+                return {'skipped': f"inference dependencies missing: {exc}"}
+            runner = threading.Thread(target=monitor.run, name='benchmark-monitor', daemon=True)
+            runner.start()
+            time.sleep(0.1)  # a line that is already high when sampling starts is not an edge
+            for i in range(args.e2e_layers):
+                hardware.board.pulse('C5', width=0.02)
+                deadline = time.monotonic() + 120
+                while len(monitor.trigger_latencies) <= i:
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"No decision for trigger {i} within 120s")
+                    time.sleep(0.001)
+                time.sleep(0.03)  # let the photo line fall before the next pulse
+            hardware.board.pulse('C3', width=0.02)
+            runner.join(10)
+            startup = dict(monitor.startup.timings)
+        finally:
+            monitor.cleanup()
+
+    return {
+        'layers': args.e2e_layers,
+        'trigger_to_decision': summarize([latency for _, latency in monitor.trigger_latencies]),
+        'startup_s': startup,
+        'camera_frames': sum(camera.grabbed for camera in hardware.neoapi.cameras),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'revision': git_revision(),
+        'time': dt.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'threads': cv2.getNumThreads(),
+    }
+
+
+def run(args):
+    selected = [name for name in BENCHMARKS if name not in args.skip]
+    report = {
+        'environment': environment(),
+        'parameters': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='champ-bench-') as tmp:
+        workdir = Path(tmp)
+        gcode_path = write_gcode(workdir / 'part.gcode', layers=args.layers, moves_per_layer=args.moves,
+                                 switch_every=args.switch_every, seed=args.seed)
+        frame = synthetic_frame(args.width, args.height, pix_per_mm=PIX_PER_MM, seed=args.seed)
+        report['parameters']['gcode_mb'] = gcode_path.stat().st_size / 2 ** 20
+
+        parser = ColumnarGCodeParser()
+        parser.parse_file(gcode_path)
+        layers = parser.get_layers()
+
+        if 'parse' in selected:
+            report['results']['parse'] = bench_parse(gcode_path, args)
+        masks = {}
+        if 'masks' in selected or 'apply_mask' in selected or 'inference' in selected:
+            report['results']['masks'], masks = bench_masks(layers, args, workdir)
+        mask = masks.get(max(masks)) if masks else None
+        if 'apply_mask' in selected:
+            report['results']['apply_mask'] = bench_apply_mask(frame, mask, args)
+        if 'inference' in selected:
+            report['results']['inference'] = bench_inference(frame, mask, args, workdir)
+        if 'end_to_end' in selected:
+            report['results']['end_to_end'] = bench_end_to_end(layers, frame, args, workdir)
+
+    if resource is not None:
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        scale = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10
+        report['environment']['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    return report
+
+
+def flatten(tree, prefix=''):
+    flat = {}
+    for key, value in tree.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(baseline, current):
+    # Lower is better for every _ms and _mb figure
+    before = flatten(baseline['results'])
+    after = flatten(current['results'])
+    print(f"{'metric':<60}{'baseline':>12}{'current':>12}{'change':>10}")
+    for path in sorted(set(before) & set(after)):
+        if not (path.endswith('_ms') or path.endswith('_mb')) or path.endswith(('min_ms', 'max_ms')):
+            continue
+        old, new = before[path], after[path]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+        print(f"{path:<60}{old:>12.2f}{new:>12.2f}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hardware-free benchmarks for the CHAMP layer pipeline")
+    parser.add_argument('--layers', type=int, default=20)
+    parser.add_argument('--moves', type=int, default=2000, help="moves per layer")
+    parser.add_argument('--switch-every', type=int, default=1,
+                        help="layers between polymer/ceramic switches, 0 for polymer only")
+    parser.add_argument('--width', type=int, default=FRAME_WIDTH)
+    parser.add_argument('--height', type=int, default=FRAME_HEIGHT)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help="mask cache worker processes")
+    parser.add_argument('--model', default='yolov8n.yaml')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--e2e-layers', type=int, default=5)
+    parser.add_argument('--skip', nargs='*', default=[], choices=BENCHMARKS)
+    parser.add_argument('--output', type=Path, help="write the JSON report here instead of stdout")
+    parser.add_argument('--compare', type=Path, help="JSON report of an earlier run to compare against")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=4)
+    if args.output:
+        args.output.parent.mkdir(exist_ok=True, parents=True)
+        args.output.write_text(text)
+        print(f"Benchmark report written to {args.output}")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
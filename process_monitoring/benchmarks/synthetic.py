@@ -0,0 +1,58 @@
+import numpy as np
+
+# Synthetic inputs for the benchmarks: G-code in the shape the slicer writes and camera
+# frames at the full sensor resolution, both reproducible from a seed.
+
+FRAME_WIDTH = 5472
+FRAME_HEIGHT = 3648
+
+
+def generate_gcode(layers=50, moves_per_layer=2000, switch_every=1, size_mm=30.0, layer_height=0.1, seed=0):
+    # Serpentine infill over a square part, with a travel move at the start of every pass.
+    # The material system alternates between polymer (G55) and ceramic (G58) every
+    # switch_every layers, 0 keeps everything on polymer.
+    rng = np.random.default_rng(seed)
+    lines = [";Generated by benchmarks.synthetic", "G21", "G90"]
+    passes = max(1, moves_per_layer // 2)
+    half = size_mm / 2
+    for layer in range(1, layers + 1):
+        lines.append(f";Layer {layer} of {layers}")
+        ceramic = switch_every and ((layer - 1) // switch_every) % 2 == 1
+        lines.append("G58" if ceramic else "G55")
+        axis = 'B' if ceramic else 'A'
+        lines.append(f"G0 Z{layer * layer_height:.3f} F600")
+        ys = np.linspace(-half, half, passes) + rng.normal(0, 0.01, passes)
+        for i, y in enumerate(ys):
+            x0, x1 = (-half, half) if i % 2 == 0 else (half, -half)
+            lines.append(f"G0 X{x0:.3f} Y{y:.3f} F3000")
+            lines.append(f"G1 X{x1:.3f} Y{y:.3f} {axis}{abs(x1 - x0) * 0.01:.4f} F1200")
+    lines.append("M30")
+    return "\n".join(lines) + "\n"
+
+
+def write_gcode(path, **kwargs):
+    with open(path, 'w') as f:
+        f.write(generate_gcode(**kwargs))
+    return path
+
+
+def synthetic_frame(width=FRAME_WIDTH, height=FRAME_HEIGHT, part_mm=30.0, pix_per_mm=56, defects=5, seed=0):
+    # Mono8 frame: noisy dark bed, a brighter part centred on the optical axis and a few
+    # dark blobs on the part standing in for defects
+    rng = np.random.default_rng(seed)
+    frame = rng.normal(40, 6, (height, width)).clip(0, 255).astype(np.uint8)
+    half = int(part_mm * pix_per_mm / 2)
+    cx, cy = width // 2, height // 2
+    y0, y1 = max(cy - half, 0), min(cy + half, height)
+    x0, x1 = max(cx - half, 0), min(cx + half, width)
+    part = rng.normal(170, 12, (y1 - y0, x1 - x0)).clip(0, 255).astype(np.uint8)
+    frame[y0:y1, x0:x1] = part
+    for _ in range(defects):
+        r = int(rng.integers(10, 60))
+        x = int(rng.integers(x0 + r, max(x1 - r, x0 + r + 1)))
+        y = int(rng.integers(y0 + r, max(y1 - r, y0 + r + 1)))
+        yy, xx = np.ogrid[-r:r, -r:r]
+        blob = (xx * xx + yy * yy) <= r * r
+        frame[y - r:y + r, x - r:x + r][blob] = 60
+    return frame
+
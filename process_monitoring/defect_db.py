@@ -0,0 +1,79 @@
+import argparse
+from pathlib import Path
+
+from utils.interfaces import load_config
+from utils.data_processing.defect_database import DefectDatabase, CLASS_COLUMNS, GROUPS, layer_heights
+
+# Queries across prints from the defect database the monitor writes with database.enabled, e.g.
+#   python defect_db.py import ~/output                         # existing <part_name>_defects.json reports
+#   python defect_db.py rate --by z --class Underextrusion --last 200
+#   python defect_db.py decisions --part part_a
+#   python defect_db.py defects 12 --layer 40
+
+
+def print_rows(rows):
+    if not rows:
+        return
+    columns = list(rows[0])
+    cells = [[str(column) for column in columns]] + [[str(row[column]) for column in columns] for row in rows]
+    widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+    for line in cells:
+        print('  '.join(cell.rjust(width) for cell, width in zip(line, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import and query the cross-print defect database")
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--db', type=Path, help="database file, defaults to database.path")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    importer = commands.add_parser('import', help="load JSON defect reports")
+    importer.add_argument('paths', nargs='+', type=Path, help="reports or directories searched for *_defects.json")
+    importer.add_argument('--gcode', type=Path, help="G-code the prints ran, for layer heights")
+    importer.add_argument('--layer-offset', type=int, default=1,
+                          help="G-code layer of monitor layer 0, as segment_index.layer_offset")
+
+    def filtered(command, help):
+        sub = commands.add_parser(command, help=help)
+        sub.add_argument('--last', type=int, default=200, help="most recent prints to include")
+        sub.add_argument('--part', help="only prints of this part_name")
+        return sub
+
+    filtered('prints', "recent prints with their layer and defect counts")
+    rate = filtered('rate', "share of layers with defects")
+    rate.add_argument('--by', choices=list(GROUPS), default='layer')
+    rate.add_argument('--class', dest='defect_class', choices=[c for c in CLASS_COLUMNS if c])
+    filtered('decisions', "planarize/rework/none counts")
+    defects = commands.add_parser('defects', help="detections of one print")
+    defects.add_argument('print_id', type=int)
+    defects.add_argument('--layer', type=int)
+    defects.add_argument('--min-conf', type=float, default=0.0)
+    args = parser.parse_args()
+
+    path = args.db
+    if path is None:
+        config = load_config(args.config)
+        path = config.get('database', {}).get('path') or Path.home() / config.get('output_path', '.') / 'defects.sqlite'
+    database = DefectDatabase(path)
+    try:
+        if args.command == 'import':
+            heights = layer_heights(args.gcode) if args.gcode else None
+            imported = database.import_reports(args.paths, heights, args.layer_offset)
+            print(f"Imported {imported} reports into {database.path}")
+            return
+        if args.command == 'prints':
+            rows = database.prints(args.last, args.part)
+        elif args.command == 'rate':
+            rows = database.defect_rate(args.by, args.defect_class, args.last, args.part)
+        elif args.command == 'decisions':
+            rows = database.decisions(args.last, args.part)
+        else:
+            rows = database.defects(args.print_id, args.layer, args.min_conf)
+        print_rows(rows)
+        print(f"{len(rows)} rows in {database.last_query_time * 1000:.1f} ms")
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    main()
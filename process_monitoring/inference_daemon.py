@@ -0,0 +1,31 @@
+import argparse
+import signal
+import threading
+
+from utils.interfaces import load_config
+from utils.monitoring.inference_daemon import InferenceDaemon, DEFAULT_SOCKET
+
+# Keeps torch, ultralytics and the weights loaded while app.py is restarted, e.g.
+#   python inference_daemon.py --config config.yaml
+# Monitors with yolo.daemon.enabled connect to it, and load the model themselves when it is not running.
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-lived local inference service for the CHAMP monitor")
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--socket', help="Unix socket path, defaults to yolo.daemon.socket")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    socket_path = args.socket or config['yolo'].get('daemon', {}).get('socket', DEFAULT_SOCKET)
+    daemon = InferenceDaemon(config['yolo'], socket_path)
+    # shutdown() waits for serve_forever, so it cannot run on the thread that is serving
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=daemon.shutdown).start())
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
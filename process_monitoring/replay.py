@@ -0,0 +1,49 @@
+import argparse
+from pathlib import Path
+
+from utils.interfaces import load_config
+from utils.monitoring.offline_replay import BatchReplay
+
+# Re-runs the current model over the Camera/ frames of finished prints, e.g.
+#   python replay.py ~/output/2025-03-01/part_10_15 --conf 0.6 --workers 4
+# Each print gets <part_name>_defects_replay.json next to its original report.
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprocess saved frames of finished prints")
+    parser.add_argument('print_dirs', nargs='+', type=Path, help="print directories containing Camera/")
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--toolpath', type=Path,
+                        help="CAD JSON or G-code for the masks, defaults to camera.cad_file when masking is on")
+    parser.add_argument('--no-mask', action='store_true', help="run on the raw frames")
+    parser.add_argument('--model', help="override yolo.model_path")
+    parser.add_argument('--conf', type=float, help="override yolo.conf")
+    parser.add_argument('--workers', type=int, help="worker processes, 0 runs in this process")
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--start-layer', type=int, default=0, help="first layer when a print has no defect report")
+    parser.add_argument('--output-dir', type=Path, help="write reports here instead of into each print directory")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    if args.model:
+        config['yolo']['model_path'] = args.model
+    if args.conf is not None:
+        config['yolo']['conf'] = args.conf
+    toolpath = args.toolpath
+    if toolpath is None and config['camera'].get('masking', False):
+        toolpath = config['camera']['cad_file']
+    if args.no_mask:
+        toolpath = None
+
+    with BatchReplay(config, workers=args.workers, batch_size=args.batch_size) as replay:
+        for print_dir in args.print_dirs:
+            output = None
+            if args.output_dir:
+                args.output_dir.mkdir(exist_ok=True, parents=True)
+                output = args.output_dir / f"{print_dir.name}_defects_replay.json"
+            output, _ = replay.replay(print_dir, toolpath, output, args.start_layer)
+            print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The monitor imports its modules as utils.*, relative to process_monitoring/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
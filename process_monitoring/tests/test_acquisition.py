@@ -0,0 +1,77 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from utils.monitoring.acquisition import ContinuousAcquisition
+from utils.simulation import SimulatedCam, SimulatedNeoAPI
+
+
+class LEDs:
+    def __init__(self):
+        self.history = []  # (time.perf_counter(), state)
+
+    def toggle_leds(self, state):
+        self.history.append((time.perf_counter(), bool(state)))
+
+
+def acquisition(trigger='software', buffers=3, **config):
+    frames = [np.full((4, 6), value, np.uint8) for value in range(1, 9)]
+    camera = SimulatedCam(frames)
+    camera.f.ExposureTime.Set(2000)
+    leds = LEDs()
+    acquired = ContinuousAcquisition(camera, SimulatedNeoAPI(), leds,
+                                     {'trigger': trigger, 'buffers': buffers, 'led_settle': 0.005, **config}, 2000)
+    return acquired, camera, leds
+
+
+def test_leds_cover_the_software_triggered_exposure():
+    acquired, camera, leds = acquisition()
+    frame, timestamp = acquired.grab()
+    assert (frame == 1).all() and frame.shape == (4, 6)
+    assert camera.f.TriggerMode.Get() == 'On' and camera.f.TriggerSource.Get() == 'Software'
+    (on, on_state), (off, off_state) = leds.history
+    start, end = camera.exposures[0]
+    assert on_state and not off_state
+    assert on + 0.005 <= start and end <= off
+
+
+def test_hardware_trigger_waits_for_the_line_and_delays_the_exposure():
+    acquired, camera, leds = acquisition('hardware', trigger_line='Line1')
+    assert camera.f.TriggerSource.Get() == 'Line1' and camera.f.TriggerDelay.Get() == pytest.approx(5000)
+    threading.Timer(0.02, camera.fire_line_trigger).start()
+    frame, _ = acquired.grab()
+    assert (frame == 1).all()
+    (on, _), (off, _) = leds.history
+    start, end = camera.exposures[0]
+    assert on + 0.02 <= start and end <= off
+    assert acquired.exposure_windows[0][1] is None
+
+
+def test_timeout_without_a_trigger():
+    acquired, camera, leds = acquisition('hardware', timeout=0.05)
+    with pytest.raises(TimeoutError):
+        acquired.grab()
+    # The LEDs do not stay on after a missed frame
+    assert leds.history[-1][1] is False
+
+
+def test_held_frames_keep_their_buffers_and_the_last_one_is_copied():
+    acquired, camera, leds = acquisition(buffers=3, led_settle=0.0)
+    first, _ = acquired.grab()
+    second, _ = acquired.grab()
+    assert acquired.in_use() == 2
+    # Two of three buffers are lent out, the third frame is copied and its buffer handed back
+    third, _ = acquired.grab()
+    assert acquired.copied == 1 and not any(np.shares_memory(third, buffer.memory) for buffer in acquired._buffers)
+    fourth, _ = acquired.grab()
+    assert (first == 1).all() and (second == 2).all() and (third == 3).all() and (fourth == 4).all()
+    assert camera.dropped == 0
+
+    del first, second
+    assert acquired.in_use() == 0
+    fifth, _ = acquired.grab()
+    assert (fifth == 5).all() and acquired.in_use() == 1
+    acquired.close()
+    assert camera.f.TriggerMode.Get() == 'Off' and not camera.user_buffer_mode
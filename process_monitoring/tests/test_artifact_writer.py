@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+from utils.monitoring.artifact_writer import ArtifactWriter
+
+
+def frame(value):
+    return np.full((32, 48), value, np.uint8)
+
+
+def test_flush_waits_for_every_write(tmp_path):
+    writer = ArtifactWriter(tmp_path, {'masked': {'format': 'png'}})
+    done = []
+    raw = writer.submit_frame('raw', 'ts_1', frame(10), on_done=lambda path, image: done.append(path))
+    masked = writer.submit_frame('masked', 'ts_1', frame(20))
+    assert writer.submit_frame('raw', 'ts_2', None) is None
+    writer.flush()
+    assert writer.pending() == 0
+    assert (raw.name, masked.name) == ('image_ts_1.bmp', 'mask_image_ts_1.png')
+    assert done == [raw]
+    np.testing.assert_array_equal(cv2.imread(str(raw), cv2.IMREAD_GRAYSCALE), frame(10))
+    np.testing.assert_array_equal(cv2.imread(str(masked), cv2.IMREAD_GRAYSCALE), frame(20))
+    writer.close()
+
+
+def test_overlay_is_drawn_by_the_worker(tmp_path):
+    drawn = []
+
+    def plot(img=None):
+        drawn.append(img.shape)
+        return img
+
+    writer = ArtifactWriter(tmp_path)
+    path = writer.submit_overlay('ts_3', [SimpleNamespace(orig_img=frame(30), plot=plot)])
+    writer.close()
+    # The mono frame is converted to BGR only when the overlay is rendered
+    assert drawn == [(32, 48, 3)]
+    assert path.name == 'image_ts_3_predictions.jpeg' and path.exists()
+
+
+def test_close_writes_everything_queued_then_refuses_more(tmp_path):
+    writer = ArtifactWriter(tmp_path, workers=2, queue_size=4)
+    paths = [writer.submit_frame('raw', f"ts_{i}", frame(i)) for i in range(20)]
+    writer.close()
+    assert all(path.exists() for path in paths)
+    assert (writer.written, writer.failed) == (20, 0)
+    assert not any(worker.is_alive() for worker in writer._workers)
+    with pytest.raises(RuntimeError):
+        writer.submit_frame('raw', 'ts_late', frame(0))
+
+
+def test_failed_write_is_counted_and_does_not_stop_the_worker(tmp_path):
+    writer = ArtifactWriter(tmp_path, workers=1)
+
+    def plot(img=None):
+        raise ValueError("bad results")
+
+    writer.submit_overlay('ts_4', [SimpleNamespace(orig_img=frame(0), plot=plot)])
+    path = writer.submit_frame('raw', 'ts_5', frame(5))
+    writer.close()
+    assert (writer.written, writer.failed) == (1, 1)
+    assert path.exists()
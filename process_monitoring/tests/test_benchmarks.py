@@ -0,0 +1,55 @@
+import argparse
+
+from benchmarks.run import run, compare, flatten
+from benchmarks.synthetic import generate_gcode, synthetic_frame
+from utils.data_processing.gcode_parser import ColumnarGCodeParser
+
+
+def test_synthetic_gcode_alternates_materials(tmp_path):
+    path = tmp_path / 'part.gcode'
+    path.write_text(generate_gcode(layers=4, moves_per_layer=10, switch_every=2))
+    text = path.read_text()
+    assert text.count(";Layer ") == 4
+    assert [line for line in text.splitlines() if line in ('G55', 'G58')] == ['G55', 'G55', 'G58', 'G58']
+    parser = ColumnarGCodeParser()
+    parser.parse_file(path)
+    assert len(parser.get_layers()) == 4
+
+
+def test_synthetic_frame_is_reproducible():
+    frame = synthetic_frame(800, 600, part_mm=5.0, seed=3)
+    assert frame.shape == (600, 800) and frame.dtype.name == 'uint8'
+    assert (frame == synthetic_frame(800, 600, part_mm=5.0, seed=3)).all()
+    # The part is brighter than the bed around it
+    assert frame[300, 400] > frame[10, 10]
+
+
+def small_args(**overrides):
+    args = dict(layers=3, moves=60, switch_every=1, width=1200, height=900, repeat=1, seed=0, workers=1,
+                model='yolov8n.yaml', imgsz=320, threads=None, e2e_layers=1, skip=['inference', 'end_to_end'],
+                output=None, compare=None)
+    return argparse.Namespace(**{**args, **overrides})
+
+
+def test_report_covers_the_selected_benchmarks():
+    report = run(small_args())
+    results = report['results']
+    assert set(results) == {'parse', 'masks', 'apply_mask'}
+    assert report['parameters']['layers'] == 3 and 'output' not in report['parameters']
+    # Both parsers read the same moves
+    assert results['parse']['GCodeParser']['moves'] == results['parse']['ColumnarGCodeParser']['moves'] > 0
+    assert results['masks']['layers'] == 3 and results['masks']['cache_disk_mb'] > 0
+    for variant in ('full_frame', 'cropped', 'fused'):
+        assert results['apply_mask'][variant]['runs'] == 1
+
+
+def test_compare_reports_relative_change(capsys):
+    baseline = {'results': {'parse': {'median_ms': 10.0, 'min_ms': 1.0, 'runs': 5}, 'masks': {'retained_mb': 4.0}}}
+    current = {'results': {'parse': {'median_ms': 5.0, 'min_ms': 2.0, 'runs': 5}, 'masks': {'retained_mb': 4.0}}}
+    assert flatten(current['results']) == {'parse.median_ms': 5.0, 'parse.min_ms': 2.0, 'parse.runs': 5,
+                                           'masks.retained_mb': 4.0}
+    compare(baseline, current)
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 3
+    assert lines[1].startswith('masks.retained_mb') and lines[1].endswith('+0.0%')
+    assert lines[2].startswith('parse.median_ms') and lines[2].endswith('-50.0%')
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from benchmarks.synthetic import write_gcode
+from utils.data_processing.defect_database import DefectDatabase, layer_heights
+
+
+def write_report(path, layers):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    records = [
+        {"Layer number": layer, "Number of defects": defects, "Overextrusions": defects, "Underextrusions": 0,
+         "Decision": "Planarize" if defects else "No defects",
+         "Defect data": [{"Class": "Overextrusion", "Confidence": 0.9, "Defect coordinates": [1, 2, 3, 4]}] * defects}
+        for layer, defects in layers
+    ]
+    path.write_text(json.dumps(records))
+    return path
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = DefectDatabase(tmp_path / 'defects.sqlite')
+    yield database
+    database.close()
+
+
+def test_import_skips_reports_already_imported(tmp_path, database, monkeypatch):
+    output = tmp_path / 'output'
+    write_report(output / '2026-10-01' / 'part_a_10_00' / 'part_a_defects.json', [(0, 0), (1, 2)])
+    assert database.import_reports([output]) == 1
+    # The same tree through other spellings of its path
+    monkeypatch.chdir(tmp_path)
+    assert database.import_reports(['output']) == 0
+    assert database.import_reports([tmp_path / 'output' / '..' / 'output' / '2026-10-01']) == 0
+    assert database.import_reports([output / '2026-10-01' / 'part_a_10_00' / 'part_a_defects.json']) == 0
+
+    write_report(output / '2026-10-02' / 'part_a_09_30' / 'part_a_defects.json', [(0, 1)])
+    assert database.import_reports([output]) == 1
+    prints = database.prints()
+    assert [row['started'] for row in prints] == ['2026-10-02T09:30:00', '2026-10-01T10:00:00']
+    assert [row['defects'] for row in prints] == [1, 2]
+
+
+def test_live_print_is_not_imported_again(tmp_path, database, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    report = tmp_path / 'output' / '2026-10-01' / 'part_b_08_15' / 'part_b_defects.json'
+    database.begin_print('part_b', 'output/2026-10-01/part_b_08_15/part_b_defects.json')
+    database.record_layer({"Layer number": 0, "Number of defects": 0, "Decision": "No defects"})
+    database.record_layer({"Layer number": 0, "Number of defects": 0, "Decision": "No defects"})
+    write_report(report, [(0, 0)])
+    assert database.import_reports([tmp_path / 'output']) == 0
+    assert database.prints()[0]['layers'] == 2
+    assert database.decisions() == [{'action': 'none', 'layers': 2, 'prints': 1}]
+
+
+def test_layer_heights_follow_the_layer_offset(tmp_path, database):
+    # Slicer layer n is printed at Z = n * 0.1, the monitor calls it layer n - 1
+    gcode = write_gcode(tmp_path / 'part.gcode', layers=4, moves_per_layer=20, layer_height=0.1)
+    heights = layer_heights(gcode)
+    assert heights[1] == pytest.approx(0.1)
+    write_report(tmp_path / 'output' / '2026-10-01' / 'part_c_07_00' / 'part_c_defects.json', [(0, 0), (2, 1)])
+    database.import_reports([tmp_path / 'output'], heights)
+    database.begin_print('part_d', tmp_path / 'live' / 'part_d_defects.json', heights=heights)
+    database.record_layer({"Layer number": 0, "Number of defects": 1, "Decision": "Planarize"})
+    database.record_layer({"Layer number": 3, "Number of defects": 0, "Decision": "No defects"})
+    rows = database.defect_rate(by='z')
+    assert [(row['z'], row['layers'], row['defects']) for row in rows] == [(0.1, 2, 1), (0.3, 1, 1), (0.4, 1, 0)]
@@ -0,0 +1,59 @@
+import os
+import time
+
+from utils.data_processing import defect_journal
+from utils.data_processing.defect_journal import DefectJournal
+
+
+def record(layer):
+    return {"Layer number": layer, "Number of defects": 0, "Decision": "No defects"}
+
+
+def count_fsyncs(monkeypatch):
+    calls = []
+    real = os.fsync
+
+    def fsync(fd):
+        calls.append(fd)
+        real(fd)
+
+    monkeypatch.setattr(defect_journal.os, 'fsync', fsync)
+    return calls
+
+
+def test_records_are_synced_in_batches(tmp_path, monkeypatch):
+    fsyncs = count_fsyncs(monkeypatch)
+    journal = DefectJournal(tmp_path / 'part_defects.jsonl', fsync_every=10, fsync_interval=60.0)
+    for layer in range(25):
+        journal.append(record(layer))
+    assert len(fsyncs) == 2
+    # Flushed to the OS at once, so a reader sees every record before it is synced
+    assert [r["Layer number"] for r in DefectJournal.read(journal.path)] == list(range(25))
+    journal.close()
+    assert len(fsyncs) == 3
+
+
+def test_waiting_batch_is_synced_after_the_interval(tmp_path, monkeypatch):
+    fsyncs = count_fsyncs(monkeypatch)
+    journal = DefectJournal(tmp_path / 'part_defects.jsonl', fsync_every=10, fsync_interval=0.2)
+    journal.append(record(0))
+    assert fsyncs == []
+    deadline = time.monotonic() + 2.0
+    while not fsyncs and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert len(fsyncs) == 1
+    journal.close()
+    assert len(fsyncs) == 1  # nothing left to sync
+
+
+def test_torn_record_is_skipped_and_appending_resumes(tmp_path):
+    path = tmp_path / 'part_defects.jsonl'
+    journal = DefectJournal(path)
+    journal.append(record(0))
+    journal.close()
+    with open(path, 'a') as f:
+        f.write('{"Layer number": 1, "Num')
+    journal = DefectJournal(path)
+    journal.append(record(1))
+    journal.close()
+    assert [r["Layer number"] for r in DefectJournal.read(path)] == [0, 1]
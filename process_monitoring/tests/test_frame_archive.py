@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from utils.data_processing.frame_archive import FrameArchive, FrameArchiveReader, INDEX_FILE
+
+
+def frame(seed, shape=(600, 800)):
+    # Smooth gradient plus noise, roughly what the camera delivers
+    rng = np.random.default_rng(seed)
+    ramp = np.linspace(0, 120, shape[1], dtype=np.float32)[None, :]
+    return (ramp + rng.normal(60, 8, shape)).clip(0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize('codec,filter', [('zlib', 'sub'), ('zlib', 'none'), ('none', 'sub')])
+def test_round_trip(tmp_path, codec, filter):
+    frames = [frame(i) for i in range(3)]
+    archive = FrameArchive(tmp_path, {'codec': codec, 'filter': filter, 'chunk_rows': 128, 'threads': 2})
+    for layer, image in enumerate(frames):
+        archive.append('raw', layer, f'image_{layer}.png', image)
+    archive.append('raw', 1, 'image_rework.png', frames[0])
+    archive.close()
+
+    with FrameArchiveReader(tmp_path, threads=2) as reader:
+        assert reader.layers() == [0, 1, 2]
+        assert [record['attempt'] for record in reader.attempts(1)] == [0, 1]
+        np.testing.assert_array_equal(reader.read(2), frames[2])
+        np.testing.assert_array_equal(reader.read(1, attempt=0), frames[1])
+        np.testing.assert_array_equal(reader.read(1), frames[0])
+        np.testing.assert_array_equal(reader.read_name('image_rework.png'), frames[0])
+        # Rows spanning a chunk boundary
+        np.testing.assert_array_equal(reader.read(2, rows=(100, 300)), frames[2][100:300])
+        assert reader.preview(0, 4).shape == (150, 200)
+        with pytest.raises(KeyError):
+            reader.read(7)
+
+
+def test_torn_index_line_is_skipped(tmp_path):
+    archive = FrameArchive(tmp_path)
+    archive.append('raw', 0, 'image_0.png', frame(0))
+    archive.close()
+    # A crash in the middle of writing an index line
+    with open(tmp_path / INDEX_FILE, 'a') as f:
+        f.write('{"layer": 1, "att')
+
+    archive = FrameArchive(tmp_path)
+    archive.append('raw', 0, 'image_0b.png', frame(1))
+    archive.append('raw', 2, 'image_2.png', frame(2))
+    archive.close()
+
+    with FrameArchiveReader(tmp_path) as reader:
+        assert reader.layers() == [0, 2]
+        # The resumed archive keeps counting attempts
+        assert [record['attempt'] for record in reader.attempts(0)] == [0, 1]
+        np.testing.assert_array_equal(reader.read(0), frame(1))
+        np.testing.assert_array_equal(reader.read(2), frame(2))
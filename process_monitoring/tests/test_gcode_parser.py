@@ -0,0 +1,35 @@
+import pytest
+
+from benchmarks.synthetic import write_gcode
+from utils.data_processing.gcode_parser import GCodeParser, ColumnarGCodeParser
+
+
+@pytest.fixture(scope='module')
+def gcode_file(tmp_path_factory):
+    # Material switches every other layer, so the system column is exercised too
+    return write_gcode(tmp_path_factory.mktemp('gcode') / 'part.gcode', layers=6, moves_per_layer=200, switch_every=2)
+
+
+def test_columnar_moves_match_reference_parser(gcode_file):
+    reference = GCodeParser()
+    reference.parse_file(gcode_file)
+    columnar = ColumnarGCodeParser()
+    columnar.parse_file(gcode_file)
+    assert columnar.get_moves() == reference.get_moves()
+
+
+def test_load_layer_matches_full_parse(gcode_file):
+    full = ColumnarGCodeParser()
+    full.parse_file(gcode_file)
+    indexed = ColumnarGCodeParser()
+    indexed.parse_file(gcode_file, store_moves=False)
+    assert sorted(indexed.layer_index) == full.table.layers()
+    for layer in full.table.layers():
+        assert indexed.load_layer(layer).to_dicts() == full.get_layer(layer).to_dicts()
+    assert indexed.get_layers() == full.get_layers()
+
+
+def test_unknown_layer_is_empty(gcode_file):
+    parser = ColumnarGCodeParser()
+    parser.parse_file(gcode_file, store_moves=False)
+    assert len(parser.load_layer(999)) == 0
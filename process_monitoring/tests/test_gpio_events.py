@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+from utils.interfaces import GPIOManager, GPIOEventMonitor
+from utils.simulation import SimulatedBoard
+
+
+@pytest.fixture
+def board():
+    return SimulatedBoard()
+
+
+@pytest.fixture
+def events(board):
+    monitor = GPIOEventMonitor(GPIOManager(backend=board))
+    monitor.start()
+    yield monitor
+    monitor.stop()
+
+
+def test_bouncing_pulse_is_one_edge(board, events):
+    fired = []
+    events.on_rising('photo', fired.append)
+    start = time.perf_counter()
+    board.pulse('C5', width=0.05, bounce=5).join()
+    event = events.wait_for(('photo',), timeout=1.0)
+    assert event is not None and event.name == 'photo'
+    assert event.timestamp >= start
+    assert events.wait_for(('photo',), timeout=0.05) is None
+    assert fired == [event]
+
+
+def test_held_line_fires_once(board, events):
+    board.set_input('C5', True)
+    assert events.wait_for(('photo',), timeout=1.0) is not None
+    assert events.wait_for(('photo',), timeout=0.1) is None
+    board.set_input('C5', False)
+    time.sleep(0.05)
+    board.set_input('C5', True)
+    assert events.wait_for(('photo',), timeout=1.0) is not None
+
+
+def test_line_high_at_start_is_not_an_edge(board):
+    board.set_input('C5', True)
+    monitor = GPIOEventMonitor(GPIOManager(backend=board))
+    monitor.start()
+    try:
+        assert monitor.wait_for(timeout=0.05) is None
+    finally:
+        monitor.stop()
+
+
+def test_other_pins_stay_queued(board, events):
+    board.pulse('C3', width=0.05).join()
+    assert events.wait_for(('photo',), timeout=0.05) is None
+    assert events.wait_for(('exit',), timeout=1.0).name == 'exit'
+
+
+def test_unwired_input_is_rejected(board):
+    manager = GPIOManager(backend=board, pins={'exit': None})
+    with pytest.raises(ValueError, match='exit'):
+        GPIOEventMonitor(manager)
+    monitor = GPIOEventMonitor(manager, pins=('photo',))
+    with pytest.raises(ValueError, match='exit'):
+        monitor.on_rising('exit', print)
+
+
+class CountingInput:
+    def __init__(self, pin):
+        self.pin = pin
+        self.reads = 0
+
+    @property
+    def value(self):
+        self.reads += 1
+        return self.pin.value
+
+
+@pytest.mark.parametrize('edge_waits', [True, False])
+def test_idle_sampler_wakeups(board, edge_waits):
+    manager = GPIOManager(backend=board)
+    if not edge_waits:
+        manager.edge_source = None  # like the FT232H
+    manager.inputs = {name: CountingInput(pin) for name, pin in manager.inputs.items()}
+    monitor = GPIOEventMonitor(manager, pins=('photo',))
+    assert monitor.debounce == 2 * monitor.poll_interval
+    monitor.start()
+    time.sleep(0.5)
+    board.pulse('C5', width=0.05).join()
+    event = monitor.wait_for(timeout=1.0)
+    monitor.stop()
+    assert event is not None
+    reads = manager.inputs['photo'].reads
+    # Polling samples every 5 ms, edge waits about every 100 ms plus a few while the pulse settles
+    assert reads < 40 if edge_waits else 80 <= reads < 200
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from utils.monitoring.inference_backends import InferenceBackend, NativeExportBackend, export_model, load_backend
+
+
+def test_letterbox_pads_and_scales_into_a_reused_blob():
+    backend = NativeExportBackend({})
+    image = np.full((300, 600), 255, np.uint8)
+    blob, ratio, pad = backend._letterbox(image, (320, 320))
+    assert blob.shape == (1, 3, 320, 320) and blob.dtype == np.float32
+    assert ratio == pytest.approx(320 / 600) and pad == (0, 80)
+    # The gray frame fills all three channels between the grey padding bands
+    assert (blob[0, :, 80:240] == 1.0).all()
+    assert (blob[0, :, :80] == np.float32(114 / 255)).all() and (blob[0, :, 240:] == np.float32(114 / 255)).all()
+    again, _, _ = backend._letterbox(image, (320, 320))
+    assert again is blob
+
+
+def test_decode_maps_model_boxes_back_to_the_frame():
+    backend = NativeExportBackend({'iou': 0.5})
+    ratio, pad = 320 / 600, (0, 80)
+
+    def anchor(box, scores):
+        x1, y1, x2, y2 = (np.float32(box) * ratio) + [pad[0], pad[1], pad[0], pad[1]]
+        return [(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1, *scores]
+
+    anchors = [
+        anchor([100, 60, 200, 120], [0.1, 0.8]),
+        anchor([104, 60, 204, 120], [0.1, 0.6]),  # the same defect, suppressed
+        anchor([400, 200, 450, 260], [0.2, 0.1]),  # below conf
+    ]
+    output = np.float32(anchors).T[None]  # (1, 4 + classes, anchors)
+    data = backend._decode(output, 0.25, ratio, pad, (300, 600))
+    np.testing.assert_allclose(data, [[100, 60, 200, 120, 0.8, 1]], atol=1e-3)
+    assert backend._decode(output, 0.9, ratio, pad, (300, 600)).shape == (0, 6)
+
+
+class CountingBackend(InferenceBackend):
+    def __init__(self):
+        super().__init__({})
+        self.shapes = []
+
+    def predict(self, images, imgsz, conf, **kwargs):
+        self.shapes.append(images.shape)
+
+
+def test_warmup_runs_the_model_on_a_blank_frame():
+    backend = CountingBackend()
+    backend.warmup((256, 320), runs=3)
+    assert backend.shapes == [(256, 320, 3)] * 3 and backend.warmup_time is not None
+    backend.warmup(256, runs=0)
+    assert len(backend.shapes) == 3
+
+
+def test_existing_export_is_reused(tmp_path):
+    model = tmp_path / 'best.pt'
+    model.touch()
+    (tmp_path / 'best_int8.onnx').touch()
+    assert export_model(model, 'onnx', 640, int8=True) == tmp_path / 'best_int8.onnx'
+    assert export_model(model, 'torch', 640) == model
+    # Already exported models are used as they are
+    assert export_model(tmp_path / 'best_int8.onnx', 'onnx', 640) == tmp_path / 'best_int8.onnx'
+
+
+def test_unknown_runtime_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        load_backend({'model_path': tmp_path / 'best.pt', 'backend': {'runtime': 'tensorrt'}})
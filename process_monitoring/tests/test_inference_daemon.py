@@ -0,0 +1,143 @@
+import socket
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from utils.monitoring import inference_daemon, yolo_inference
+from utils.monitoring.inference_daemon import InferenceClient, InferenceDaemon, send_message, recv_message
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason="the daemon listens on a Unix socket")
+
+NAMES = {0: 'Overextrusion', 1: 'Underextrusion'}
+BOX = np.float32([[1.0, 2.0, 5.0, 6.0, 0.9, 1.0]])
+
+
+def fake_results(orig_img, names, data, path=None, speed=None):
+    # build_results without ultralytics
+    boxes = SimpleNamespace(data=np.asarray(data, np.float32).reshape(-1, 6))
+    return [SimpleNamespace(orig_img=orig_img, names=names, boxes=boxes, speed=speed or {})]
+
+
+class Backend:
+    # The model the monitor loads itself when there is no daemon
+    name = 'fake'
+    names = NAMES
+
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, images, imgsz, conf, **kwargs):
+        self.calls += 1
+        return fake_results(images, NAMES, BOX)
+
+
+@pytest.fixture
+def local_model(monkeypatch):
+    backend = Backend()
+    monkeypatch.setattr(inference_daemon, 'load_backend', lambda config: backend)
+    monkeypatch.setattr(inference_daemon, 'build_results', fake_results)
+    monkeypatch.setattr(yolo_inference, 'build_results', fake_results)
+    return backend
+
+
+def client(socket_path):
+    return InferenceClient({'daemon': {'socket': str(socket_path), 'connect_timeout': 1.0}}, output_path=None)
+
+
+def test_no_daemon_loads_the_model_here(tmp_path, local_model):
+    yolo = client(tmp_path / 'missing.sock')
+    assert yolo.sock is None and yolo.names == NAMES
+    assert yolo.frame_buffer((4, 4)) is None
+    results = yolo.infer(np.zeros((8, 8), np.uint8))
+    assert local_model.calls == 1
+    np.testing.assert_array_equal(results[0].boxes.data, BOX)
+    yolo.close()
+
+
+def serve_once(socket_path, replies):
+    # A daemon stand-in that sends the given replies, one per message, then drops the connection
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(socket_path))
+    server.listen(1)
+
+    def serve():
+        connection, _ = server.accept()
+        with connection:
+            for reply in replies:
+                if recv_message(connection) is None:
+                    return
+                send_message(connection, reply)
+            recv_message(connection)
+        server.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+
+
+def test_daemon_that_cannot_load_the_model_is_not_used(tmp_path, local_model):
+    serve_once(tmp_path / 'd.sock', [{'error': "FileNotFoundError: best.pt"}])
+    yolo = client(tmp_path / 'd.sock')
+    assert yolo.sock is None and yolo.backend is local_model
+
+
+def test_lost_daemon_falls_back_mid_print(tmp_path, local_model):
+    serve_once(tmp_path / 'd.sock', [{'names': {'0': 'Overextrusion', '1': 'Underextrusion'}, 'pid': 1}])
+    yolo = client(tmp_path / 'd.sock')
+    assert yolo.sock is not None and yolo.names == NAMES and local_model.calls == 0
+    # The daemon drops the connection on the first frame, the frame is then run here
+    results = yolo.infer(np.zeros((8, 8), np.uint8))
+    assert yolo.sock is None and local_model.calls == 1
+    np.testing.assert_array_equal(results[0].boxes.data, BOX)
+    yolo.close()
+
+
+class DaemonModel:
+    names = NAMES
+
+    def __init__(self):
+        self.seen = []
+
+    def infer(self, image, roi=None, profile=None):
+        self.seen.append((image.copy(), roi, profile))
+        return fake_results(image, NAMES, BOX, speed={'inference': 1.0})
+
+
+def test_frames_reach_the_daemon_through_shared_memory(tmp_path, local_model, monkeypatch):
+    # The daemon normally runs in its own process, here it would unregister the monitor's segments
+    monkeypatch.setattr(inference_daemon.resource_tracker, 'unregister', lambda *args: None)
+    daemon = InferenceDaemon.__new__(InferenceDaemon)
+    daemon.socket_path = tmp_path / 'd.sock'
+    daemon._lock = threading.Lock()
+    # Already holding the model the client's hello asks for
+    daemon._key = inference_daemon.model_key({'daemon': {}})
+    daemon.yolo_inference = DaemonModel()
+    server = threading.Thread(target=daemon.serve_forever, daemon=True)
+    server.start()
+    while not daemon.socket_path.exists():
+        time.sleep(0.001)
+
+    yolo = client(daemon.socket_path)
+    try:
+        assert yolo.sock is not None
+        frame = yolo.frame_buffer((6, 8))
+        frame[...] = np.arange(48, dtype=np.uint8).reshape(6, 8)
+        assert yolo.frames.handle(frame) is not None
+        results = yolo.infer(frame, roi=(1, 2, 5, 6), profile='default')
+        # A frame outside the shared buffers is copied in
+        yolo.infer(np.full((3, 3), 7, np.uint8), profile='default')
+    finally:
+        yolo.close()
+        daemon.shutdown()
+        server.join(5.0)
+
+    (first, roi, profile), (second, _, _) = daemon.yolo_inference.seen
+    np.testing.assert_array_equal(first, np.arange(48).reshape(6, 8))
+    assert roi == (1, 2, 5, 6) and profile == 'default'
+    assert (second == 7).all()
+    # Rebuilt around the monitor's own frame
+    assert results[0].orig_img is frame and local_model.calls == 0
+    np.testing.assert_array_equal(results[0].boxes.data, BOX)
+    assert not daemon.socket_path.exists()
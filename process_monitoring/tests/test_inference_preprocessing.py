@@ -0,0 +1,52 @@
+import numpy as np
+
+from utils.monitoring.detections import remap_boxes
+from utils.monitoring.inference_preprocessing import RoiPreprocessor
+
+
+def bright_box(prepared):
+    ys, xs = np.nonzero(prepared.image[:, :, 0] > 127)
+    return [xs.min(), ys.min(), xs.max() + 1, ys.max() + 1]
+
+
+def test_small_roi_is_cropped_at_full_resolution():
+    frame = np.zeros((1200, 1600), np.uint8)
+    frame[500:540, 700:760] = 255
+    preprocessor = RoiPreprocessor(imgsz=1024, margin=16)
+    prepared = preprocessor.prepare(frame, bbox=(700, 500, 760, 540))
+
+    assert prepared.scale == (1.0, 1.0)
+    height, width = prepared.imgsz
+    assert height % 32 == 0 and width % 32 == 0
+    x0, y0 = prepared.offset
+    # Unscaled, so the model input is the frame itself around the toolpath
+    np.testing.assert_array_equal(prepared.image[:, :, 0], frame[y0:y0 + height, x0:x0 + width])
+    box = bright_box(prepared) + [0.9, 0]
+    np.testing.assert_array_equal(remap_boxes(box, prepared.scale, prepared.offset)[0, :4], [700, 500, 760, 540])
+
+
+def test_downscaled_boxes_map_back_to_the_frame():
+    frame = np.zeros((3000, 4000), np.uint8)
+    frame[800:1200, 1000:1400] = 255
+    prepared = RoiPreprocessor(imgsz=1024).prepare(frame)
+    sx, sy = prepared.scale
+    assert max(prepared.imgsz) == 1024 and sx < 1 and sy < 1
+
+    remapped = remap_boxes(bright_box(prepared) + [0.9, 0], prepared.scale, prepared.offset)[0]
+    np.testing.assert_allclose(remapped[:4], [1000, 800, 1400, 1200], atol=1 / sx + 1)
+    assert tuple(remapped[4:]) == (np.float32(0.9), 0)
+
+
+def test_buffers_are_reused_between_frames():
+    preprocessor = RoiPreprocessor(imgsz=512)
+    first = preprocessor.prepare(np.full((400, 600), 10, np.uint8), bbox=(100, 100, 300, 200))
+    second = preprocessor.prepare(np.full((400, 600), 20, np.uint8))
+    assert np.shares_memory(first.image, preprocessor._rgb)
+    assert np.shares_memory(second.image, preprocessor._rgb)
+    assert (second.image == 20).all()
+
+
+def test_remapped_boxes_are_clipped_to_the_frame():
+    boxes = [[-10, 5, 50, 70, 0.5, 1], [90, 10, 130, 40, 0.8, 0]]
+    remapped = remap_boxes(boxes, (0.5, 0.5), (100, 200), frame_shape=(260, 300))
+    np.testing.assert_array_equal(remapped[:, :4], [[80, 210, 200, 260], [280, 220, 300, 260]])
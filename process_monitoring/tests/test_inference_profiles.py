@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+from utils.monitoring.inference_profiles import InferenceProfiles
+
+PROFILES = [{'name': 'full', 'imgsz': 2048}, {'name': 'reduced', 'imgsz': 1536}, {'name': 'fast', 'imgsz': 1024}]
+
+
+def profiles(window=10, tiling=None, **adaptive):
+    config = {'imgsz': 2048, 'conf': 0.85,
+              'adaptive': {'enabled': True, 'margin': 0.1, 'window': window, 'profiles': PROFILES, **adaptive}}
+    if tiling is not None:
+        config['tiling'] = tiling
+    return InferenceProfiles(config)
+
+
+def test_costs_default_to_pixel_counts():
+    built = profiles()
+    assert [profile.cost for profile in built.profiles] == [1.0, 0.5625, 0.25]
+    assert built.get().name == 'full' and built.get('fast').imgsz == 1024
+    # Without yolo.adaptive there is only the main settings' profile
+    single = InferenceProfiles({'imgsz': 1280, 'conf': 0.5})
+    assert [(p.name, p.imgsz, p.conf) for p in single.profiles] == [('default', 1280, 0.5)]
+    assert single.select(time.perf_counter()) == 'default'
+
+
+def test_most_accurate_profile_that_meets_the_deadline():
+    built = profiles()
+    now = time.perf_counter()
+    # Nothing measured yet, so nothing is known to be too slow
+    assert built.select(now + 0.2) == 'full'
+    built.observe('full', 1.0)
+    assert built.select() == 'full'
+    assert built.select(now + 0.1 + 1.5) == 'full'
+    assert built.select(now + 0.1 + 0.7) == 'reduced'
+    assert built.select(now + 0.1 + 0.3) == 'fast'
+    # Late whatever runs, the fastest profile is late by the least
+    assert built.select(now) == 'fast'
+
+
+def test_slow_layers_at_any_profile_move_every_estimate():
+    built = profiles(window=1)
+    built.observe('full', 1.0)
+    assert built.estimate(built.get('fast')) == pytest.approx(0.25)
+    # A loaded host makes even the fast profile take 0.5 s, so full would now take 2 s
+    built.observe('fast', 0.5)
+    assert built.summary() == pytest.approx({'full': 2.0, 'reduced': 1.125, 'fast': 0.5})
+
+
+def test_tiled_profiles_must_differ_in_more_than_imgsz():
+    with pytest.raises(ValueError):
+        profiles(tiling={'enabled': True, 'tile_size': 1024})
+    tiled = [{'name': 'full', 'imgsz': 2048}, {'name': 'fast', 'imgsz': 1024, 'tiling': False}]
+    built = InferenceProfiles({'imgsz': 2048, 'tiling': {'enabled': True, 'tile_size': 1024, 'overlap': 0.0},
+                               'adaptive': {'enabled': True, 'profiles': tiled, 'calibration_shape': [2048, 3072]}})
+    # Without overlap the tiled profile runs six 1024 tiles over 2048 x 3072, three across and two down
+    assert built.get('fast').cost == pytest.approx(1024 ** 2 / (6 * 1024 ** 2))
+
+
+def test_calibration_replaces_pixel_costs():
+    built = profiles(calibrate=2, calibration_shape=[64, 64])
+    seen = []
+
+    def run(image, profile):
+        seen.append((image.shape, profile.name))
+        time.sleep({'full': 0.02, 'reduced': 0.02, 'fast': 0.01}[profile.name])
+
+    built.calibrate(run)
+    assert len(seen) == 6 and seen[0] == ((64, 64), 'full')
+    assert built.get('reduced').cost == pytest.approx(1.0, rel=0.3)
+    assert built.get('fast').cost == pytest.approx(0.5, rel=0.3)
+
+
+def test_profiles_with_their_own_backend_load_it():
+    adaptive = [{'name': 'full', 'imgsz': 2048}, {'name': 'int8', 'imgsz': 1024, 'backend': {'int8': True}}]
+    config = {'imgsz': 2048, 'backend': {'format': 'onnx', 'threads': 4},
+              'adaptive': {'enabled': True, 'profiles': adaptive}}
+    built = InferenceProfiles(config)
+    built.load_backends(config, lambda backend_config: backend_config)
+    assert built.get('full').backend is None
+    assert built.get('int8').backend['imgsz'] == 1024
+    assert built.get('int8').backend['backend'] == {'format': 'onnx', 'threads': 4, 'int8': True}
@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+
+from utils.monitoring.inference_scheduler import InferenceScheduler
+
+
+class Model:
+    # infer_batch records every batch as its images, which are the requesting cells' names here
+    names = {0: 'Overextrusion'}
+
+    def __init__(self, gate=None, fail=False):
+        self.batches = []
+        self.gate = gate
+        self.fail = fail
+
+    def infer_batch(self, images, rois, profile=None):
+        self.batches.append((list(images), profile))
+        if self.gate is not None:
+            self.gate.wait(5.0)
+            self.gate = None
+        if self.fail:
+            raise RuntimeError("out of memory")
+        return [f"results {image}" for image in images]
+
+
+def submit(scheduler, name, deadline=None, profile=None):
+    return scheduler.submit(name, name, deadline=deadline, profile=profile)
+
+
+def test_waiting_frames_go_out_earliest_deadline_first():
+    gate = threading.Event()
+    model = Model(gate)
+    scheduler = InferenceScheduler(model, max_batch=2, max_wait=0.0)
+    submit(scheduler, 'busy')
+    while not model.batches:
+        time.sleep(0.001)
+    # Queued while the model is busy with the first frame
+    now = time.perf_counter()
+    requests = [submit(scheduler, 'a', now + 10), submit(scheduler, 'b', now + 5), submit(scheduler, 'c'),
+                submit(scheduler, 'd', now + 1)]
+    gate.set()
+    for request in requests:
+        assert request.done.wait(5.0)
+    scheduler.close()
+    assert [images for images, _ in model.batches] == [['busy'], ['d', 'b'], ['a', 'c']]
+    assert requests[0].results == 'results a'
+
+
+def test_full_batch_does_not_wait_for_max_wait():
+    model = Model()
+    scheduler = InferenceScheduler(model, max_batch=3, max_wait=10.0)
+    start = time.perf_counter()
+    requests = [submit(scheduler, name) for name in 'abc']
+    assert all(request.done.wait(5.0) for request in requests)
+    assert time.perf_counter() - start < 1.0
+    scheduler.close()
+    assert [images for images, _ in model.batches] == [['a', 'b', 'c']]
+
+
+def test_deadline_sends_a_partial_batch_early():
+    scheduler = InferenceScheduler(Model(), max_batch=4, max_wait=10.0, safety_margin=0.02)
+    deadline = time.perf_counter() + 0.1
+    request = submit(scheduler, 'a', deadline)
+    assert request.done.wait(5.0)
+    assert time.perf_counter() < deadline
+    scheduler.close()
+
+
+def test_profiles_are_never_mixed_in_a_batch():
+    gate = threading.Event()
+    model = Model(gate)
+    scheduler = InferenceScheduler(model, max_batch=4, max_wait=0.0)
+    submit(scheduler, 'busy')
+    while not model.batches:
+        time.sleep(0.001)
+    now = time.perf_counter()
+    requests = [submit(scheduler, 'a', now + 1, 'fast'), submit(scheduler, 'b', now + 2, 'default'),
+                submit(scheduler, 'c', now + 3, 'fast')]
+    gate.set()
+    assert all(request.done.wait(5.0) for request in requests)
+    scheduler.close()
+    assert model.batches[1:] == [(['a', 'c'], 'fast'), (['b'], 'default')]
+
+
+def test_failure_reaches_every_cell_in_the_batch():
+    scheduler = InferenceScheduler(Model(fail=True), max_batch=2, max_wait=1.0)
+    errors = []
+
+    def cell(name):
+        try:
+            scheduler.cell(name).infer(name)
+        except RuntimeError as exc:
+            errors.append((name, str(exc)))
+
+    threads = [threading.Thread(target=cell, args=(name,)) for name in ('cell_a', 'cell_b')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5.0)
+    scheduler.close()
+    assert sorted(errors) == [('cell_a', 'out of memory'), ('cell_b', 'out of memory')]
+    assert scheduler.batches == 1
+
+
+def test_close_runs_what_was_submitted_then_refuses_more():
+    model = Model()
+    scheduler = InferenceScheduler(model, max_batch=8, max_wait=10.0)
+    requests = [submit(scheduler, name) for name in 'ab']
+    scheduler.close()
+    assert all(request.done.is_set() for request in requests)
+    assert scheduler.frames == 2
+    with pytest.raises(RuntimeError):
+        submit(scheduler, 'c')
+    # Everything but infer is the shared model's
+    assert scheduler.cell('cell_a').names == model.names
@@ -0,0 +1,160 @@
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from utils.monitoring.layer_pipeline import LayerPipeline
+
+
+class Camera:
+    def __init__(self, fail_on=()):
+        self.fail_on = set(fail_on)
+        self.grabs = 0
+
+    def grab_image(self):
+        self.grabs += 1
+        if self.grabs in self.fail_on:
+            raise TimeoutError("no frame")
+        return np.full((8, 8), self.grabs, np.uint8), f"ts_{self.grabs}"
+
+    def apply_mask(self, image, layer, out=None):
+        return image
+
+    def roi(self, layer):
+        return None
+
+    def toolpath_mask(self, layer):
+        return None
+
+
+class Model:
+    names = {0: 'Overextrusion', 1: 'Underextrusion'}
+
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def frame_buffer(self, shape, dtype):
+        return None
+
+    def select_profile(self, deadline=None):
+        return 'default'
+
+    def infer(self, image, roi=None, deadline=None, profile=None):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+        if self.fail:
+            raise RuntimeError("model crashed")
+        return ['clean']
+
+    def process_results(self, results, layer, filename):
+        return {"Layer number": layer, "Number of defects": 0, "Decision": "No defects"}, layer + 1, False, False
+
+
+class Writer:
+    def __init__(self):
+        self.frames = []
+        self.overlays = []
+
+    def path(self, kind, timestamp):
+        return Path(f"image_{timestamp}.bmp")
+
+    def submit_frame(self, kind, timestamp, image, layer=None):
+        self.frames.append((kind, layer))
+
+    def submit_overlay(self, timestamp, results, layer=None):
+        self.overlays.append(layer)
+
+
+def pipeline(camera=None, model=None, **kwargs):
+    decided, persisted = [], []
+    writer = Writer()
+    built = LayerPipeline(camera or Camera(), model or Model(), writer, on_decision=decided.append,
+                          on_persisted=persisted.append, **kwargs)
+    return built, writer, decided, persisted
+
+
+def test_failed_layer_gets_an_error_decision_and_is_persisted():
+    p, writer, decided, persisted = pipeline(Camera(fail_on={2}))
+    jobs = [p.submit(layer) for layer in range(3)]
+    for job in jobs:
+        assert job.wait_for_decision(5.0)
+    p.close()
+
+    failed = jobs[1]
+    assert failed.failed_stage == 'capture'
+    assert failed.rework and not failed.planarize
+    assert failed.next_layer == 1
+    assert failed.defects["Decision"] == "Error in capture stage, rework"
+    assert failed.defects["Error"] == "TimeoutError: no frame"
+    # Every layer reached Mach4 and the persistence stage, in order
+    assert decided == jobs and persisted == jobs
+    assert writer.overlays == [0, 2]
+    assert ('raw', 1) not in writer.frames
+
+
+def test_inference_failure_uses_the_configured_action():
+    p, writer, decided, persisted = pipeline(model=Model(fail=True), on_error_action='none')
+    job = p.submit(4)
+    assert job.wait_for_decision(5.0)
+    p.close()
+    assert job.failed_stage == 'inference'
+    assert not job.rework and not job.planarize
+    assert job.next_layer == 5
+    assert job.defects["Error"] == "RuntimeError: model crashed"
+    assert persisted == [job]
+    # The frames it got as far as are still written
+    assert writer.frames == [('raw', 4), ('masked', 4)] and writer.overlays == []
+
+
+def test_failing_decision_callback_still_decides():
+    def on_decision(job):
+        raise OSError("GPIO gone")
+
+    p = LayerPipeline(Camera(), Model(), Writer(), on_decision=on_decision)
+    job = p.submit(0)
+    assert job.wait_for_decision(5.0)
+    p.close()
+    assert job.defects["Decision"] == "No defects"
+    assert job.defects["Error"] == "OSError: GPIO gone"
+
+
+def test_unknown_error_action_is_rejected():
+    with pytest.raises(ValueError):
+        LayerPipeline(Camera(), Model(), Writer(), on_decision=print, on_error_action='stop')
+
+
+def test_full_queues_hold_back_submit():
+    p, writer, decided, persisted = pipeline(model=Model(delay=0.05), queue_size=1)
+    submitted = []
+    submitter = threading.Thread(target=lambda: submitted.extend(p.submit(layer) for layer in range(12)))
+    submitter.start()
+    time.sleep(0.2)
+    # At most one job per queue and one per stage are in flight while inference is busy
+    assert len(submitted) < 12
+    assert all(depth <= 1 for depth in p.queue_depths().values())
+    submitter.join(5.0)
+    p.close()
+    assert p.yolo_inference.max_running == 1
+    assert [job.layer for job in decided] == list(range(12))
+
+
+def test_close_drains_submitted_layers_and_stops_the_stages():
+    p, writer, decided, persisted = pipeline(model=Model(delay=0.02))
+    jobs = [p.submit(layer) for layer in range(5)]
+    p.close()
+    assert decided == jobs and persisted == jobs
+    assert all(job.decided.is_set() for job in jobs)
+    assert not any(stage.is_alive() for stage in p.stages)
+    with pytest.raises(RuntimeError):
+        p.submit(5)
+    p.close()
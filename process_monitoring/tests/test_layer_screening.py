@@ -0,0 +1,100 @@
+import cv2
+import numpy as np
+import pytest
+
+from utils.data_processing.mask_handler import CroppedMask
+from utils.monitoring.layer_screening import LayerScreener
+
+SHAPE = (600, 800)
+
+
+def toolpath():
+    # Serpentine passes 12 px wide over the middle of the frame, with bed between them
+    mask = np.zeros(SHAPE, np.uint8)
+    for y in range(160, 440, 40):
+        cv2.line(mask, (200, y), (600, y), 255, 12)
+    return CroppedMask.from_mask(mask)
+
+
+def frame(mask, path=150, bed=40, seed=0):
+    rng = np.random.default_rng(seed)
+    image = np.where(mask.to_full() > 0, path, bed) + rng.normal(0, 4, SHAPE)
+    return image.clip(0, 255).astype(np.uint8)
+
+
+@pytest.fixture
+def mask():
+    return toolpath()
+
+
+def screener(**config):
+    return LayerScreener({'scale': 4, 'tile': 8, 'audit_every': 0, 'log_every': 0, **config})
+
+
+@pytest.mark.parametrize('reference', ['toolpath', 'previous', 'both'])
+def test_clean_layers_skip_the_detector(mask, reference):
+    s = screener(reference=reference)
+    for seed in range(3):
+        result = s.screen(frame(mask, seed=seed), mask, seed)
+        assert result.nominal and result.skip, result.stats
+
+
+def test_blank_layer_is_not_nominal(mask):
+    # Nothing printed: the path looks like the bed and no pixel stands out from its region
+    s = screener(reference='toolpath')
+    assert s.screen(frame(mask), mask, 0).skip
+    result = s.screen(frame(mask, path=40, seed=1), mask, 1)
+    assert not result.nominal
+    assert abs(result.stats["Contrast"]) < 5
+    assert result.stats["Outlier fraction"] == 0.0
+
+
+def test_even_underextrusion_is_not_nominal(mask):
+    s = screener(reference='toolpath')
+    assert s.screen(frame(mask), mask, 0).skip
+    result = s.screen(frame(mask, path=90, seed=1), mask, 1)
+    assert not result.nominal
+    assert result.stats["Contrast change"] == pytest.approx(-0.55, abs=0.05)
+
+
+def test_clean_detector_result_resets_the_contrast_reference(mask):
+    s = screener(reference='toolpath')
+    s.screen(frame(mask), mask, 0)
+    # Another material, darker but as confirmed by the detector
+    result = s.screen(frame(mask, path=90, seed=1), mask, 1)
+    s.review(result, {"Layer number": 1, "Number of defects": 0})
+    assert s.screen(frame(mask, path=90, seed=2), mask, 2).skip
+
+
+def test_local_defect_is_cropped_to(mask):
+    s = screener(reference='both', crop_to_suspicious=True, margin=16)
+    s.screen(frame(mask), mask, 0)
+    image = frame(mask, seed=1)
+    cv2.circle(image, (400, 280), 14, 255, -1)
+    result = s.screen(image, mask, 1)
+    assert not result.nominal
+    x0, y0, x1, y1 = result.roi
+    assert x0 <= 386 and x1 >= 414 and y0 <= 266 and y1 >= 294
+    assert x1 - x0 < 200 and y1 - y0 < 200
+
+
+def test_off_path_blob_is_seen_on_the_raw_frame(mask):
+    s = screener(reference='toolpath')
+    image = frame(mask)
+    cv2.circle(image, (400, 180), 6, 255, -1)  # on the bed between two passes
+    assert not s.screen(image, mask, 0).nominal
+
+
+def test_previous_layer_compared_over_a_moved_box(mask):
+    s = screener(reference='previous', min_contrast=0)
+    s.screen(frame(mask), mask, 0)
+    # The next layer's toolpath box is one pixel larger, the unchanged part is still compared
+    grown = np.zeros(SHAPE, np.uint8)
+    grown[mask.bbox[1]:mask.bbox[3], mask.bbox[0]:mask.bbox[2]] = mask.unpack()
+    grown[mask.bbox[3], 300] = 255
+    moved = CroppedMask.from_mask(grown)
+    image = frame(moved, seed=1)
+    image[250:300, 300:340] = np.where(moved.to_full()[250:300, 300:340] > 0, 230, image[250:300, 300:340])
+    result = s.screen(image, moved, 1)
+    assert "Max tile change" in result.stats
+    assert not result.nominal
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import generate_gcode, FRAME_WIDTH, FRAME_HEIGHT
+from utils.data_processing.gcode_parser import ColumnarGCodeParser
+from utils.data_processing.mask_cache import MaskCache
+from utils.data_processing.mask_handler import MaskHandler
+
+
+@pytest.fixture(scope='module')
+def part(tmp_path_factory):
+    path = tmp_path_factory.mktemp('gcode') / 'part.gcode'
+    path.write_text(generate_gcode(layers=3, moves_per_layer=300, size_mm=20))
+    parser = ColumnarGCodeParser()
+    parser.parse_file(path)
+    return path, parser.get_layers()
+
+
+def cached_handler(part, cache, pix_per_mm=56):
+    path, layers = part
+    handler = MaskHandler(layers, FRAME_WIDTH, FRAME_HEIGHT, pix_per_mm, mask_cache=cache, source=path)
+    handler.generate_masks()
+    return handler
+
+
+def test_cold_build_matches_lazy_masks_and_warm_start_skips_it(part, tmp_path, monkeypatch):
+    path, layers = part
+    lazy = MaskHandler(layers, FRAME_WIDTH, FRAME_HEIGHT, 56)
+    lazy.generate_masks()
+    cold = cached_handler(part, MaskCache(tmp_path, workers=2))
+    assert len(list(tmp_path.iterdir())) == 1
+    for layer in layers:
+        np.testing.assert_array_equal(cold.get_mask(layer).to_full(), lazy.get_mask(layer).to_full())
+
+    # A fresh cache, as after a restart, maps the entry instead of rasterizing again
+    monkeypatch.setattr(MaskCache, 'build', lambda *args: pytest.fail("warm start rebuilt the masks"))
+    warm = cached_handler(part, MaskCache(tmp_path))
+    for layer in layers:
+        assert isinstance(warm.mask_manager.persistent_masks[layer].packed, np.memmap)
+        np.testing.assert_array_equal(warm.get_mask(layer).to_full(), lazy.get_mask(layer).to_full())
+    for handler in (lazy, cold, warm):
+        handler.close()
+
+
+def test_key_follows_file_bytes_and_calibration(part, tmp_path):
+    path, layers = part
+    key = MaskCache.make_key(layers, 56, FRAME_WIDTH, FRAME_HEIGHT, 1.3, path)
+    assert MaskCache.make_key(layers, 56, FRAME_WIDTH, FRAME_HEIGHT, 1.3, path) == key
+    assert MaskCache.make_key(layers, 57, FRAME_WIDTH, FRAME_HEIGHT, 1.3, path) != key
+    assert MaskCache.make_key(layers, 56, FRAME_WIDTH, FRAME_HEIGHT, 1.5, path) != key
+    assert MaskCache.make_key(layers, 56, FRAME_WIDTH // 2, FRAME_HEIGHT, 1.3, path) != key
+    edited = tmp_path / 'part.gcode'
+    edited.write_bytes(path.read_bytes() + b"; edited\n")
+    assert MaskCache.make_key(layers, 56, FRAME_WIDTH, FRAME_HEIGHT, 1.3, edited) != key
+
+    # A recalibrated camera gets its own entry next to the old one
+    cache = MaskCache(tmp_path / 'cache', workers=1)
+    cached_handler(part, cache).close()
+    cached_handler(part, cache, pix_per_mm=50).close()
+    assert len(list((tmp_path / 'cache').iterdir())) == 2
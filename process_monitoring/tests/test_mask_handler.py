@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import generate_gcode, FRAME_WIDTH, FRAME_HEIGHT
+from utils.data_processing.gcode_parser import ColumnarGCodeParser
+from utils.data_processing.mask_handler import CoordinateTransformer, MaskGenerator, MaskApplicator, MaskHandler
+
+
+@pytest.fixture(scope='module')
+def layers(tmp_path_factory):
+    path = tmp_path_factory.mktemp('gcode') / 'part.gcode'
+    path.write_text(generate_gcode(layers=3, moves_per_layer=300, size_mm=20))
+    parser = ColumnarGCodeParser()
+    parser.parse_file(path)
+    return parser.get_layers()
+
+
+@pytest.fixture(scope='module')
+def handler(layers):
+    handler = MaskHandler(layers, FRAME_WIDTH, FRAME_HEIGHT, 56)
+    handler.generate_masks()
+    yield handler
+    handler.close()
+
+
+def reference_mask(handler, layer, thickness=1.3):
+    manager = handler.mask_manager
+    coordinates = manager._extract_coordinates_with_travel(manager.parsed_gcode[layer])
+    return MaskGenerator(handler.transformer, FRAME_WIDTH, FRAME_HEIGHT).generate_mask(coordinates, thickness)
+
+
+def test_cropped_mask_matches_full_frame_mask(layers, handler):
+    for layer in layers:
+        mask = handler.get_mask(layer)
+        full = reference_mask(handler, layer)
+        np.testing.assert_array_equal(mask.to_full(), full)
+        # The bounding box is tight around the toolpath
+        ys, xs = np.nonzero(full)
+        assert mask.bbox == (xs.min(), ys.min(), xs.max() + 1, ys.max() + 1)
+
+
+def test_cropped_apply_matches_full_frame_apply(layers, handler):
+    rng = np.random.default_rng(0)
+    image = rng.integers(20, 200, (FRAME_HEIGHT, FRAME_WIDTH), dtype=np.uint8)
+    applicator = MaskApplicator()
+    for layer in layers:
+        expected = MaskApplicator.apply_mask(image, reference_mask(handler, layer))
+        np.testing.assert_array_equal(applicator.apply(image, handler.get_mask(layer)), expected)
+        np.testing.assert_array_equal(handler.apply_mask_to_image(image, layer), expected)
+
+
+def test_toolpath_off_frame_gives_empty_mask():
+    transformer = CoordinateTransformer(56, 640, 480)
+    mask = MaskGenerator(transformer, 640, 480).generate_cropped_mask({'X': [500.0, 510.0], 'Y': [500.0, 500.0]}, 1.3)
+    assert mask.is_empty()
+    assert not mask.to_full().any()
+
+
+def square_mask(x0, y0, x1, y1, shape=(120, 160)):
+    mask = np.zeros(shape, np.uint8)
+    mask[y0:y1, x0:x1] = 255
+    return mask
+
+
+@pytest.mark.parametrize('alpha', [0.1, 0.5, 0.9])
+def test_fused_apply_matches_apply_mask(alpha):
+    image = np.random.default_rng(1).integers(30, 220, (120, 160), dtype=np.uint8)
+    mask = square_mask(20, 30, 90, 70)
+    expected = MaskApplicator.apply_mask(image, mask, alpha)
+    applicator = MaskApplicator()
+    np.testing.assert_array_equal(applicator.apply(image, mask, alpha), expected)
+    # A caller's buffer is cleared of whatever it held before
+    out = np.full_like(image, 77)
+    assert applicator.apply(image, mask, alpha, out=out) is out
+    np.testing.assert_array_equal(out, expected)
+    # A flat frame has nothing to normalise
+    flat = np.full_like(image, 90)
+    np.testing.assert_array_equal(applicator.apply(flat, mask, alpha), MaskApplicator.apply_mask(flat, mask, alpha))
+
+
+def test_pooled_buffer_is_reused_once_released():
+    image = np.random.default_rng(2).integers(30, 220, (120, 160), dtype=np.uint8)
+    first_mask, second_mask = square_mask(10, 10, 60, 50), square_mask(100, 60, 150, 110)
+    applicator = MaskApplicator(max_buffers=2)
+    first = applicator.apply(image, first_mask)
+    held = applicator.apply(image, second_mask)
+    assert not np.shares_memory(first, held)
+    address = first.ctypes.data
+    del first
+    # The released buffer comes back with the first mask's box cleared
+    reused = applicator.apply(image, second_mask)
+    assert reused.ctypes.data == address
+    np.testing.assert_array_equal(reused, MaskApplicator.apply_mask(image, second_mask))
+    # Past max_buffers every result is still correct, just not pooled
+    extra = applicator.apply(image, first_mask)
+    assert len(applicator.pool) == 2
+    np.testing.assert_array_equal(extra, MaskApplicator.apply_mask(image, first_mask))
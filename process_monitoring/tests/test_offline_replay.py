@@ -0,0 +1,92 @@
+import json
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+from utils.data_processing.defect_journal import DefectJournal
+from utils.monitoring import offline_replay
+from utils.monitoring.offline_replay import FileCameraSource, BatchReplay
+
+# Capture times out of name order, 59 s past the minute sorts before 05 of the next one
+STAMPS = ['17_10_26_10_00_59', '17_10_26_10_01_05', '17_10_26_09_59_30']
+
+
+@pytest.fixture
+def print_dir(tmp_path):
+    camera = tmp_path / 'Camera'
+    camera.mkdir()
+    for i, stamp in enumerate(STAMPS):
+        cv2.imwrite(str(camera / f"image_{stamp}.bmp"), np.full((8, 8), i, np.uint8))
+        cv2.imwrite(str(camera / f"mask_image_{stamp}.bmp"), np.zeros((8, 8), np.uint8))
+        cv2.imwrite(str(camera / f"image_{stamp}_predictions.jpeg"), np.zeros((8, 8, 3), np.uint8))
+    return tmp_path
+
+
+def report(layers):
+    return [{"Timestamp": f"image_{stamp}.bmp", "Layer number": layer} for stamp, layer in layers]
+
+
+def test_frames_come_in_capture_order_with_their_report_layers(print_dir):
+    # Layer 4 was retaken after a rework, the frame of 09:59:30 is not in the report
+    (print_dir / 'bracket_defects.json').write_text(json.dumps(report([(STAMPS[0], 4), (STAMPS[1], 4)])))
+    source = FileCameraSource(print_dir)
+    assert source.part_name == 'bracket'
+    assert [(frame.timestamp, frame.layer) for frame in source] == [(STAMPS[0], 4), (STAMPS[1], 4)]
+    image, timestamp = source.grab_image()
+    assert timestamp == STAMPS[0] and (image == 0).all() and image.ndim == 2
+
+
+def test_journal_is_used_when_the_print_did_not_finish(print_dir):
+    journal = DefectJournal(print_dir / 'bracket_defects.jsonl')
+    for record in report([(STAMPS[2], 0), (STAMPS[0], 1), (STAMPS[1], 2)]):
+        journal.append(record)
+    journal.close()
+    assert [frame.layer for frame in FileCameraSource(print_dir)] == [0, 1, 2]
+
+
+def test_without_a_report_frames_are_numbered_from_start_layer(print_dir):
+    source = FileCameraSource(print_dir, start_layer=10)
+    assert source.part_name == print_dir.name
+    assert [(frame.timestamp, frame.layer) for frame in source] == [(STAMPS[2], 10), (STAMPS[0], 11), (STAMPS[1], 12)]
+    for _ in range(3):
+        source.grab_image()
+    with pytest.raises(StopIteration):
+        source.grab_image()
+
+
+class Worker:
+    # Stands in for ReplayWorker, which loads the detector
+    batches = []
+
+    def __init__(self, config, output_path):
+        self.config = config
+
+    def process(self, frames, toolpath=None):
+        Worker.batches.append(len(frames))
+        return [{"Timestamp": Path(path).name, "Layer number": layer} for path, layer in frames]
+
+    def close(self):
+        pass
+
+
+def test_replay_batches_frames_and_writes_records_in_order(print_dir, monkeypatch):
+    monkeypatch.setattr(offline_replay, 'ReplayWorker', Worker)
+    Worker.batches = []
+    with BatchReplay({'yolo': {}}, workers=0, batch_size=2) as replay:
+        output, records = replay.replay(print_dir, start_layer=5)
+    assert Worker.batches == [2, 1]
+    assert output == print_dir / f"{print_dir.name}_defects_replay.json"
+    assert json.loads(output.read_text()) == records
+    assert [record["Layer number"] for record in records] == [5, 6, 7]
+    assert records[0]["Timestamp"] == f"image_{STAMPS[2]}.bmp"
+    # A replay report is never taken for the print's own
+    assert FileCameraSource(print_dir).layer_map == {}
+
+
+def test_model_threads_are_split_between_workers(monkeypatch):
+    monkeypatch.setattr(offline_replay.os, 'cpu_count', lambda: 8)
+    assert BatchReplay({'yolo': {}}, workers=4).config['yolo']['backend']['threads'] == 2
+    assert BatchReplay({'yolo': {'backend': {'threads': 3}}}, workers=4).config['yolo']['backend']['threads'] == 3
+    assert 'threads' not in BatchReplay({'yolo': {}}, workers=1).config['yolo']['backend']
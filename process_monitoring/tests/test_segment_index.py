@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from utils.data_processing.mask_handler import CoordinateTransformer
+from utils.data_processing.segment_index import SegmentIndex, ToolpathIndex
+
+# Two passes on layer 1 at frame rows 150 (line 5) and 180 (line 7), one vertical pass on
+# layer 2 down frame column 200 (line 12), at 10 px/mm on a 400 x 300 frame
+GCODE = """;Layer 1 of 2
+G55
+G0 Z0.100 F600
+G0 X-5 Y0 F3000
+G1 X5 Y0 A0.1 F1200
+G0 X-5 Y3 F3000
+G1 X5 Y3 A0.1 F1200
+;Layer 2 of 2
+G58
+G0 Z0.200 F600
+G0 X0 Y-5 F3000
+G1 X0 Y5 B0.1 F1200
+M30
+"""
+
+
+@pytest.fixture
+def gcode_file(tmp_path):
+    path = tmp_path / 'part.gcode'
+    path.write_text(GCODE)
+    return path
+
+
+def record(layer, *boxes):
+    return {"Layer number": layer, "Defect data": [{"Defect coordinates": list(box)} for box in boxes]}
+
+
+def test_defects_are_mapped_to_segments_and_lines(gcode_file):
+    index = ToolpathIndex(gcode_file, CoordinateTransformer(10, 400, 300))
+    annotated = index.annotate(record(0, (190, 140, 210, 160), (190, 140, 210, 185), (190, 155, 210, 160),
+                                      (190, 160, 210, 165), (10, 10, 20, 20)))
+    assert annotated["G-code layer"] == 1
+    hits = [(d["Segments"], d["G-code lines"]) for d in annotated["Defect data"]]
+    # The third box only touches the 6.5 px half-width of the line at row 150
+    assert hits == [([2], [5]), ([2, 4], [5, 7]), ([2], [5]), ([], []), ([], [])]
+
+
+def test_monitor_layers_follow_the_layer_offset(gcode_file):
+    transformer = CoordinateTransformer(10, 400, 300)
+    annotated = ToolpathIndex(gcode_file, transformer).annotate(record(1, (195, 120, 205, 130)))
+    assert annotated["G-code layer"] == 2 and annotated["Defect data"][0]["G-code lines"] == [12]
+    annotated = ToolpathIndex(gcode_file, transformer, layer_offset=0).annotate(record(1, (190, 140, 210, 160)))
+    assert annotated["G-code layer"] == 1 and annotated["Defect data"][0]["G-code lines"] == [5]
+    # Past the end of the toolpath the record is left as it was
+    annotated = ToolpathIndex(gcode_file, transformer).annotate(record(5, (190, 140, 210, 160)))
+    assert annotated["G-code layer"] == 6 and "Segments" not in annotated["Defect data"][0]
+
+
+def test_grid_query_matches_a_brute_force_scan():
+    rng = np.random.default_rng(4)
+    n = 500
+    x0, y0 = rng.uniform(0, 1000, n), rng.uniform(0, 800, n)
+    x1, y1 = x0 + rng.normal(0, 60, n), y0 + rng.normal(0, 60, n)
+    index = SegmentIndex(x0, y0, x1, y1, np.arange(n), np.arange(n) + 100, (800, 1000), cell_size=64, radius=3.0)
+    everything = np.arange(n)
+    for _ in range(50):
+        bx, by = rng.uniform(0, 1000), rng.uniform(0, 800)
+        box = (bx, by, bx + rng.uniform(1, 120), by + rng.uniform(1, 120))
+        segment_ids, lines = index.query(box)
+        expected = everything[index._clip(everything, box[0] - 3.0, box[1] - 3.0, box[2] + 3.0, box[3] + 3.0)]
+        np.testing.assert_array_equal(segment_ids, expected)
+        np.testing.assert_array_equal(lines, expected + 100)
@@ -0,0 +1,133 @@
+import os
+import select
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from utils.monitoring.sensor_ingest import SensorRingBuffer, SensorIngest
+from utils import simulation
+from utils.simulation import SimulatedArduino
+
+
+def test_ring_buffer_window_before_wrap():
+    buffer = SensorRingBuffer(['Pressure'], capacity=8)
+    buffer.extend([1.0, 2.0, 3.0], [[10.0], [20.0], [30.0]])
+    times, values, truncated = buffer.window(1.0, 3.0)
+    np.testing.assert_array_equal(times, [2.0, 3.0])
+    np.testing.assert_array_equal(values[:, 0], [20.0, 30.0])
+    assert not truncated
+    np.testing.assert_array_equal(buffer.latest(), [30.0])
+
+
+def test_ring_buffer_wraps_in_time_order():
+    buffer = SensorRingBuffer(['Pressure', 'Laser'], capacity=8)
+    for start in range(0, 20, 3):
+        times = np.arange(start, start + 3, dtype=float)
+        buffer.extend(times, np.column_stack([times * 10, -times]))
+    # 21 samples written, the last 8 (t = 13..20) are kept
+    times, values, truncated = buffer.window(10.0, 20.0)
+    np.testing.assert_array_equal(times, np.arange(13, 21))
+    np.testing.assert_array_equal(values[:, 0], np.arange(13, 21) * 10)
+    np.testing.assert_array_equal(values[:, 1], -np.arange(13, 21))
+    assert truncated
+    times, _, truncated = buffer.window(15.0, 18.0)
+    np.testing.assert_array_equal(times, [16.0, 17.0, 18.0])
+    assert not truncated
+
+
+def test_ring_buffer_keeps_the_newest_of_an_oversized_batch():
+    buffer = SensorRingBuffer(['Pressure'], capacity=4)
+    buffer.extend(np.arange(10.0), np.arange(10.0)[:, None])
+    times, values, _ = buffer.window(-1.0, 100.0)
+    np.testing.assert_array_equal(times, [6.0, 7.0, 8.0, 9.0])
+    np.testing.assert_array_equal(values[:, 0], [6.0, 7.0, 8.0, 9.0])
+
+
+class PtyPort:
+    # The parts of serial.Serial SensorIngest uses, on the simulated Arduino's pseudo-terminal
+    def __init__(self, port, baud, timeout):
+        self.fd = os.open(port, os.O_RDONLY | os.O_NOCTTY)
+        self.timeout = timeout
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def read(self, size):
+        ready, _, _ = select.select([self.fd], [], [], self.timeout)
+        return os.read(self.fd, 4096) if ready else b''
+
+    def close(self):
+        os.close(self.fd)
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="SimulatedArduino needs a pseudo-terminal")
+def test_ingest_from_simulated_arduino():
+    arduino = SimulatedArduino(lambda t: (50.0 if t < 0.2 else 95.0, 1), rate=500.0)
+    sensors = SensorIngest(
+        {'port': arduino.port, 'bands': {'Pressure': [20.0, 80.0]}, 'capacity': 4096}, serial_factory=PtyPort
+    )
+    try:
+        assert sensors.wait_connected(2.0)
+        arduino.start()
+        arduino.write("garbage\n")
+        time.sleep(0.5)
+        record = sensors.layer_aggregates()
+    finally:
+        sensors.close()
+        arduino.close()
+    assert record["Samples"] > 100
+    assert record["Parse errors"] == 1
+    assert record["Pressure"]["Min"] == 50.0 and record["Pressure"]["Max"] == 95.0
+    assert 0 < record["Pressure"]["Out of band"] < record["Samples"]
+    assert record["Laser"]["Mean"] == 1.0
+    assert not record["Truncated"]
+
+
+def test_failed_port_is_retried():
+    opened = []
+
+    def factory(port, baud, timeout):
+        opened.append(port)
+        raise OSError("unplugged")
+
+    sensors = SensorIngest({'port': '/dev/null-arduino', 'reconnect': 0.01}, serial_factory=factory)
+    try:
+        deadline = time.monotonic() + 2.0
+        while len(opened) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        sensors.close()
+    assert len(opened) >= 3
+    assert not sensors.wait_connected(0)
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="SimulatedArduino needs a pseudo-terminal")
+def test_partial_pty_writes_keep_lines_whole(monkeypatch):
+    arduino = SimulatedArduino(lambda t: (0.0, 0))
+    real_write = os.write
+    calls = []
+
+    def short_write(fd, data):
+        # At most 5 bytes per call, and every other call finds the buffer full
+        calls.append(len(data))
+        if len(calls) % 2 == 0:
+            raise BlockingIOError
+        return real_write(fd, bytes(data[:5]))
+
+    try:
+        monkeypatch.setattr(simulation.os, 'write', short_write)
+        arduino.write("12.5,1\n13.0,0\n", lines=2)
+        assert (arduino.written, arduino.dropped) == (2, 0)
+        # Full from the first call on, the batch is dropped without a byte of it going out
+        arduino.write("14.0,1\n")
+        assert (arduino.written, arduino.dropped) == (2, 1)
+        monkeypatch.undo()
+        received = b''
+        while select.select([arduino.slave], [], [], 0.1)[0]:
+            received += os.read(arduino.slave, 4096)
+    finally:
+        arduino.close()
+    assert received == b"12.5,1\n13.0,0\n"
@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+from utils.startup import StartupOrchestrator
+
+
+def slow(value, delay=0.2):
+    def factory(**dependencies):
+        time.sleep(delay)
+        return value
+    return factory
+
+
+def test_independent_components_start_in_parallel():
+    startup = StartupOrchestrator()
+    for name in ('camera', 'model', 'masks'):
+        startup.add(name, slow(name))
+    start = time.perf_counter()
+    startup.start()
+    assert startup.wait_all(5.0) == {}
+    assert time.perf_counter() - start < 0.5
+    assert startup.get('model') == 'model'
+    assert set(startup.timings) == {'camera', 'model', 'masks'}
+
+
+def test_dependencies_are_passed_in_and_timed_separately():
+    startup = StartupOrchestrator()
+    startup.add('pipeline', lambda camera, model: (camera, model), requires=('camera', 'model'))
+    startup.add('camera', slow('cam'))
+    startup.add('model', slow('yolo'))
+    startup.start()
+    assert startup.get('pipeline', timeout=5.0) == ('cam', 'yolo')
+    # The wait for camera and model is not counted against the pipeline
+    assert startup.timings['pipeline'] < 0.1
+
+
+def test_failure_reaches_dependents_and_the_caller():
+    startup = StartupOrchestrator()
+    error = OSError("camera not found")
+
+    def camera():
+        raise error
+
+    startup.add('camera', camera)
+    startup.add('pipeline', lambda camera: camera, requires=('camera',))
+    startup.add('model', slow('yolo', 0.0))
+    startup.start()
+    assert startup.wait_all(5.0) == {'camera': error, 'pipeline': error}
+    with pytest.raises(OSError):
+        startup.get('pipeline')
+    assert startup.peek('camera') is None and startup.peek('model') == 'yolo'
+    assert "camera          failed: camera not found" in startup.report()
+
+
+def test_get_only_waits_for_what_it_asks_for():
+    release = threading.Event()
+    startup = StartupOrchestrator()
+    startup.add('database', lambda: release.wait(5.0))
+    startup.add('gpio', slow('gpio', 0.0))
+    startup.start()
+    assert startup.get('gpio', timeout=1.0) == 'gpio'
+    assert not startup.is_ready('database')
+    with pytest.raises(TimeoutError):
+        startup.get('database', timeout=0.05)
+    release.set()
+    assert startup.get('database', timeout=5.0) is True
+    with pytest.raises(RuntimeError):
+        startup.add('late', slow('late'))
+
+
+def test_sequential_start_builds_in_order():
+    order = []
+    startup = StartupOrchestrator(parallel=False)
+    for name in ('camera', 'model'):
+        startup.add(name, lambda name=name: order.append(name) or name)
+    startup.start()
+    assert order == ['camera', 'model']
+    assert all(startup.is_ready(name) for name in order)
@@ -0,0 +1,57 @@
+import json
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from utils.telemetry import Telemetry, MetricsServer
+
+
+@pytest.fixture
+def server():
+    telemetry = Telemetry()
+    server = MetricsServer(telemetry, port=0)
+    yield telemetry, f"http://127.0.0.1:{server.server.server_port}"
+    server.close()
+
+
+def post(url):
+    with urlopen(Request(url, method='POST'), timeout=5) as response:
+        return response.status
+
+
+@pytest.mark.parametrize('query', ['layers=abc', 'layers=-3', 'layers=1.5', 'layers='])
+def test_bad_profile_requests_are_rejected(server, query):
+    telemetry, base = server
+    with pytest.raises(HTTPError) as error:
+        post(f"{base}/profile?{query}")
+    assert error.value.code == 400
+    assert not telemetry.claim_profile()
+
+
+def test_profile_request_profiles_that_many_layers(server):
+    telemetry, base = server
+    assert post(f"{base}/profile?layers=2") == 200
+    assert [telemetry.claim_profile() for _ in range(3)] == [True, True, False]
+    # Without a count one layer is profiled, and 0 cancels
+    assert post(f"{base}/profile") == 200
+    assert post(f"{base}/profile?layers=0") == 200
+    assert not telemetry.claim_profile()
+
+
+def test_metrics_and_layers(server):
+    telemetry, base = server
+    telemetry.observe('inference', 0.003, model='yolo')
+    telemetry.observe('inference', 0.2, model='yolo')
+    telemetry.increment('stage_errors', stage='capture')
+    telemetry.record_layer({"Layer number": 4, "inference": 0.2})
+
+    with urlopen(f"{base}/metrics", timeout=5) as response:
+        text = response.read().decode()
+    assert 'champ_inference_seconds_bucket{model="yolo",le="0.005"} 1' in text
+    assert 'champ_inference_seconds_bucket{model="yolo",le="+Inf"} 2' in text
+    assert 'champ_inference_seconds_count{model="yolo"} 2' in text
+    assert 'champ_stage_errors{stage="capture"} 1' in text
+
+    with urlopen(f"{base}/layers", timeout=5) as response:
+        assert json.loads(response.read()) == [{"Layer number": 4, "inference": 0.2}]
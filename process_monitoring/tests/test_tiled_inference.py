@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from utils.monitoring.tiled_inference import TiledInference, merge_boxes, tile_grid
+
+
+def test_tile_grid_covers_the_frame():
+    width, height, tile = 1000, 700, 256
+    covered = np.zeros((height, width), bool)
+    for x0, y0, x1, y1 in tile_grid(width, height, tile, 0.2):
+        assert 0 <= x0 < x1 <= width and 0 <= y0 < y1 <= height
+        assert (x1 - x0, y1 - y0) == (tile, tile)
+        covered[y0:y1, x0:x1] = True
+    assert covered.all()
+    assert tile_grid(200, 100, tile, 0.2) == [(0, 0, 200, 100)]
+
+
+def test_nms_keeps_the_most_confident_box_per_class():
+    boxes = [
+        [10, 10, 50, 50, 0.6, 0],
+        [12, 10, 52, 50, 0.9, 0],
+        [10, 10, 50, 50, 0.7, 1],  # same place, other class
+        [200, 200, 240, 240, 0.5, 0],
+    ]
+    merged = merge_boxes(boxes, threshold=0.5, metric='iou', method='nms')
+    np.testing.assert_array_equal(merged, np.float32([boxes[1], boxes[2], boxes[3]]))
+
+
+def test_wbf_averages_the_cluster_by_confidence():
+    merged = merge_boxes([[0, 0, 40, 40, 0.75, 0], [10, 0, 50, 40, 0.25, 0]], threshold=0.5, method='wbf')
+    np.testing.assert_allclose(merged, [[2.5, 0, 42.5, 40, 0.75, 0]])
+
+
+def test_ios_merges_a_box_cut_by_a_tile_edge():
+    whole, cut = [240, 100, 280, 130, 0.9, 0], [240, 100, 256, 130, 0.4, 0]
+    assert len(merge_boxes([whole, cut], metric='iou')) == 2
+    np.testing.assert_array_equal(merge_boxes([whole, cut], metric='ios'), np.float32([whole]))
+
+
+def blob_detector(calls):
+    # Every bright blob in a tile is a detection, more confident the more of it is visible
+    def predict_batch(tiles):
+        calls.append(len(tiles))
+        results = []
+        for tile in tiles:
+            count, _, stats, _ = cv2.connectedComponentsWithStats((tile[:, :, 0] > 127).astype(np.uint8))
+            data = [[x, y, x + w, y + h, min(1.0, area / 1600), 0] for x, y, w, h, area in stats[1:count]]
+            results.append(SimpleNamespace(boxes=SimpleNamespace(data=np.float32(data).reshape(-1, 6))))
+        return results
+    return predict_batch
+
+
+def test_tiled_predict_finds_each_blob_once_in_frame_coordinates():
+    frame = np.zeros((512, 512), np.uint8)
+    frame[100:140, 230:270] = 255  # across the edge of the first tile
+    frame[400:420, 20:40] = 255
+    calls = []
+    tiled = TiledInference(blob_detector(calls), tile_size=256, overlap=0.25, batch_size=4)
+    boxes = tiled.predict(frame)
+    # Nine tiles in batches of four
+    assert calls == [4, 4, 1]
+    np.testing.assert_array_equal(boxes[np.argsort(boxes[:, 0]), :4], [[20, 400, 40, 420], [230, 100, 270, 140]])
@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from utils.monitoring.yolo_inference import YOLOInference
+
+NAMES = {0: 'Overextrusion', 1: 'Underextrusion'}
+
+
+def results(data):
+    return [SimpleNamespace(boxes=SimpleNamespace(data=np.asarray(data, np.float32).reshape(-1, 6)), speed={})]
+
+
+def inference(config=None):
+    # Everything but the model, like InferenceClient
+    yolo = YOLOInference.__new__(YOLOInference)
+    yolo._configure(config or {}, NAMES)
+    return yolo
+
+
+def test_summarize_defects():
+    data = [[10.4, 20.6, 50.0, 41.0, 0.912, 0], [0, 0, 30, 0, 0.5, 1], [5, 5, 15, 25, 0.876, 1]]
+    summary = inference().summarize_defects(results(data), 7, 'image_1.bmp', '')
+    assert summary["Layer number"] == 7
+    assert summary["Number of defects"] == 3
+    assert (summary["Overextrusions"], summary["Underextrusions"]) == (1, 2)
+    first, flat, last = summary["Defect data"]
+    assert first == {"Class": 'Overextrusion', "Confidence": 0.91, "Defect coordinates": [10, 21, 50, 41],
+                     "Box area (px)": 800, "Box aspect ratio": 2.0}
+    assert flat["Box aspect ratio"] is None  # zero height
+    assert last["Box aspect ratio"] == 0.5
+
+
+def test_empty_results_summarize_to_no_defects():
+    summary = inference().summarize_defects(results(np.zeros((0, 6))), 0, 'image_0.bmp', '')
+    assert summary["Number of defects"] == 0 and summary["Defect data"] == []
+
+
+@pytest.mark.parametrize('classes,decision,planarize,rework,next_layer', [
+    ([], 'No defects', False, False, 4),
+    ([0, 0], 'Overextrusions, planarize layer', True, False, 3),
+    ([0, 1], 'Underextrusions, remove and reprint layer', False, True, 3),
+])
+def test_process_results_decisions(classes, decision, planarize, rework, next_layer):
+    data = [[0, 0, 10, 10, 0.9, c] for c in classes]
+    defects, layer, do_planarize, do_rework = inference().process_results(results(data), 3, 'image.bmp')
+    assert defects["Decision"] == decision
+    assert (do_planarize, do_rework, layer) == (planarize, rework, next_layer)
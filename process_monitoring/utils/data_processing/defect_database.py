@@ -0,0 +1,283 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime as dt
+from pathlib import Path
+
+import numpy as np
+
+from utils.data_processing.gcode_parser import ColumnarGCodeParser
+
+# One SQLite file for every print on the host, so questions across prints are an indexed
+# query instead of a scan over all <part_name>_defects.json reports:
+#   prints     one row per print, keyed by the path of its JSON report
+#   layers     one row per inspected layer attempt, with the defect counts, Z height and the full record
+#   defects    one row per detection
+#   decisions  what the layer led to: planarize, rework or none
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prints (
+    id INTEGER PRIMARY KEY,
+    part_name TEXT NOT NULL,
+    report TEXT NOT NULL UNIQUE,
+    started TEXT,
+    source TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS prints_started ON prints (started);
+CREATE INDEX IF NOT EXISTS prints_part ON prints (part_name, started);
+
+CREATE TABLE IF NOT EXISTS layers (
+    id INTEGER PRIMARY KEY,
+    print_id INTEGER NOT NULL REFERENCES prints (id),
+    layer INTEGER NOT NULL,
+    attempt INTEGER NOT NULL,
+    z REAL,
+    timestamp TEXT,
+    defects INTEGER NOT NULL,
+    overextrusions INTEGER NOT NULL,
+    underextrusions INTEGER NOT NULL,
+    trigger_ms REAL,
+    inference_profile TEXT,
+    deadline_met INTEGER,
+    record TEXT
+);
+CREATE INDEX IF NOT EXISTS layers_print ON layers (print_id, layer);
+CREATE INDEX IF NOT EXISTS layers_z ON layers (z);
+
+CREATE TABLE IF NOT EXISTS defects (
+    id INTEGER PRIMARY KEY,
+    layer_id INTEGER NOT NULL REFERENCES layers (id),
+    print_id INTEGER NOT NULL REFERENCES prints (id),
+    class TEXT NOT NULL,
+    confidence REAL,
+    x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER,
+    area INTEGER,
+    aspect_ratio REAL
+);
+CREATE INDEX IF NOT EXISTS defects_layer ON defects (layer_id);
+CREATE INDEX IF NOT EXISTS defects_class ON defects (class, print_id);
+
+CREATE TABLE IF NOT EXISTS decisions (
+    layer_id INTEGER PRIMARY KEY REFERENCES layers (id),
+    print_id INTEGER NOT NULL REFERENCES prints (id),
+    decision TEXT,
+    action TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS decisions_action ON decisions (action, print_id);
+"""
+
+# Per-layer count column for each class, None counts every defect
+CLASS_COLUMNS = {None: 'defects', 'Overextrusion': 'overextrusions', 'Underextrusion': 'underextrusions'}
+GROUPS = {'layer': 'l.layer', 'z': 'ROUND(l.z, 3)', 'print': 'p.report'}
+
+
+def decision_action(decision):
+    # Inverse of the decision strings YOLOInference.process_results writes
+    decision = (decision or '').lower()
+    if 'planarize' in decision:
+        return 'planarize'
+    if 'reprint' in decision or 'rework' in decision:
+        return 'rework'
+    return 'none'
+
+
+def layer_heights(gcode_file):
+    # {G-code layer: Z of its printing moves}, the median so a stray travel height does not count.
+    # Keyed by the slicer's numbers, which start at 1, see layer_offset in DefectDatabase.
+    parser = ColumnarGCodeParser()
+    parser.parse_file(gcode_file)
+    table = parser.table
+    printing = table['is_print']
+    layers, z = table['layer'][printing], table['Z'][printing]
+    heights = {}
+    for layer in np.unique(layers).tolist():
+        heights[layer] = round(float(np.median(z[layers == layer])), 4)
+    return heights
+
+
+def print_started(report):
+    # Reports sit in <date>/<part_name>_<HH>_<MM>/, the file time when they do not
+    folder = Path(report).parent
+    try:
+        return dt.strptime(f"{folder.parent.name} {folder.name[-5:]}", "%Y-%m-%d %H_%M").isoformat()
+    except ValueError:
+        return dt.fromtimestamp(Path(report).stat().st_mtime).isoformat(timespec='seconds')
+
+
+class DefectDatabase:
+    # Safe to share between threads. WAL mode, so the CLI can query a database the monitor is
+    # writing to. begin_print()/record_layer() are the monitor's side, import_reports() loads
+    # old JSON reports and the rest are the queries behind defect_db.py.
+    def __init__(self, path: Path, synchronous='NORMAL'):
+        self.path = Path(path)
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(f"PRAGMA synchronous={synchronous}")
+        self.connection.executescript(SCHEMA)
+        self.print_id = None
+        self.heights = {}
+        self.layer_offset = 1
+        self.last_query_time = None
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    # Writing
+
+    def begin_print(self, part_name, report, started=None, heights=None, layer_offset=1):
+        # report identifies the print, the monitor passes the path its JSON report will have so
+        # a later import of the output tree does not add the print twice. Stored resolved, like
+        # imported reports, so a relative or symlinked output path names the same print.
+        report = str(Path(report).resolve())
+        with self._lock, self.connection:
+            self.print_id = self._add_print(part_name, report, (started or dt.now()).isoformat(), 'live')
+            self._attempts = {
+                row['layer']: row['attempts'] for row in self.connection.execute(
+                    "SELECT layer, COUNT(*) AS attempts FROM layers WHERE print_id = ? GROUP BY layer", (self.print_id,)
+                )
+            }
+        # heights are keyed by G-code layer, which is the monitor's layer number + layer_offset
+        self.heights = heights or {}
+        self.layer_offset = layer_offset
+        return self.print_id
+
+    def record_layer(self, defects, action=None):
+        with self._lock, self.connection:
+            self._add_layer(self.print_id, defects, self.heights, self._attempts, action, self.layer_offset)
+
+    def import_reports(self, paths, heights=None, layer_offset=1):
+        # Reports already in the database are skipped, so re-running over the output tree only
+        # adds new prints. Every file goes in as one transaction. heights and layer_offset as
+        # for begin_print().
+        imported = 0
+        for report in self.find_reports(paths):
+            with open(report) as f:
+                records = json.load(f)
+            with self._lock, self.connection:
+                if self.connection.execute("SELECT 1 FROM prints WHERE report = ?", (str(report),)).fetchone():
+                    continue
+                part_name = report.name[:-len('_defects.json')]
+                print_id = self._add_print(part_name, str(report), print_started(report), 'import')
+                attempts = {}
+                for record in records:
+                    self._add_layer(print_id, record, heights or {}, attempts, layer_offset=layer_offset)
+            imported += 1
+        return imported
+
+    @staticmethod
+    def find_reports(paths):
+        # Resolved, so importing the same tree through another relative path skips it again
+        reports = []
+        for path in map(Path, paths):
+            if path.is_dir():
+                reports += sorted(report.resolve() for report in path.rglob('*_defects.json'))
+            elif path.name.endswith('_defects.json'):
+                reports.append(path.resolve())
+        return reports
+
+    def _add_print(self, part_name, report, started, source):
+        row = self.connection.execute("SELECT id FROM prints WHERE report = ?", (report,)).fetchone()
+        if row is not None:
+            return row['id']  # a monitor restarted on the same print carries on with it
+        return self.connection.execute(
+            "INSERT INTO prints (part_name, report, started, source) VALUES (?, ?, ?, ?)",
+            (part_name, report, started, source),
+        ).lastrowid
+
+    def _add_layer(self, print_id, record, heights, attempts, action=None, layer_offset=1):
+        layer = record["Layer number"]
+        attempt = attempts.get(layer, 0)
+        attempts[layer] = attempt + 1
+        deadline_met = record.get("Deadline met")
+        layer_id = self.connection.execute(
+            "INSERT INTO layers (print_id, layer, attempt, z, timestamp, defects, overextrusions, underextrusions, "
+            "trigger_ms, inference_profile, deadline_met, record) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                print_id, layer, attempt, heights.get(layer + layer_offset), record.get("Timestamp"),
+                record.get("Number of defects", 0), record.get("Overextrusions", 0), record.get("Underextrusions", 0),
+                record.get("Trigger to decision (ms)"), record.get("Inference profile"),
+                None if deadline_met is None else int(deadline_met), json.dumps(record, default=str),
+            ),
+        ).lastrowid
+        self.connection.executemany(
+            "INSERT INTO defects (layer_id, print_id, class, confidence, x1, y1, x2, y2, area, aspect_ratio) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (layer_id, print_id, defect["Class"], defect.get("Confidence"), *defect["Defect coordinates"],
+                 defect.get("Box area (px)"), defect.get("Box aspect ratio"))
+                for defect in record.get("Defect data", [])
+            ],
+        )
+        decision = record.get("Decision")
+        self.connection.execute(
+            "INSERT INTO decisions (layer_id, print_id, decision, action) VALUES (?, ?, ?, ?)",
+            (layer_id, print_id, decision, action or decision_action(decision)),
+        )
+
+    # Queries, each limited to the last `last` prints (of part_name when given)
+
+    def _recent(self, last, part_name):
+        where = "WHERE part_name = ?" if part_name else ""
+        params = [part_name] if part_name else []
+        return f"SELECT id FROM prints {where} ORDER BY started DESC LIMIT ?", params + [last]
+
+    def prints(self, last=20, part_name=None):
+        recent, params = self._recent(last, part_name)
+        return self._query(f"""
+            SELECT p.id, p.part_name, p.started, p.source, COUNT(l.id) AS layers,
+                   COALESCE(SUM(l.defects), 0) AS defects
+            FROM prints p LEFT JOIN layers l ON l.print_id = p.id
+            WHERE p.id IN ({recent})
+            GROUP BY p.id ORDER BY p.started DESC
+        """, params)
+
+    def defect_rate(self, by='layer', defect_class=None, last=200, part_name=None):
+        # Per layer number, Z height or print: inspected layers, how many had the class, and the rate
+        column = CLASS_COLUMNS[defect_class]
+        group = GROUPS[by]
+        recent, params = self._recent(last, part_name)
+        return self._query(f"""
+            SELECT {group} AS {by}, COUNT(*) AS layers, SUM(l.{column} > 0) AS affected,
+                   SUM(l.{column}) AS defects, ROUND(AVG(l.{column} > 0), 4) AS rate
+            FROM layers l JOIN prints p ON p.id = l.print_id
+            WHERE l.print_id IN ({recent})
+            GROUP BY {group} ORDER BY {group}
+        """, params)
+
+    def decisions(self, last=200, part_name=None):
+        recent, params = self._recent(last, part_name)
+        return self._query(f"""
+            SELECT action, COUNT(*) AS layers, COUNT(DISTINCT print_id) AS prints
+            FROM decisions WHERE print_id IN ({recent})
+            GROUP BY action ORDER BY layers DESC
+        """, params)
+
+    def defects(self, print_id, layer=None, min_confidence=0.0):
+        where, params = "d.print_id = ? AND d.confidence >= ?", [print_id, min_confidence]
+        if layer is not None:
+            where += " AND l.layer = ?"
+            params.append(layer)
+        return self._query(f"""
+            SELECT l.layer, l.attempt, d.class, d.confidence, d.x1, d.y1, d.x2, d.y2, d.area
+            FROM defects d JOIN layers l ON l.id = d.layer_id
+            WHERE {where} ORDER BY l.layer, l.attempt, d.id
+        """, params)
+
+    def _query(self, sql, params):
+        start = time.perf_counter()
+        with self._lock:
+            rows = [dict(row) for row in self.connection.execute(sql, params)]
+        self.last_query_time = time.perf_counter() - start
+        return rows
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+# Usage example:
+# database = DefectDatabase(Path.home() / 'output' / 'defects.sqlite')
+# database.import_reports([Path.home() / 'output'])
+# for row in database.defect_rate(by='z', defect_class='Underextrusion', last=200):
+#     print(row['z'], row['rate'])
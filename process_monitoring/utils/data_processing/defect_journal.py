@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import threading
+from pathlib import Path
+
+
+class DefectJournal:
+    # Append-only JSON Lines log with one record per layer. Every record is flushed to the OS
+    # as soon as it is written and fsynced in batches of fsync_every records. A background
+    # thread syncs a batch that has waited fsync_interval seconds, so between two slow layers a
+    # record is never left unsynced for longer than that. A crash of the process loses nothing,
+    # a power cut at most the unsynced batch.
+    def __init__(self, path: Path, fsync_every=10, fsync_interval=5.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if self._ends_mid_record():
+            # Left behind by a crash, start the next record on its own line
+            self._file.write('\n')
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._syncer = None
+        if fsync_interval:
+            self._syncer = threading.Thread(target=self._sync_periodically, name='journal-sync', daemon=True)
+            self._syncer.start()
+
+    def append(self, record):
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        self._closed.set()
+        if self._syncer is not None:
+            self._syncer.join()
+        with self._lock:
+            if self._file.closed:
+                return
+            self._sync()
+            self._file.close()
+
+    def _sync_periodically(self):
+        while not self._closed.wait(self.fsync_interval / 4):
+            with self._lock:
+                if self._unsynced and time.monotonic() - self._last_sync >= self.fsync_interval:
+                    self._sync()
+
+    def _ends_mid_record(self):
+        if self.path.stat().st_size == 0:
+            return False
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b'\n'
+
+    def _sync(self):
+        if self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    @staticmethod
+    def read(path):
+        # Every complete record. A line cut short by a crash is skipped.
+        records = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                record = DefectJournal._decode(line)
+                if record is not None:
+                    records.append(record)
+        return records
+
+    @staticmethod
+    def tail(path, poll_interval=0.5, stop_event=None, from_start=True):
+        # Yields records as they are appended, like `tail -f`
+        path = Path(path)
+        while not path.exists():
+            if stop_event is not None and stop_event.is_set():
+                return
+            time.sleep(poll_interval)
+        with open(path, encoding='utf-8') as f:
+            if not from_start:
+                f.seek(0, os.SEEK_END)
+            partial = ''
+            while stop_event is None or not stop_event.is_set():
+                line = f.readline()
+                if not line:
+                    time.sleep(poll_interval)
+                    continue
+                partial += line
+                if not partial.endswith('\n'):
+                    continue  # the writer is midway through this record
+                record = DefectJournal._decode(partial)
+                partial = ''
+                if record is not None:
+                    yield record
+
+    @staticmethod
+    def _decode(line):
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError:
+            return None
+
+# Usage example: follow a running print's journal
+if __name__ == "__main__":
+    import sys
+    for record in DefectJournal.tail(sys.argv[1]):
+        print(f"Layer {record['Layer number']}: {record['Number of defects']} defects, {record.get('Decision')}")
@@ -0,0 +1,268 @@
+import os
+import json
+import mmap
+import zlib
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# A print's frames in one append-only data file plus a JSON Lines index:
+#   <dir>/frames.dat    compressed row chunks and preview levels, back to back
+#   <dir>/index.jsonl   one record per frame: layer, attempt, kind, name, shape, chunk and preview offsets
+# A record is only indexed once its data has been written, so a crash loses at most the frames
+# being written, and the index is read with the same rule as DefectJournal.
+
+DATA_FILE = 'frames.dat'
+INDEX_FILE = 'index.jsonl'
+
+
+def _codec(name, level=1):
+    # (compress, decompress) for a chunk
+    if name == 'zlib':
+        return (lambda data: zlib.compress(data, level)), zlib.decompress
+    if name == 'lz4':
+        import lz4.frame
+        return (lambda data: lz4.frame.compress(data, compression_level=level)), lz4.frame.decompress
+    if name == 'none':
+        return bytes, bytes
+    raise ValueError(f"Unknown archive codec {name!r}")
+
+
+def _sub_filter(chunk):
+    # Difference to the left neighbour, wrapping like PNG's Sub filter. Neighbouring pixels of a
+    # frame are close, so this turns most of it into small values zlib packs much tighter.
+    filtered = np.empty_like(chunk)
+    filtered[:, 0] = chunk[:, 0]
+    np.subtract(chunk[:, 1:], chunk[:, :-1], out=filtered[:, 1:])
+    return filtered
+
+
+def _unsub_filter(chunk):
+    return np.cumsum(chunk, axis=1, dtype=chunk.dtype)
+
+
+class FrameArchive:
+    # Writer. append() is safe to call from several threads: chunks are compressed on a thread
+    # pool outside the lock and only the write and index line are serialized.
+    def __init__(self, path: Path, config=None):
+        config = config or {}
+        self.path = Path(path)
+        self.path.mkdir(exist_ok=True, parents=True)
+        self.codec = config.get('codec', 'zlib')
+        self.level = config.get('level', 1)
+        self.filter = config.get('filter', 'sub')
+        self.chunk_rows = config.get('chunk_rows', 256)
+        self.previews = list(config.get('previews', [4, 16]))
+        self.fsync_every = config.get('fsync_every', 10)
+        self._compress, _ = _codec(self.codec, self.level)
+        self._pool = ThreadPoolExecutor(config.get('threads', 4), thread_name_prefix='frame-archive')
+        self._data = open(self.path / DATA_FILE, 'ab')
+        self._index = open(self.path / INDEX_FILE, 'a', encoding='utf-8')
+        if self._index.tell() and not self._ends_with_newline():
+            # Left behind by a crash, start the next record on its own line
+            self._index.write('\n')
+        self._offset = self._data.seek(0, os.SEEK_END)
+        # Attempts already in the archive, so a resumed print keeps counting
+        self._attempts = {}
+        for record in FrameArchiveReader.read_index(self.path / INDEX_FILE):
+            key = (record['layer'], record['kind'])
+            self._attempts[key] = max(self._attempts.get(key, 0), record['attempt'] + 1)
+        self._unsynced = 0
+        self._lock = threading.Lock()
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def append(self, kind, layer, name, image, extra=None):
+        # Returns the index record. Every store of the same layer and kind is a new attempt.
+        image = np.ascontiguousarray(image)
+        chunks = list(self._pool.map(self._encode, [
+            image[start:start + self.chunk_rows] for start in range(0, image.shape[0], self.chunk_rows)
+        ]))
+        previews = []
+        for factor in self.previews:
+            size = (max(1, image.shape[1] // factor), max(1, image.shape[0] // factor))
+            preview = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+            previews.append((factor, preview.shape, self._encode(preview)))
+
+        with self._lock:
+            attempt = self._attempts.get((layer, kind), 0)
+            self._attempts[(layer, kind)] = attempt + 1
+            record = {
+                'layer': layer, 'attempt': attempt, 'kind': kind, 'name': name,
+                'shape': list(image.shape), 'dtype': image.dtype.str,
+                'codec': self.codec, 'filter': self.filter, 'chunk_rows': self.chunk_rows,
+                'chunks': [self._write(chunk) for chunk in chunks],
+                'previews': {
+                    str(factor): {'shape': list(shape), 'chunk': self._write(data)}
+                    for factor, shape, data in previews
+                },
+                **(extra or {}),
+            }
+            # Data reaches the OS before the index line that points at it
+            self._data.flush()
+            self._index.write(json.dumps(record) + '\n')
+            self._index.flush()
+            self.bytes_in += image.nbytes
+            self.bytes_out += sum(length for _, length in record['chunks'])
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every:
+                self._sync()
+        return record
+
+    def _ends_with_newline(self):
+        with open(self.path / INDEX_FILE, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def _encode(self, array):
+        if self.filter == 'sub' and array.ndim >= 2:
+            array = _sub_filter(array)
+        return self._compress(np.ascontiguousarray(array).data)
+
+    def _write(self, data):
+        offset = self._offset
+        self._data.write(data)
+        self._offset += len(data)
+        return [offset, len(data)]
+
+    def _sync(self):
+        os.fsync(self._data.fileno())
+        os.fsync(self._index.fileno())
+        self._unsynced = 0
+
+    def ratio(self):
+        return self.bytes_in / self.bytes_out if self.bytes_out else 0.0
+
+    def close(self):
+        with self._lock:
+            if self._data.closed:
+                return
+            self._sync()
+            self._data.close()
+            self._index.close()
+        self._pool.shutdown()
+        if self.bytes_out:
+            print(f"Frame archive {self.path}: {self.bytes_in / 1e6:.0f} MB in {self.bytes_out / 1e6:.0f} MB "
+                  f"({self.ratio():.1f}x)")
+
+
+class FrameArchiveReader:
+    # Random access to an archive, also while it is still being written (call refresh()).
+    # The data file is memory-mapped, so loading a layer only reads and decompresses its own
+    # chunks, or only the chunks covering the rows asked for.
+    def __init__(self, path: Path, threads=4):
+        self.path = Path(path)
+        self._pool = ThreadPoolExecutor(threads, thread_name_prefix='frame-archive-read')
+        self._file = None
+        self._mmap = None
+        self.refresh()
+
+    @staticmethod
+    def read_index(path):
+        records = []
+        if not Path(path).exists():
+            return records
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # cut short by a crash
+        return records
+
+    def refresh(self):
+        self.records = self.read_index(self.path / INDEX_FILE)
+        self._by_layer = {}
+        self._by_name = {}
+        for record in self.records:
+            self._by_layer.setdefault((record['layer'], record['kind']), []).append(record)
+            self._by_name[record['name']] = record
+        self._close_map()
+        self._file = open(self.path / DATA_FILE, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def layers(self, kind='raw'):
+        return sorted(layer for layer, k in self._by_layer if k == kind)
+
+    def attempts(self, layer, kind='raw'):
+        return self._by_layer.get((layer, kind), [])
+
+    def find(self, layer, kind='raw', attempt=-1):
+        # attempt counts like a list index, -1 is the latest
+        records = self.attempts(layer, kind)
+        if not records:
+            raise KeyError(f"No {kind} frame for layer {layer} in {self.path}")
+        return records[attempt]
+
+    def read(self, layer, kind='raw', attempt=-1, rows=None):
+        return self.decode(self.find(layer, kind, attempt), rows)
+
+    def read_name(self, name):
+        # By the file name the frame would have had in Camera/, e.g. a defect record's Timestamp
+        return self.decode(self._by_name[name])
+
+    def preview(self, layer, factor=None, kind='raw', attempt=-1):
+        # Smallest stored preview, or the one downsampled by factor
+        record = self.find(layer, kind, attempt)
+        previews = record['previews']
+        key = str(factor) if factor is not None else max(previews, key=int)
+        preview = previews[key]
+        return self._chunk(record, preview['chunk'], preview['shape'])
+
+    def decode(self, record, rows=None):
+        shape = tuple(record['shape'])
+        first, last = rows if rows is not None else (0, shape[0])
+        step = record['chunk_rows']
+        out = np.empty((last - first,) + shape[1:], np.dtype(record['dtype']))
+
+        def load(i):
+            start = i * step
+            stop = min(start + step, shape[0])
+            chunk = self._chunk(record, record['chunks'][i], (stop - start,) + shape[1:])
+            lo, hi = max(start, first), min(stop, last)
+            out[lo - first:hi - first] = chunk[lo - start:hi - start]
+
+        list(self._pool.map(load, range(first // step, -(-last // step))))
+        return out
+
+    def _chunk(self, record, location, shape):
+        offset, length = location
+        _, decompress = _codec(record['codec'])
+        data = decompress(memoryview(self._mmap)[offset:offset + length])
+        array = np.frombuffer(data, np.dtype(record['dtype'])).reshape(shape)
+        if record['filter'] == 'sub' and array.ndim >= 2:
+            array = _unsub_filter(array)
+        return array
+
+    def _close_map(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        self._close_map()
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Usage example:
+# archive = FrameArchive(output_path / 'Camera' / 'frames.archive', config['artifacts']['archive'])
+# archive.append('raw', layer, 'image_17_10_26_12_00_00.png', frame)
+# archive.close()
+#
+# with FrameArchiveReader(output_path / 'Camera' / 'frames.archive') as reader:
+#     frame = reader.read(layer=12)                     # latest attempt of layer 12
+#     first_try = reader.read(12, attempt=0)
+#     thumbnail = reader.preview(12, factor=16)
+#     band = reader.read(12, rows=(1000, 1256))         # only the chunks covering these rows
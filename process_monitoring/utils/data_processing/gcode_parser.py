@@ -1,4 +1,8 @@
 import re
+import mmap
+from array import array
+
+import numpy as np
 
 class GCodeParser:
     def __init__(self):
@@ -45,6 +49,228 @@ class GCodeParser:
     def get_moves(self):
         return self.moves
 
+
+AXES = 'XYZABF'
+SYSTEM_CODES = {None: 0, 'polymer': 1, 'ceramic': 2}
+SYSTEM_NAMES = {code: name for name, code in SYSTEM_CODES.items()}
+
+# Column name -> (array typecode used while parsing, numpy dtype of the final column)
+MOVE_COLUMNS = {
+    'X': ('d', np.float64),
+    'Y': ('d', np.float64),
+    'Z': ('d', np.float64),
+    'A': ('d', np.float64),
+    'B': ('d', np.float64),
+    'F': ('d', np.float64),
+    'layer': ('i', np.int32),
+    'system': ('b', np.int8),
+    'is_print': ('b', np.bool_),
+    'line': ('q', np.int64),
+}
+
+_AXIS_INDEX = {ord(axis): i for i, axis in enumerate(AXES)}
+_EXTRUSION_AXES = (AXES.index('A'), AXES.index('B'))
+
+
+class MoveTable:
+    # Typed, column-per-field view of parsed moves
+    def __init__(self, columns):
+        self.columns = columns
+
+    @classmethod
+    def empty(cls):
+        return cls({name: np.empty(0, dtype) for name, (_, dtype) in MOVE_COLUMNS.items()})
+
+    def __len__(self):
+        return len(self.columns['line'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def select(self, index):
+        return MoveTable({name: column[index] for name, column in self.columns.items()})
+
+    def layer(self, layer):
+        return self.select(self.columns['layer'] == layer)
+
+    def layers(self):
+        return np.unique(self.columns['layer']).tolist()
+
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+    def to_dicts(self):
+        # Same dict shape GCodeParser.parse_move produces, for existing consumers
+        columns = [self.columns[axis].tolist() for axis in AXES]
+        systems = [SYSTEM_NAMES[code] for code in self.columns['system'].tolist()]
+        layers = self.columns['layer'].tolist()
+        kinds = ['print' if p else 'travel' for p in self.columns['is_print'].tolist()]
+        moves = []
+        for i in range(len(layers)):
+            move = {axis: columns[a][i] for a, axis in enumerate(AXES)}
+            move['system'] = systems[i]
+            move['layer'] = layers[i]
+            move['type'] = kinds[i]
+            moves.append(move)
+        return moves
+
+    def group_by_layer(self):
+        layers = self.columns['layer']
+        grouped = {}
+        for layer in np.unique(layers).tolist():
+            grouped[layer] = self.select(layers == layer).to_dicts()
+        return grouped
+
+
+class LayerSpan:
+    # Byte range of one layer header block plus the modal state at its start
+    def __init__(self, layer, start, first_line, position, system):
+        self.layer = layer
+        self.start = start
+        self.end = start
+        self.first_line = first_line
+        self.position = position
+        self.system = system
+
+    def __repr__(self):
+        return f"LayerSpan(layer={self.layer}, bytes={self.start}:{self.end}, line={self.first_line})"
+
+
+class ColumnarGCodeParser:
+    # Same G-code semantics as GCodeParser, but moves are kept in typed columns and
+    # each layer's byte ranges are indexed so one layer can be re-read from a mmap.
+    def __init__(self):
+        self.filename = None
+        self.current_system = None
+        self.current_position = [0.0] * len(AXES)
+        self.current_layer = 1 #Gcode currently starts at layer 1
+        self.layer_index = {}
+        self.table = MoveTable.empty()
+        self._span = None
+
+    def parse_file(self, filename, store_moves=True):
+        # store_moves=False only builds the layer index, layers are then read with load_layer
+        self.filename = filename
+        self.layer_index = {}
+        buffers = self._new_buffers() if store_moves else None
+        self._open_span(0, 1)
+
+        offset = 0
+        with open(filename, 'rb') as file:
+            for line_number, raw in enumerate(file, 1):
+                line = raw.strip()
+                if line.startswith(b';Layer'):
+                    layer = self._parse_layer_number(line)
+                    if layer is not None:
+                        self._close_span(offset)
+                        self.current_layer = layer
+                        self._open_span(offset, line_number)
+                else:
+                    self._parse_line(line, line_number, buffers)
+                offset += len(raw)
+        self._close_span(offset)
+
+        if store_moves:
+            self.table = self._to_table(buffers)
+
+    def load_layer(self, layer):
+        # Parse a single layer from a memory-mapped view of the file
+        spans = self.layer_index.get(layer)
+        if not spans:
+            return MoveTable.empty()
+
+        state = (self.current_system, self.current_position, self.current_layer)
+        buffers = self._new_buffers()
+        try:
+            with open(self.filename, 'rb') as file, \
+                    mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for span in spans:
+                    self.current_system = span.system
+                    self.current_position = list(span.position)
+                    self.current_layer = span.layer
+                    lines = mm[span.start:span.end].splitlines()
+                    for line_number, raw in enumerate(lines, span.first_line):
+                        line = raw.strip()
+                        if not line.startswith(b';Layer'):
+                            self._parse_line(line, line_number, buffers)
+        finally:
+            self.current_system, self.current_position, self.current_layer = state
+        return self._to_table(buffers)
+
+    def get_layer(self, layer):
+        if len(self.table):
+            return self.table.layer(layer)
+        return self.load_layer(layer)
+
+    def get_layers(self):
+        # {layer: [move dicts]}, the shape LayerMaskManager takes as parsed_gcode
+        if len(self.table):
+            return self.table.group_by_layer()
+        return {layer: self.load_layer(layer).to_dicts() for layer in self.layer_index}
+
+    def get_moves(self):
+        # Compatibility adapter for callers of GCodeParser.get_moves()
+        return self.table.to_dicts()
+
+    def _parse_line(self, line, line_number, buffers):
+        if line.startswith(b'G55'):
+            self.current_system = 'polymer'
+        elif line.startswith(b'G58'):
+            self.current_system = 'ceramic'
+        elif line.startswith(b'G0') or line.startswith(b'G1'):
+            self._parse_move(line, line_number, buffers)
+
+    def _parse_move(self, line, line_number, buffers):
+        position = self.current_position
+        has_extrusion = False
+        for part in line.split()[1:]:
+            axis = _AXIS_INDEX.get(part[0])
+            if axis is not None:
+                position[axis] = float(part[1:])
+                if axis in _EXTRUSION_AXES:
+                    has_extrusion = True
+
+        if buffers is None:
+            return
+        for axis, value in zip(AXES, position):
+            buffers[axis].append(value)
+        buffers['layer'].append(self.current_layer)
+        buffers['system'].append(SYSTEM_CODES[self.current_system])
+        buffers['is_print'].append(has_extrusion)
+        buffers['line'].append(line_number)
+
+    def _open_span(self, offset, line_number):
+        self._span = LayerSpan(
+            self.current_layer, offset, line_number, tuple(self.current_position), self.current_system
+        )
+
+    def _close_span(self, offset):
+        span = self._span
+        span.end = offset
+        if span.end > span.start:
+            # A layer can own several ranges, e.g. the preamble before ';Layer 1 of'
+            self.layer_index.setdefault(span.layer, []).append(span)
+
+    @staticmethod
+    def _parse_layer_number(line):
+        # ';Layer <n> of <total>' without running a regex on every header
+        parts = line.split(None, 3)
+        if len(parts) >= 3 and parts[0] == b';Layer' and parts[1].isdigit() and parts[2] == b'of':
+            return int(parts[1])
+        return None
+
+    @staticmethod
+    def _new_buffers():
+        return {name: array(typecode) for name, (typecode, _) in MOVE_COLUMNS.items()}
+
+    @staticmethod
+    def _to_table(buffers):
+        return MoveTable({
+            name: np.array(buffers[name], dtype=dtype) if len(buffers[name]) == 0
+            else np.frombuffer(buffers[name], dtype=np.dtype(typecode)).astype(dtype)
+            for name, (typecode, dtype) in MOVE_COLUMNS.items()
+        })
+
 # Usage example
 if __name__ == "__main__":
     parser = GCodeParser()
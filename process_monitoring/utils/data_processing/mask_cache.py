@@ -0,0 +1,143 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from utils.data_processing.mask_handler import CoordinateTransformer, MaskGenerator, CroppedMask
+
+CACHE_VERSION = 1
+
+
+def source_digest(path, chunk_size=1 << 20):
+    # Hash of the toolpath file's raw bytes, far cheaper than serializing the parsed layers
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def toolpath_digest(parsed_gcode):
+    # For toolpaths built in memory, with no file behind them
+    digest = hashlib.sha256()
+    for layer in sorted(parsed_gcode, key=str):
+        digest.update(repr(layer).encode())
+        digest.update(json.dumps(parsed_gcode[layer], sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def _rasterize_layer(args):
+    # Runs in a worker process, so only plain data goes in and out
+    layer, coordinates, pix_per_mm, image_width, image_height, thickness = args
+    transformer = CoordinateTransformer(pix_per_mm, image_width, image_height)
+    mask = MaskGenerator(transformer, image_width, image_height).generate_cropped_mask(coordinates, thickness)
+    return layer, mask.bbox, mask.packed
+
+
+class MaskCache:
+    # On-disk store of cropped, bit-packed layer masks. Each entry is a directory named after a
+    # hash of the toolpath file and calibration holding one flat file that is memory-mapped on load.
+    def __init__(self, cache_dir, workers=None):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(exist_ok=True, parents=True)
+        self.workers = workers or os.cpu_count() or 1
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(parsed_gcode, pix_per_mm, image_width, image_height, thickness, source=None):
+        # source is the file parsed_gcode was loaded from, its bytes identify the toolpath
+        digest = hashlib.sha256()
+        digest.update(f"v{CACHE_VERSION}:{pix_per_mm}:{image_width}:{image_height}:{thickness}".encode())
+        if source is not None:
+            digest.update(f"file:{source_digest(source)}".encode())
+        else:
+            digest.update(toolpath_digest(parsed_gcode).encode())
+        return digest.hexdigest()[:32]
+
+    def get_masks(self, mask_manager, thickness):
+        key = self.make_key(
+            mask_manager.parsed_gcode, mask_manager.transformer.pix_per_mm,
+            mask_manager.image_width, mask_manager.image_height, thickness, mask_manager.source
+        )
+        # The lock makes a second handler with the same toolpath reuse the first one's work
+        with self._lock:
+            masks = self._loaded.get(key)
+            if masks is None:
+                masks = self.load(key)
+                if masks is None:
+                    print(f"Mask cache miss, building {key}")
+                    self.build(key, mask_manager, thickness)
+                    masks = self.load(key)
+                self._loaded[key] = masks
+        return masks
+
+    def load(self, key):
+        entry = self.cache_dir / key
+        index_path = entry / 'index.json'
+        if not index_path.exists():
+            return None
+        with open(index_path) as f:
+            index = json.load(f)
+
+        frame_shape = tuple(index['frame_shape'])
+        masks = {}
+        if index['nbytes'] == 0:
+            return masks
+        data = np.memmap(entry / 'masks.bin', dtype=np.uint8, mode='r', shape=(index['nbytes'],))
+        for layer, offset, rows, cols, bbox in index['layers']:
+            packed = data[offset:offset + rows * cols].reshape(rows, cols)
+            masks[layer] = CroppedMask(tuple(bbox), packed, frame_shape)
+        return masks
+
+    def build(self, key, mask_manager, thickness):
+        jobs = []
+        for layer, moves in mask_manager.parsed_gcode.items():
+            coordinates = mask_manager._extract_coordinates_with_travel(moves)
+            if coordinates['X'] and coordinates['Y']:  # Only generate mask if there are coordinates
+                jobs.append((layer, coordinates, mask_manager.transformer.pix_per_mm,
+                             mask_manager.image_width, mask_manager.image_height, thickness))
+
+        if self.workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(jobs))) as pool:
+                results = list(pool.map(_rasterize_layer, jobs, chunksize=max(1, len(jobs) // (4 * self.workers))))
+        else:
+            results = [_rasterize_layer(job) for job in jobs]
+
+        # Write into a scratch directory and rename, so a crash never leaves a half-written entry
+        entry = self.cache_dir / key
+        scratch = self.cache_dir / f".{key}.{os.getpid()}.tmp"
+        scratch.mkdir(exist_ok=True)
+        layers = []
+        offset = 0
+        with open(scratch / 'masks.bin', 'wb') as f:
+            for layer, bbox, packed in results:
+                f.write(np.ascontiguousarray(packed).tobytes())
+                layers.append([layer, offset, packed.shape[0], packed.shape[1], list(bbox)])
+                offset += packed.size
+        index = {
+            'version': CACHE_VERSION,
+            'frame_shape': [mask_manager.image_height, mask_manager.image_width],
+            'thickness': thickness,
+            'nbytes': offset,
+            'layers': layers,
+        }
+        with open(scratch / 'index.json', 'w') as f:
+            json.dump(index, f)
+
+        try:
+            os.replace(scratch, entry)
+        except OSError:
+            # Another process finished the same entry first
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def clear(self):
+        with self._lock:
+            self._loaded.clear()
+            for entry in self.cache_dir.iterdir():
+                shutil.rmtree(entry, ignore_errors=True)
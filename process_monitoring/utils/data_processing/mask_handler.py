@@ -1,6 +1,13 @@
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import cv2
 
+from utils.telemetry import metrics
+
 class CoordinateTransformer:
     def __init__(self, pix_per_mm, image_width, image_height):
         self.pix_per_mm = pix_per_mm
@@ -33,33 +40,321 @@ class MaskGenerator:
         
         return poly_mask
 
+    def generate_cropped_mask(self, coordinates, thickness):
+        # Rasterize straight into a canvas the size of the toolpath bounding box
+        x, y = self.transformer.transform(coordinates['X'], coordinates['Y'])
+        points = np.column_stack((x, y)).reshape((-1, 1, 2)).astype(np.int32)
+        line_thickness = int(self.transformer.pix_per_mm * thickness)
+
+        # Half the stroke plus a small margin so findContours never sees the canvas edge
+        pad = line_thickness // 2 + 2
+        x0 = max(int(points[:, 0, 0].min()) - pad, 0)
+        y0 = max(int(points[:, 0, 1].min()) - pad, 0)
+        x1 = min(int(points[:, 0, 0].max()) + pad + 1, self.image_width)
+        y1 = min(int(points[:, 0, 1].max()) + pad + 1, self.image_height)
+        if x1 <= x0 or y1 <= y0:
+            return CroppedMask.empty((self.image_height, self.image_width))
+
+        poly_mask = np.zeros((y1 - y0, x1 - x0), np.uint8)
+        cv2.polylines(poly_mask, [points - np.array([x0, y0], np.int32)], isClosed=False,
+                      color=255, thickness=line_thickness)
+
+        contours, _ = cv2.findContours(poly_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+        cv2.drawContours(poly_mask, contours, -1, 255, cv2.FILLED)
+
+        return CroppedMask.from_mask(poly_mask, (self.image_height, self.image_width), offset=(x0, y0))
+
+# Byte value -> its 8 bits as 0/255 bytes (most significant first, like np.packbits) in one uint64
+_UNPACK_LUT = (np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1) * np.uint8(255)).view(np.uint64).ravel()
+
+class CroppedMask:
+    # Mask kept only over its bounding box, bit-packed along each row
+    def __init__(self, bbox, packed, frame_shape):
+        self.bbox = bbox  # (x0, y0, x1, y1), end exclusive, full-frame pixels
+        self.packed = packed
+        self.frame_shape = frame_shape
+
+    @classmethod
+    def empty(cls, frame_shape):
+        return cls((0, 0, 0, 0), np.zeros((0, 0), np.uint8), frame_shape)
+
+    @classmethod
+    def from_mask(cls, mask, frame_shape=None, offset=(0, 0)):
+        frame_shape = frame_shape or mask.shape[:2]
+        x, y, w, h = cv2.boundingRect(mask)
+        if w == 0 or h == 0:
+            return cls.empty(frame_shape)
+        crop = mask[y:y + h, x:x + w]
+        bbox = (x + offset[0], y + offset[1], x + offset[0] + w, y + offset[1] + h)
+        return cls(bbox, np.packbits(crop > 0, axis=1), frame_shape)
+
+    @property
+    def shape(self):
+        x0, y0, x1, y1 = self.bbox
+        return (y1 - y0, x1 - x0)
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    def is_empty(self):
+        return self.shape[0] == 0 or self.shape[1] == 0
+
+    def unpack(self, out=None, index=None):
+        # uint8 0/255 array covering the bounding box. With a flat uint8 out of at least
+        # packed.size * 8 bytes and a flat intp index of packed.size it is written there via a
+        # lookup table of 8-byte rows, without allocating.
+        if out is None:
+            bits = np.unpackbits(self.packed, axis=1, count=self.shape[1])
+            return bits * np.uint8(255)
+        rows, cols = self.packed.shape
+        wide = out[:rows * cols * 8].view(np.uint64).reshape(rows, cols)
+        if index is not None:
+            indices = index[:rows * cols].reshape(rows, cols)
+            np.copyto(indices, self.packed, casting='unsafe')
+        else:
+            indices = self.packed
+        np.take(_UNPACK_LUT, indices, out=wide, mode='clip')
+        return out[:rows * cols * 8].reshape(rows, cols * 8)[:, :self.shape[1]]
+
+    def to_full(self):
+        mask = np.zeros(self.frame_shape, np.uint8)
+        if not self.is_empty():
+            x0, y0, x1, y1 = self.bbox
+            mask[y0:y1, x0:x1] = self.unpack()
+        return mask
+
+class FrameBufferPool:
+    # Reusable full-frame output buffers. A buffer is handed out again only once nothing but
+    # the pool refers to it, so a masked frame still queued for the artifact writer or held by
+    # a results object is never overwritten. Each buffer remembers the box last written into
+    # it, which is all that has to be cleared before it is reused.
+    def __init__(self, max_buffers=8):
+        self.max_buffers = max_buffers
+        self._buffers = []  # [array, dirty bbox or None]
+        self._lock = threading.Lock()
+
+    def acquire(self, shape, dtype=np.uint8):
+        with self._lock:
+            for entry in self._buffers:
+                # Free when the only references are the entry list and getrefcount's argument
+                if entry[0].shape == shape and entry[0].dtype == dtype and sys.getrefcount(entry[0]) <= 2:
+                    buffer = entry[0]
+                    if entry[1] is not None:
+                        x0, y0, x1, y1 = entry[1]
+                        buffer[y0:y1, x0:x1] = 0
+                        entry[1] = None
+                    return buffer, entry
+            buffer = np.zeros(shape, dtype)
+            if len(self._buffers) >= self.max_buffers:
+                return buffer, None
+            entry = [buffer, None]
+            self._buffers.append(entry)
+            return buffer, entry
+
+    def __len__(self):
+        return len(self._buffers)
+
 class MaskApplicator:
+    def __init__(self, max_buffers=8):
+        self.pool = FrameBufferPool(max_buffers)
+        # Grow-only scratch for the bounding box: normalised crop, blend, unpacked mask, lookup indices
+        self._crop = np.empty(0, np.uint8)
+        self._blended = np.empty(0, np.uint8)
+        self._unpacked = np.empty(0, np.uint8)
+        self._index = np.empty(0, np.intp)
+        self._lock = threading.Lock()
+
+    def apply(self, image, mask, alpha=0.1, out=None):
+        # Fused apply_mask: same result, but only the mask's bounding box is read or written and
+        # the result goes into out (zeroed here) or a pooled buffer instead of fresh frames
+        if not isinstance(mask, CroppedMask):
+            mask = CroppedMask.from_mask(mask)
+        entry = None
+        if out is None:
+            out, entry = self.pool.acquire(image.shape, image.dtype)
+        else:
+            out.fill(0)
+        if mask.is_empty():
+            return out
+
+        min_val, max_val, _, _ = cv2.minMaxLoc(image)
+        scale = 254.0 / (max_val - min_val) if max_val > min_val else 0.0
+        x0, y0, x1, y1 = mask.bbox
+        rows, cols = mask.shape
+        with self._lock:
+            self._reserve(rows * cols, mask.packed.size)
+            crop = self._crop[:rows * cols].reshape(rows, cols)
+            blended = self._blended[:rows * cols].reshape(rows, cols)
+            cv2.convertScaleAbs(image[y0:y1, x0:x1], dst=crop, alpha=scale, beta=-min_val * scale)
+            mask_crop = mask.unpack(out=self._unpacked, index=self._index)
+            cv2.addWeighted(crop, alpha, mask_crop, 1 - alpha, 0, dst=blended)
+            target = out[y0:y1, x0:x1]
+            np.subtract(crop, blended, out=target)
+            # The mask is 0/255, so and-ing with it zeroes everything outside the toolpath
+            np.bitwise_and(target, mask_crop, out=target)
+        if entry is not None:
+            entry[1] = mask.bbox
+        return out
+
+    def _reserve(self, area, packed_size):
+        if self._crop.size < area:
+            self._crop = np.empty(area, np.uint8)
+            self._blended = np.empty(area, np.uint8)
+        if self._index.size < packed_size:
+            self._unpacked = np.empty(packed_size * 8, np.uint8)
+            self._index = np.empty(packed_size, np.intp)
+
     @staticmethod
     def apply_mask(image, mask, alpha=0.1):
+        if isinstance(mask, CroppedMask):
+            return MaskApplicator.apply_cropped_mask(image, mask, alpha)
         image = cv2.normalize(image, None, 0, 254, cv2.NORM_MINMAX)
         mask_bool = mask.astype(bool)
         out = image.copy()
         out[mask_bool] = cv2.addWeighted(image, alpha, mask, 1 - alpha, 0)[mask_bool]
         return image - out
 
+    @staticmethod
+    def apply_cropped_mask(image, mask, alpha=0.1):
+        # Same result as apply_mask, but only the bounding box of the mask is touched.
+        # Normalisation still uses the min/max of the whole frame.
+        result = np.zeros_like(image)
+        if mask.is_empty():
+            return result
+        min_val, max_val, _, _ = cv2.minMaxLoc(image)
+        scale = 254.0 / (max_val - min_val) if max_val > min_val else 0.0
+
+        x0, y0, x1, y1 = mask.bbox
+        crop = cv2.convertScaleAbs(image[y0:y1, x0:x1], alpha=scale, beta=-min_val * scale)
+        mask_crop = mask.unpack()
+        blended = cv2.addWeighted(crop, alpha, mask_crop, 1 - alpha, 0)
+        diff = crop - blended
+        diff[mask_crop == 0] = 0
+        result[y0:y1, x0:x1] = diff
+        return result
+
+class LRUMaskStore:
+    # Size-bounded, thread-safe LRU of CroppedMask objects keyed by layer
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, layer):
+        with self._lock:
+            return layer in self._masks
+
+    def __len__(self):
+        return len(self._masks)
+
+    def get(self, layer):
+        with self._lock:
+            mask = self._masks.get(layer)
+            if mask is not None:
+                self._masks.move_to_end(layer)
+            return mask
+
+    def put(self, layer, mask):
+        with self._lock:
+            old = self._masks.pop(layer, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._masks[layer] = mask
+            self.nbytes += mask.nbytes
+            # Always keep the newest entry, even if it alone exceeds the budget
+            while self.nbytes > self.max_bytes and len(self._masks) > 1:
+                _, evicted = self._masks.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._masks.clear()
+            self.nbytes = 0
+
 class LayerMaskManager:
-    def __init__(self, parsed_gcode, transformer, image_width, image_height):
+    def __init__(self, parsed_gcode, transformer, image_width, image_height, cache_mb=256, mask_cache=None,
+                 source=None):
         self.parsed_gcode = parsed_gcode
+        self.source = source  # file parsed_gcode came from, keys the persistent cache
         self.transformer = transformer
         self.image_width = image_width
         self.image_height = image_height
-        self.masks = {}
+        self.thickness = 1.3
+        self.mask_gen = MaskGenerator(transformer, image_width, image_height)
+        self.masks = LRUMaskStore(int(cache_mb * 1024 * 1024))
+        self.mask_cache = mask_cache
+        self.persistent_masks = {}
+        self._empty_layers = set()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mask-prefetch')
 
     def generate_all_masks(self, thickness=1.3):
-        mask_gen = MaskGenerator(self.transformer, self.image_width, self.image_height)
-        for layer, moves in self.parsed_gcode.items():
-            coordinates = self._extract_coordinates_with_travel(moves)
-            if coordinates['X'] and coordinates['Y']:  # Only generate mask if there are coordinates
-                mask = mask_gen.generate_mask(coordinates, thickness)
-                self.masks[layer] = mask
+        # Without a persistent cache masks are rasterized lazily by get_mask
+        self.thickness = thickness
+        self.masks.clear()
+        self._empty_layers.clear()
+        if self.mask_cache is not None:
+            self.persistent_masks = self.mask_cache.get_masks(self, thickness)
 
     def get_mask(self, layer):
-        return self.masks.get(layer)
+        mask = self._load_mask(layer)
+        self.prefetch(layer + 1)
+        return mask
+
+    def prefetch(self, layer):
+        if layer in self.persistent_masks or layer in self.masks or layer in self._empty_layers or layer not in self.parsed_gcode:
+            return
+        with self._pending_lock:
+            if layer not in self._pending:
+                self._pending[layer] = self._prefetcher.submit(self._prefetch_layer, layer)
+
+    def close(self):
+        self._prefetcher.shutdown(wait=False, cancel_futures=True)
+
+    def _load_mask(self, layer):
+        mask = self.persistent_masks.get(layer)
+        if mask is not None:
+            return mask
+        mask = self.masks.get(layer)
+        if mask is not None or layer in self._empty_layers:
+            return mask
+        with self._pending_lock:
+            future = self._pending.get(layer)
+            if future is not None and future.cancel():
+                del self._pending[layer]
+                future = None
+        if future is not None:
+            # Already being rasterized in the background, wait for it instead of doing it twice
+            return future.result()
+        return self._build_mask(layer)
+
+    def _prefetch_layer(self, layer):
+        try:
+            return self._build_mask(layer)
+        finally:
+            with self._pending_lock:
+                self._pending.pop(layer, None)
+
+    def _build_mask(self, layer):
+        with metrics.timer('mask_rasterize'):
+            mask = self._rasterize(layer)
+        if mask is None:
+            self._empty_layers.add(layer)
+        else:
+            self.masks.put(layer, mask)
+        return mask
+
+    def _rasterize(self, layer):
+        moves = self.parsed_gcode.get(layer)
+        if not moves:
+            return None
+        coordinates = self._extract_coordinates_with_travel(moves)
+        if not (coordinates['X'] and coordinates['Y']):  # Only generate mask if there are coordinates
+            return None
+        return self.mask_gen.generate_cropped_mask(coordinates, self.thickness)
 
     def _extract_coordinates_with_travel(self, moves):
         x_coords = []
@@ -94,19 +389,36 @@ class LayerMaskManager:
         return move.get('type') == 'travel'
 
 class MaskHandler:
-    def __init__(self, parsed_gcode, image_width, image_height, pix_per_mm):
+    def __init__(self, parsed_gcode, image_width, image_height, pix_per_mm, cache_mb=256, mask_cache=None,
+                 source=None):
         self.transformer = CoordinateTransformer(pix_per_mm, image_width, image_height)
-        self.mask_manager = LayerMaskManager(parsed_gcode, self.transformer, image_width, image_height)
+        self.mask_manager = LayerMaskManager(
+            parsed_gcode, self.transformer, image_width, image_height, cache_mb, mask_cache, source
+        )
         self.mask_applicator = MaskApplicator()
 
     def generate_masks(self, thickness=1.3):
         self.mask_manager.generate_all_masks(thickness)
 
-    def apply_mask_to_image(self, image, layer, alpha=0.1):
+    def apply_mask_to_image(self, image, layer, alpha=0.1, out=None):
         mask = self.mask_manager.get_mask(layer)
         if mask is None:
             return image  # Return original image if no mask for this layer
-        return self.mask_applicator.apply_mask(image, mask, alpha)
+        with metrics.timer('mask_apply'):
+            return self.mask_applicator.apply(image, mask, alpha, out=out)
+
+    def get_mask(self, layer):
+        # The layer's CroppedMask, None for layers without print moves
+        return self.mask_manager.get_mask(layer)
+
+    def get_bbox(self, layer):
+        mask = self.mask_manager.get_mask(layer)
+        if mask is None or mask.is_empty():
+            return None
+        return mask.bbox
+
+    def close(self):
+        self.mask_manager.close()
 
 # # Usage example
 # def main():
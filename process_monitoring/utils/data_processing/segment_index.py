@@ -0,0 +1,140 @@
+import threading
+
+import numpy as np
+
+from utils.data_processing.gcode_parser import ColumnarGCodeParser
+
+
+class SegmentIndex:
+    # Uniform grid over one layer's print segments in frame pixels. Every cell lists the
+    # segments whose (stroke-widened) bounding box touches it, stored CSR style, so a box query
+    # gathers one contiguous slice per grid row and clips only those candidates exactly.
+    def __init__(self, x0, y0, x1, y1, segment_ids, lines, frame_shape, cell_size=64, radius=0.0):
+        self.x0, self.y0, self.x1, self.y1 = (np.asarray(a, np.float32) for a in (x0, y0, x1, y1))
+        self.segment_ids = np.asarray(segment_ids, np.int64)
+        self.lines = np.asarray(lines, np.int64)
+        self.cell_size = cell_size
+        self.radius = radius
+        height, width = frame_shape[:2]
+        self.grid_w = max(1, -(-width // cell_size))
+        self.grid_h = max(1, -(-height // cell_size))
+        self._build()
+
+    @classmethod
+    def from_moves(cls, moves, transformer, thickness=1.3, start=None, cell_size=64):
+        # moves is a MoveTable of one layer. Each print move is a segment from the position
+        # before it, the same path LayerMaskManager draws, identified by its row in the layer.
+        x, y = transformer.transform(moves['X'], moves['Y'])
+        if start is None and len(x):
+            start = (moves['X'][0], moves['Y'][0])
+        sx, sy = transformer.transform(start[0], start[1]) if start is not None else (0.0, 0.0)
+        prev_x = np.concatenate(([sx], x[:-1]))
+        prev_y = np.concatenate(([sy], y[:-1]))
+        rows = np.flatnonzero(moves['is_print'])
+        return cls(
+            prev_x[rows], prev_y[rows], x[rows], y[rows], rows, moves['line'][rows],
+            (transformer.image_height, transformer.image_width), cell_size,
+            radius=transformer.pix_per_mm * thickness / 2
+        )
+
+    def __len__(self):
+        return len(self.segment_ids)
+
+    def _cells(self, lo, hi, limit):
+        return np.clip(np.floor(lo / self.cell_size), 0, limit - 1).astype(np.int64), \
+            np.clip(np.floor(hi / self.cell_size), 0, limit - 1).astype(np.int64)
+
+    def _build(self):
+        r = self.radius
+        cx0, cx1 = self._cells(np.minimum(self.x0, self.x1) - r, np.maximum(self.x0, self.x1) + r, self.grid_w)
+        cy0, cy1 = self._cells(np.minimum(self.y0, self.y1) - r, np.maximum(self.y0, self.y1) + r, self.grid_h)
+        widths = cx1 - cx0 + 1
+        counts = widths * (cy1 - cy0 + 1)
+
+        # One (cell, segment) pair per covered cell, without a Python loop over segments
+        segments = np.repeat(np.arange(len(counts)), counts)
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        local = np.arange(counts.sum()) - first
+        cells = (cy0[segments] + local // widths[segments]) * self.grid_w + cx0[segments] + local % widths[segments]
+
+        order = np.argsort(cells, kind='stable')
+        self._cell_segments = segments[order]
+        self._cell_start = np.zeros(self.grid_w * self.grid_h + 1, np.int64)
+        np.cumsum(np.bincount(cells, minlength=self.grid_w * self.grid_h), out=self._cell_start[1:])
+
+    def query(self, box):
+        # Rows of the segments a (x1, y1, x2, y2) frame box overlaps, with their G-code lines
+        if not len(self):
+            return self.segment_ids[:0], self.lines[:0]
+        bx0, by0, bx1, by1 = box
+        cx0, cx1 = self._cells(np.float32(bx0), np.float32(bx1), self.grid_w)
+        cy0, cy1 = self._cells(np.float32(by0), np.float32(by1), self.grid_h)
+        starts = self._cell_start[np.arange(cy0, cy1 + 1) * self.grid_w + cx0]
+        ends = self._cell_start[np.arange(cy0, cy1 + 1) * self.grid_w + cx1 + 1]
+        candidates = np.unique(np.concatenate([self._cell_segments[s:e] for s, e in zip(starts, ends)]))
+        if not len(candidates):
+            return self.segment_ids[:0], self.lines[:0]
+        hits = candidates[self._clip(candidates, bx0 - self.radius, by0 - self.radius,
+                                     bx1 + self.radius, by1 + self.radius)]
+        return self.segment_ids[hits], self.lines[hits]
+
+    def _clip(self, candidates, xmin, ymin, xmax, ymax):
+        # Liang-Barsky: does each candidate segment cross the rectangle
+        x0, y0 = self.x0[candidates], self.y0[candidates]
+        dx, dy = self.x1[candidates] - x0, self.y1[candidates] - y0
+        t0 = np.zeros(len(candidates), np.float32)
+        t1 = np.ones(len(candidates), np.float32)
+        inside = np.ones(len(candidates), bool)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for p, q in ((-dx, x0 - xmin), (dx, xmax - x0), (-dy, y0 - ymin), (dy, ymax - y0)):
+                parallel = p == 0
+                inside &= ~(parallel & (q < 0))
+                t = q / p
+                t0 = np.where(~parallel & (p < 0), np.maximum(t0, t), t0)
+                t1 = np.where(~parallel & (p > 0), np.minimum(t1, t), t1)
+        return inside & (t0 <= t1)
+
+
+class ToolpathIndex:
+    # Segment indexes for every layer of a G-code file, built the first time a layer is asked for.
+    # Layers are read from the file through ColumnarGCodeParser's layer index, so the whole
+    # toolpath never has to be held as move dicts.
+    def __init__(self, gcode_file, transformer, thickness=1.3, cell_size=64, layer_offset=1):
+        self.transformer = transformer
+        # G-code layer of monitor layer n is n + layer_offset, the slicer numbers from 1
+        self.layer_offset = layer_offset
+        self.thickness = thickness
+        self.cell_size = cell_size
+        self.parser = ColumnarGCodeParser()
+        self.parser.parse_file(gcode_file, store_moves=False)
+        self._layers = {}
+        self._lock = threading.Lock()
+
+    def layer(self, layer):
+        with self._lock:
+            index = self._layers.get(layer)
+            if index is None:
+                spans = self.parser.layer_index.get(layer)
+                start = spans[0].position[:2] if spans else None
+                index = SegmentIndex.from_moves(self.parser.load_layer(layer), self.transformer,
+                                                self.thickness, start, self.cell_size)
+                self._layers[layer] = index
+        return index
+
+    def gcode_layer(self, layer):
+        return layer + self.layer_offset
+
+    def annotate(self, defects):
+        # Adds the overlapped segment rows and G-code lines to every defect of a layer record
+        gcode_layer = self.gcode_layer(defects["Layer number"])
+        defects["G-code layer"] = gcode_layer
+        if gcode_layer not in self.parser.layer_index:
+            print(f"Layer {defects['Layer number']}: no G-code layer {gcode_layer} in the toolpath, "
+                  f"check segment_index.layer_offset")
+            return defects
+        index = self.layer(gcode_layer)
+        for defect in defects["Defect data"]:
+            segment_ids, lines = index.query(defect["Defect coordinates"])
+            defect["Segments"] = segment_ids.tolist()
+            defect["G-code lines"] = np.unique(lines).tolist()
+        return defects
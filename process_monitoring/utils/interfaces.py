@@ -1,56 +1,81 @@
 import yaml
 import time
-import digitalio as IO
-import board
+import threading
 import logging
-import neopixel_spi as neo
+
+from utils.telemetry import metrics
 
 logger = logging.getLogger(__name__)
 
+def hardware_gpio():
+    # Imported here so the simulated backend works on machines without blinka
+    import board
+    import digitalio
+    return board, digitalio
+
+# Mach4 wiring of the GPIO board, pins can be remapped per cell with gpio.pins
+DEFAULT_PINS = {
+    # INPUTS TO PYTHON (outputs of Mach4)
+    'load': 'C0',
+    'laser': 'C1',  # laser start
+    'save': 'C2',  # save laser
+    'exit': 'C3',  # spare digital input, used to leave the monitoring loop
+    'rewind': 'C4',  # cancel output 6/rewind
+    'photo': 'C5',  # take photo
+    # OUTPUTS FROM PYTHON (inputs of Mach4)
+    'spare': 'D4',
+    'planarize': 'D5',  # overextrusion signal
+    'rework': 'D6',  # underextrusion signal
+    'continue_print': 'D7',  # loop exit
+}
+INPUT_PINS = ('load', 'laser', 'save', 'exit', 'rewind', 'photo')
+OUTPUT_PINS = ('spare', 'planarize', 'rework', 'continue_print')
+
 class GPIOManager:
     def __init__(
-            self
+            self,
+            backend=None,
+            pins=None
         ):
-        self.load_in = IO.DigitalInOut(board.C0) 
-        self.load_in.direction = IO.Direction.INPUT
-        #Laser start input
-        self.laser_in = IO.DigitalInOut(board.C1)
-        self.laser_in.direction = IO.Direction.INPUT
-        #Save laser
-        self.save_in = IO.DigitalInOut(board.C2)
-        self.save_in.direction = IO.Direction.INPUT
-        #spare digital input
-        self.exit_in = IO.DigitalInOut(board.C3)
-        self.exit_in.direction = IO.Direction.INPUT
-        #Cancel output 6/rewind
-        self.rewind_in = IO.DigitalInOut(board.C4)
-        self.rewind_in.direction = IO.Direction.INPUT
-        #take photo
-        self.photo_in = IO.DigitalInOut(board.C5) 
-        self.photo_in.direction = IO.Direction.INPUT
-        ####################################
-        #OUTPUTS FROM PYTHON (inputs Mach4)
-        #spare output signal
-        self.spare = IO.DigitalInOut(board.D4)
-        self.spare.direction = IO.Direction.OUTPUT
-        #overextrusion signal
-        self.planarize = IO.DigitalInOut(board.D5)
-        self.planarize.direction = IO.Direction.OUTPUT
-        #underextrusion signal
-        self.rework = IO.DigitalInOut(board.D6)
-        self.rework.direction = IO.Direction.OUTPUT
-        #loop exit
-        self.continue_print = IO.DigitalInOut(board.D7)
-        self.continue_print.direction = IO.Direction.OUTPUT
+        # backend is anything with .board and .digitalio, e.g. utils.simulation.SimulatedBoard
+        board, IO = (backend.board, backend.digitalio) if backend is not None else hardware_gpio()
+        # pins overrides DEFAULT_PINS, a pin mapped to None is not wired on this cell
+        self.pins = {**DEFAULT_PINS, **(pins or {})}
+
+        def pin(name, direction):
+            if self.pins[name] is None:
+                return None
+            io = IO.DigitalInOut(getattr(board, self.pins[name]))
+            io.direction = direction
+            return io
+
+        self.load_in = pin('load', IO.Direction.INPUT)
+        self.laser_in = pin('laser', IO.Direction.INPUT)
+        self.save_in = pin('save', IO.Direction.INPUT)
+        self.exit_in = pin('exit', IO.Direction.INPUT)
+        self.rewind_in = pin('rewind', IO.Direction.INPUT)
+        self.photo_in = pin('photo', IO.Direction.INPUT)
+        self.spare = pin('spare', IO.Direction.OUTPUT)
+        self.planarize = pin('planarize', IO.Direction.OUTPUT)
+        self.rework = pin('rework', IO.Direction.OUTPUT)
+        self.continue_print = pin('continue_print', IO.Direction.OUTPUT)
 
         #initialize output values
         logger.debug("class GpIO calling sleep for 100ms")
         time.sleep(0.1)
 
-        self.planarize.value = 0
-        self.rework.value = 0
-        self.continue_print.value = 0
-        self.spare.value = 0
+        for name in OUTPUT_PINS:
+            output = getattr(self, name)
+            if output is not None:
+                output.value = 0
+
+        self.inputs = {
+            name: getattr(self, f"{name}_in") for name in INPUT_PINS if getattr(self, f"{name}_in") is not None
+        }
+        # A backend that can block until an input is written, e.g. SimulatedBoard. The FT232H
+        # behind blinka cannot, its inputs are polled.
+        self.edge_source = backend if hasattr(backend, 'wait_for_change') else None
+        self.last_signal_time = None
 
     def should_capture_image(self) -> bool:
         return self.photo_in.value
@@ -59,23 +84,145 @@ class GPIOManager:
         return self.exit_in.value
 
     def signal_planarize(self):
-        self.planarize.value = 1
+        with metrics.timer('gpio_signal', signal='planarize'):
+            self.planarize.value = 1
+        self.last_signal_time = time.perf_counter()
 
     def signal_rework(self):
-        self.rework.value = 1
-    
+        with metrics.timer('gpio_signal', signal='rework'):
+            self.rework.value = 1
+        self.last_signal_time = time.perf_counter()
+
     def cleanup(self):
         print("We should have some cleanup tasks here")
 
+class TriggerEvent:
+    def __init__(self, name, timestamp):
+        self.name = name
+        self.timestamp = timestamp  # time.perf_counter() when the edge was first seen
+        self.wall_time = time.time() - (time.perf_counter() - timestamp)
+
+    def __repr__(self):
+        return f"TriggerEvent({self.name!r}, {self.timestamp:.6f})"
+
+class GPIOEventMonitor:
+    # Turns GPIOManager inputs into debounced rising-edge events. The FT232H behind blinka
+    # has no pin interrupts, so a background thread samples the inputs every poll_interval and
+    # callers block on wait_for() instead of polling themselves. With a backend that can block
+    # until an input changes the thread sleeps until then, and only polls while a change settles.
+    def __init__(self, gpio_manager, pins=('photo', 'exit'), poll_interval=0.005, debounce=None):
+        self.gpio_manager = gpio_manager
+        self.poll_interval = poll_interval
+        # A level has to hold for two samples to count, None derives it from poll_interval
+        self.debounce = 2 * poll_interval if debounce is None else debounce
+        self._check_pins(pins)
+        self._callbacks = {name: [] for name in pins}
+        self._state = {}
+        self._pending = []
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def on_rising(self, name, callback):
+        self._check_pins([name])
+        self._callbacks.setdefault(name, []).append(callback)
+
+    def _check_pins(self, names):
+        # A watched input mapped to None in gpio.pins would otherwise kill the sampler thread
+        missing = [name for name in names if name not in self.gpio_manager.inputs]
+        if missing:
+            raise ValueError(
+                f"GPIO inputs {', '.join(missing)} are watched but not wired, map them in gpio.pins "
+                f"(wired inputs: {', '.join(self.gpio_manager.inputs) or 'none'})"
+            )
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, name='gpio-events', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def wait_for(self, names=None, timeout=None):
+        # Next rising edge on any of names, or None once timeout runs out.
+        # Edges on other pins stay queued for whoever waits on them.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                for i, event in enumerate(self._pending):
+                    if names is None or event.name in names:
+                        return self._pending.pop(i)
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def clear(self):
+        with self._cond:
+            self._pending.clear()
+
+    def _sample(self):
+        source = self.gpio_manager.edge_source
+        while not self._stop.is_set():
+            seen = source.changes if source is not None else None
+            now = time.perf_counter()
+            for name in list(self._callbacks):
+                value = bool(self.gpio_manager.inputs[name].value)
+                state = self._state.get(name)
+                if state is None:
+                    # A line already held high when we start watching it is not an edge
+                    self._state[name] = [value, value, now]
+                    continue
+                stable, candidate, since = state
+                if value != candidate:
+                    state[1] = value
+                    state[2] = now
+                elif value != stable and now - since >= self.debounce:
+                    state[0] = value
+                    if value:
+                        self._emit(TriggerEvent(name, since))
+            settling = any(state[0] != state[1] for state in self._state.values())
+            if source is not None and not settling:
+                # Woken by the next input write, or after a while to notice stop()
+                source.wait_for_change(seen, timeout=0.1)
+            else:
+                time.sleep(self.poll_interval)
+
+    def _emit(self, event):
+        with self._cond:
+            self._pending.append(event)
+            self._cond.notify_all()
+        for callback in self._callbacks.get(event.name, []):
+            try:
+                callback(event)
+            except Exception as exc:
+                logger.exception("GPIO callback for %s failed: %s", event.name, exc)
+
 class LEDController:
-    def __init__(self, num_pixels=24, pixel_order=neo.GRB):
+    def __init__(self, num_pixels=24, pixel_order=None, spi_pins=None):
         self.num_pixels = num_pixels
         self.pixel_order = pixel_order
+        # {'clock': ..., 'mosi': ...} board pin names for a strip not on the default SPI bus
+        self.spi_pins = spi_pins
         self.pixels = None
         self.setup_leds()
 
     def setup_leds(self):
-        spi = board.SPI()
+        import board
+        import neopixel_spi as neo
+        if self.pixel_order is None:
+            self.pixel_order = neo.GRB
+        if self.spi_pins is not None:
+            import busio
+            spi = busio.SPI(getattr(board, self.spi_pins['clock']), MOSI=getattr(board, self.spi_pins['mosi']))
+        else:
+            spi = board.SPI()
         self.pixels = neo.NeoPixel_SPI(
             spi, 
             self.num_pixels,
@@ -105,6 +252,17 @@ class LEDController:
 # led_controller.cleanup()  # Clean up when done
 
 
+def merge_config(base, override):
+    # Nested dicts are merged key by key, anything else in override replaces the base value
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
 def load_config(path):
     with open(path) as stream:
         try:
@@ -0,0 +1,158 @@
+import sys
+import time
+import threading
+from time import strftime, gmtime
+
+import numpy as np
+
+
+def user_buffer_class(neoapi):
+    # neoapi only hands images to Python objects derived from its own BufferBase
+    class FrameBuffer(neoapi.BufferBase):
+        def __init__(self, size):
+            neoapi.BufferBase.__init__(self)
+            self.memory = np.empty(size, np.uint8)
+            self.RegisterMemory(self.memory, size)
+
+    return FrameBuffer
+
+
+class FrameSlot:
+    def __init__(self, image, memory):
+        self.image = image  # holding the neoapi image keeps its buffer out of the camera's queue
+        self.memory = memory  # the user buffer's array, every frame view handed out refers to it
+        self.baseline = None
+
+    def in_use(self):
+        return sys.getrefcount(self.memory) > self.baseline
+
+
+class ContinuousAcquisition:
+    # Keeps the camera streaming in trigger mode into a fixed set of preallocated user buffers
+    # and hands frames out as views of those buffers. A buffer goes back to the camera once
+    # nothing but this class refers to its frame, so frames still queued in the pipeline or the
+    # artifact writer are never overwritten. The last free buffer is never lent out: that frame
+    # is copied and its buffer returned straight away, so the camera always has somewhere to write.
+    #
+    # The LEDs follow the exposure instead of a fixed sleep. With the software trigger they
+    # are switched on led_settle seconds before the trigger and off as soon as the exposure
+    # has ended. With the hardware trigger (Mach4 wired to trigger_line) the camera delays the
+    # exposure by led_settle and the LEDs are on from the trigger until the frame arrives.
+    def __init__(self, camera, neoapi, led_controller, config, exposure_us):
+        self.camera = camera
+        self.led_controller = led_controller
+        self.exposure = exposure_us / 1e6
+        self.trigger = config.get('trigger', 'software')
+        self.trigger_line = config.get('trigger_line', 'Line0')
+        self.buffer_count = config.get('buffers', 6)
+        self.led_settle = config.get('led_settle', 0.02)
+        self.strobe_margin = config.get('strobe_margin', 0.002)
+        self.timeout = config.get('timeout', 2.0)
+        self.copied = 0
+        self.exposure_windows = []  # (led on, trigger or None, led off) in time.perf_counter() seconds
+        self._slots = []
+        self._buffers = []
+        self._lock = threading.Lock()
+        self._configure(neoapi)
+
+    def _configure(self, neoapi):
+        f = self.camera.f
+        f.TriggerMode.SetString('On')
+        if self.trigger == 'hardware':
+            f.TriggerSource.SetString(self.trigger_line)
+            f.TriggerActivation.SetString('RisingEdge')
+            f.TriggerDelay.Set(self.led_settle * 1e6)
+        else:
+            f.TriggerSource.SetString('Software')
+            f.TriggerDelay.Set(0)
+
+        self.camera.SetImageBufferCount(self.buffer_count)
+        self.shape = (int(f.Height.Get()), int(f.Width.Get()))  # Mono8
+        try:
+            payload = int(f.PayloadSize.Get())
+            buffer_class = user_buffer_class(neoapi)
+            self.camera.SetUserBufferMode(True)
+            for _ in range(self.buffer_count):
+                buffer = buffer_class(payload)
+                self.camera.AddUserBuffer(buffer)
+                self._buffers.append(buffer)
+            self.user_buffers = True
+        except Exception as exc:
+            # Frames are then copied out of neoapi's own buffers
+            print(f"User buffers unavailable, using camera buffers: {exc}")
+            self.user_buffers = False
+        print(f"Continuous acquisition: {self.trigger} trigger, {self.buffer_count} buffers")
+
+    def grab(self):
+        # Same return as CameraHandler.grab_image: (mono frame, timestamp string)
+        self._recycle()
+        if self.trigger == 'hardware':
+            image = self._wait_for_hardware_frame()
+        else:
+            image = self._software_frame()
+        if image.IsEmpty():
+            raise TimeoutError(f"No frame from the camera within {self.timeout}s")
+        timestamp = strftime("%d_%m_%y_%H_%M_%S", gmtime())
+        return self._lend(image), timestamp
+
+    def _software_frame(self):
+        self.led_controller.toggle_leds(1)
+        led_on = time.perf_counter()
+        time.sleep(self.led_settle)
+        try:
+            trigger = time.perf_counter()
+            self.camera.f.TriggerSoftware.Execute()
+            time.sleep(self.exposure + self.strobe_margin)
+        finally:
+            self.led_controller.toggle_leds(0)
+        self.exposure_windows.append((led_on, trigger, time.perf_counter()))
+        return self.camera.GetImage(int(self.timeout * 1000))
+
+    def _wait_for_hardware_frame(self):
+        # Called as soon as the photo trigger is seen, the camera's TriggerDelay covers the LED rise
+        self.led_controller.toggle_leds(1)
+        led_on = time.perf_counter()
+        try:
+            image = self.camera.GetImage(int(self.timeout * 1000))
+        finally:
+            self.led_controller.toggle_leds(0)
+        self.exposure_windows.append((led_on, None, time.perf_counter()))
+        return image
+
+    def _lend(self, image):
+        if not self.user_buffers:
+            # neoapi owns the memory and gives no way to tell when a view of it is dropped
+            return image.GetNPArray().copy()
+
+        slot = FrameSlot(image, image.GetUserBuffer().memory)
+        # References before any frame is handed out, views of the buffer add to it
+        slot.baseline = sys.getrefcount(slot.memory)
+        frame = slot.memory[:self.shape[0] * self.shape[1]].reshape(self.shape)
+        with self._lock:
+            if len(self._slots) + 1 >= self.buffer_count:
+                # Last free buffer, copy the frame and let the camera have the buffer back
+                self.copied += 1
+                return frame.copy()
+            self._slots.append(slot)
+        return frame
+
+    def _recycle(self):
+        # Release the images whose frames nobody holds any more, which requeues their buffers
+        with self._lock:
+            self._slots = [slot for slot in self._slots if slot.in_use()]
+
+    def in_use(self):
+        self._recycle()
+        return len(self._slots)
+
+    def close(self):
+        with self._lock:
+            self._slots = []
+        try:
+            self.camera.f.TriggerMode.SetString('Off')
+            if self.user_buffers:
+                for buffer in self._buffers:
+                    self.camera.RevokeUserBuffer(buffer)
+                self.camera.SetUserBufferMode(False)
+        except Exception as exc:
+            print(f"Could not restore camera acquisition settings: {exc}")
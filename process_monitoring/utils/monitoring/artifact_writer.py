@@ -0,0 +1,138 @@
+import queue
+import threading
+import time
+import traceback
+from pathlib import Path
+
+import cv2
+
+from utils.data_processing.frame_archive import FrameArchive
+from utils.monitoring.detections import render_overlay
+from utils.telemetry import metrics
+
+_STOP = object()
+
+# Per artifact kind: filename pattern and the format used when the config does not say
+ARTIFACT_KINDS = {
+    'raw': ("image_{stem}", {'format': 'bmp'}),
+    'masked': ("mask_image_{stem}", {'format': 'bmp'}),
+    'overlay': ("image_{stem}_predictions", {'format': 'jpeg', 'quality': 95}),
+}
+
+EXTENSIONS = {'bmp': '.bmp', 'png': '.png', 'jpeg': '.jpeg', 'jpg': '.jpg', 'tiff': '.tiff', 'webp': '.webp'}
+
+
+def encode_params(settings):
+    fmt = settings.get('format', 'bmp')
+    if fmt == 'png':
+        return [cv2.IMWRITE_PNG_COMPRESSION, settings.get('compression', 1)]
+    if fmt in ('jpeg', 'jpg'):
+        return [cv2.IMWRITE_JPEG_QUALITY, settings.get('quality', 95)]
+    if fmt == 'webp':
+        # Quality above 100 switches webp to lossless
+        return [cv2.IMWRITE_WEBP_QUALITY, settings.get('quality', 101)]
+    if fmt == 'tiff':
+        return [cv2.IMWRITE_TIFF_COMPRESSION, settings.get('compression', 1)]
+    return []
+
+
+class ArtifactWriter:
+    # Writes frames and prediction overlays from a small pool of worker threads.
+    # submit() blocks once queue_size artifacts are waiting, so a slow disk slows the
+    # persistence stage down instead of filling memory with frames.
+    def __init__(self, output_dir: Path, config=None, workers=2, queue_size=16):
+        config = config or {}
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(exist_ok=True, parents=True)
+        self.settings = {
+            kind: {**default, **config.get(kind, {})} for kind, (_, default) in ARTIFACT_KINDS.items()
+        }
+        archive_config = config.get('archive', {})
+        self.archive = None
+        if archive_config.get('enabled', False):
+            # Frames of known layers go into one archive instead of an image file each
+            self.archive = FrameArchive(self.output_dir / archive_config.get('name', 'frames.archive'), archive_config)
+            self.archived_kinds = tuple(archive_config.get('kinds', ['raw', 'masked']))
+            self.keep_files = archive_config.get('keep_files', False)
+        self.written = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=config.get('queue_size', queue_size))
+        self._lock = threading.Lock()
+        self._closed = False
+        self._workers = [
+            threading.Thread(target=self._work, name=f"artifact-writer-{i}", daemon=True)
+            for i in range(config.get('workers', workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def path(self, kind, stem):
+        pattern, _ = ARTIFACT_KINDS[kind]
+        extension = EXTENSIONS[self.settings[kind]['format']]
+        return self.output_dir / (pattern.format(stem=stem) + extension)
+
+    def submit_frame(self, kind, stem, image, on_done=None, layer=None):
+        if image is None:
+            return None
+        path = self.path(kind, stem)
+        self._put((path, kind, lambda: image, on_done, layer))
+        return path
+
+    def submit_overlay(self, stem, results, on_done=None, layer=None):
+        # The overlay is only drawn by the worker that writes it
+        path = self.path('overlay', stem)
+        self._put((path, 'overlay', lambda: render_overlay(results[0]), on_done, layer))
+        return path
+
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def flush(self):
+        self._queue.join()
+
+    def close(self, timeout=60):
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+        if any(worker.is_alive() for worker in self._workers):
+            print(f"Artifact writer still had {self.pending()} writes pending after {timeout}s")
+        elif self.archive is not None:
+            self.archive.close()
+
+    def _put(self, item):
+        if self._closed:
+            raise RuntimeError("Artifact writer has been closed")
+        self._queue.put(item)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                path, kind, render, on_done, layer = item
+                with metrics.timer('disk_write', kind=kind):
+                    image = render()
+                    archived = self.archive is not None and layer is not None and kind in self.archived_kinds
+                    if archived:
+                        # Indexed under the file name it would have had, which defect records refer to
+                        self.archive.append(kind, layer, path.name, image)
+                    if not archived or self.keep_files:
+                        if not cv2.imwrite(str(path), image, encode_params(self.settings[kind])):
+                            raise IOError(f"cv2.imwrite could not write {path}")
+                with self._lock:
+                    self.written += 1
+                if on_done:
+                    on_done(path, image)
+            except Exception as exc:
+                with self._lock:
+                    self.failed += 1
+                print(f"Artifact write failed: {exc}")
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
@@ -1,18 +1,37 @@
 import json
-import neoapi
 import cv2
 import os#
 from pathlib import Path
 from time import strftime, gmtime, sleep
 from utils.data_processing.mask_handler import MaskHandler
 from utils.interfaces import LEDController
+from utils.monitoring.acquisition import ContinuousAcquisition
+from utils.telemetry import metrics
+
+
+def load_cad_file(cad_file):
+    with open(cad_file) as f:
+        coord_data = json.loads(f.read())
+    if isinstance(coord_data, dict):
+        # JSON object keys are strings, the mask handler looks layers up by int
+        coord_data = {int(layer): moves for layer, moves in coord_data.items()}
+    return coord_data
+
+
+def camera_mask_handler(config, coord_data, mask_cache=None, source=None):
+    # The mask handler the camera applies to its frames, shared with offline replay. source is
+    # the file coord_data was loaded from.
+    return MaskHandler(coord_data, config.get('image_width', 5472), config.get('image_height', 3648),
+                       config.get('pix_per_mm', 56), cache_mb=config.get('mask_cache_mb', 256),
+                       mask_cache=mask_cache, source=source)
 
 
 class CameraHandler:
-    def __init__(self, config, output_path: Path):
+    def __init__(self, config, output_path: Path, mask_cache=None, led_controller=None, defer_setup=False):
         self.config = config
         self.camera = None
         self.mask_handler = None
+        self.mask_cache = mask_cache
         self.result = 0
         self.correction = 1
         self.exposure = config.get('exposure', 200000)  # Default to 200000 if not specified
@@ -22,28 +41,32 @@ class CameraHandler:
         self.coord_data = []
         self.output_path = output_path
         self.data_type = 'Camera'
-        self.led_controller = LEDController()
-        self.setup_camera()
-        self.connect_camera()
+        self.led_controller = led_controller if led_controller is not None else LEDController()
+        self.acquisition = None
+        # With defer_setup the caller runs setup_camera and connect_camera, e.g. in parallel
+        if not defer_setup:
+            self.setup_camera()
+            self.connect_camera()
 
     def setup_camera(self):
         if self.config.get('masking', False):
-            cad_file = self.config['cad_file']
-            with open(cad_file) as f:
-                data = f.read()
-            self.coord_data = json.loads(data)
+            self.coord_data = load_cad_file(self.config['cad_file'])
             self.total_layers = len(self.coord_data)
             print(f"Total layers: {self.total_layers}")
 
             # Initialize MaskHandler
-            image_width = self.config.get('image_width', 5472)
-            image_height = self.config.get('image_height', 3648)
-            self.mask_handler = MaskHandler(self.coord_data, image_width, image_height, self.pix_per_mm)
+            self.mask_handler = camera_mask_handler(self.config, self.coord_data, self.mask_cache,
+                                                    source=self.config['cad_file'])
             self.mask_handler.generate_masks()
 
     def connect_camera(self):
+        import neoapi
         self.camera = neoapi.Cam()
-        self.camera.Connect()
+        # With several cameras on one host each cell names its own by serial number
+        if self.config.get('serial'):
+            self.camera.Connect(str(self.config['serial']))
+        else:
+            self.camera.Connect()
         if self.camera.IsConnected():
             self.camera.f.UserSetSelector.SetString('Default')
             self.camera.f.UserSetLoad.Execute()
@@ -51,39 +74,83 @@ class CameraHandler:
             self.camera.f.ExposureAuto.SetString('Off')
             self.camera.f.ExposureMode.SetString('Timed')
             self.camera.f.ExposureTime.Set(self.exposure)
+            acquisition_config = self.config.get('acquisition', {})
+            if acquisition_config.get('mode', 'single') == 'continuous':
+                self.acquisition = ContinuousAcquisition(
+                    self.camera, neoapi, self.led_controller, acquisition_config, self.exposure
+                )
             print("Camera connected and configured successfully")
         else:
             raise ConnectionError("Failed to connect to the camera")
 
     def capture_and_save_image(self, layer):
+        img, timestamp = self.grab_image()
+        masked_img = self.apply_mask(img, layer)
+        filenamepath = self.save_images(img, masked_img, timestamp)
+        return (img if masked_img is None else masked_img), filenamepath
+
+    def grab_image(self):
+        metrics.frame()
+        with metrics.timer('camera_grab'):
+            return self._grab_image()
+
+    def _grab_image(self):
+        if self.acquisition is not None:
+            return self.acquisition.grab()
         self.led_controller.toggle_leds(1)
         sleep(0.5)
 
         img = self.camera.GetImage().GetNPArray()
         timestamp = strftime("%d_%m_%y_%H_%M_%S", gmtime())
 
-        filename = f"image_{timestamp}.bmp"
-        filenamepath = self.output_path / self.data_type / filename
-        filenamepath.parent.mkdir(exist_ok=True, parents=True)
-        cv2.imwrite(filenamepath, img)
-
         self.led_controller.toggle_leds(0)
         print('Smile :)')
+        return img, timestamp
+
+    def apply_mask(self, img, layer, out=None):
+        if self.mask_handler:
+            return self.mask_handler.apply_mask_to_image(img, layer, out=out)
+        return None
+
+    def roi(self, layer):
+        # Toolpath bounding box of the layer in frame pixels, None when masking is off
+        if self.mask_handler:
+            return self.mask_handler.get_bbox(layer)
+        return None
 
+    def toolpath_mask(self, layer):
         if self.mask_handler:
-            masked_img = self.mask_handler.apply_mask_to_image(img, layer)
+            return self.mask_handler.get_mask(layer)
+        return None
+
+    def image_path(self, timestamp):
+        return self.output_path / self.data_type / f"image_{timestamp}.bmp"
+
+    def save_images(self, img, masked_img, timestamp):
+        with metrics.timer('disk_write', kind='camera'):
+            return self._save_images(img, masked_img, timestamp)
+
+    def _save_images(self, img, masked_img, timestamp):
+        filenamepath = self.image_path(timestamp)
+        filenamepath.parent.mkdir(exist_ok=True, parents=True)
+        cv2.imwrite(filenamepath, img)
+
+        if masked_img is not None:
             maskname = f"mask_image_{timestamp}.bmp"
             masknamepath = os.path.join(self.output_path, self.data_type, maskname)
             cv2.imwrite(masknamepath, masked_img)
-            return masked_img, filenamepath
-        else:
-            return img, filenamepath
+        return filenamepath
 
     def capture_image(self, layer):
         if not self.camera.IsConnected():
             raise ConnectionError("Camera is not connected")
 
         return self.capture_and_save_image(layer)
+    def close(self):
+        if self.acquisition is not None:
+            self.acquisition.close()
+            self.acquisition = None
+
     def get_total_layers(self):
         return self.total_layers
 
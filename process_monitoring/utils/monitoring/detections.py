@@ -0,0 +1,43 @@
+import cv2
+import numpy as np
+
+# Helpers for building and reshaping the ultralytics results list that
+# YOLOInference.process_results consumes, whatever produced the boxes.
+
+
+def boxes_array(results) -> np.ndarray:
+    # (N, 6) float32 [x1, y1, x2, y2, conf, cls] on the host, one transfer per result
+    data = results[0].boxes.data
+    if hasattr(data, 'cpu'):
+        data = data.cpu().numpy()
+    return np.asarray(data, dtype=np.float32).reshape(-1, 6)
+
+
+def build_results(orig_img, names, data, path=None, speed=None):
+    from ultralytics.engine.results import Results
+    result = Results(orig_img, path=path, names=names, boxes=np.asarray(data, dtype=np.float32).reshape(-1, 6))
+    if speed is not None:
+        result.speed = speed
+    return [result]
+
+
+def remap_boxes(data, scale, offset, frame_shape=None):
+    # Model-space boxes back into full-frame pixels: x / sx + x0, y / sy + y0
+    data = np.array(data, dtype=np.float32, copy=True).reshape(-1, 6)
+    sx, sy = scale
+    x0, y0 = offset
+    data[:, [0, 2]] = data[:, [0, 2]] / sx + x0
+    data[:, [1, 3]] = data[:, [1, 3]] / sy + y0
+    if frame_shape is not None:
+        data[:, [0, 2]] = data[:, [0, 2]].clip(0, frame_shape[1])
+        data[:, [1, 3]] = data[:, [1, 3]].clip(0, frame_shape[0])
+    return data
+
+
+def render_overlay(result):
+    # Results.plot() expects a 3-channel image, frames from the mono camera are converted here
+    # so the conversion only happens when an overlay is actually drawn
+    orig_img = result.orig_img
+    if orig_img is not None and orig_img.ndim == 2:
+        return result.plot(img=cv2.cvtColor(orig_img, cv2.COLOR_GRAY2BGR))
+    return result.plot()
@@ -0,0 +1,229 @@
+import os
+import ast
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import yaml
+
+from utils.monitoring.detections import build_results
+from utils.monitoring.tiled_inference import merge_boxes
+
+# Everything that runs the detector sits behind InferenceBackend.predict, which returns the
+# ultralytics results list process_results reads, whichever engine produced the boxes.
+
+
+class InferenceBackend:
+    name = 'base'
+
+    def __init__(self, config):
+        self.config = config
+        self.names = {}
+        self.threads = config.get('threads')
+        self.warmup_time = None
+
+    def predict(self, images, imgsz, conf, **kwargs):
+        raise NotImplementedError
+
+    def warmup(self, imgsz, runs=1):
+        # Pays graph compilation and allocator costs at start-up instead of on layer 0
+        if runs <= 0:
+            return
+        shape = (imgsz, imgsz) if isinstance(imgsz, int) else tuple(imgsz)
+        dummy = np.zeros((*shape, 3), np.uint8)
+        start = time.perf_counter()
+        for _ in range(runs):
+            self.predict(dummy, imgsz, conf=0.99, verbose=False)
+        self.warmup_time = time.perf_counter() - start
+        print(f"{self.name} backend warmed up in {self.warmup_time:.2f}s ({runs} runs)")
+
+
+class UltralyticsBackend(InferenceBackend):
+    # Eager PyTorch, or any export format ultralytics loads itself (torchscript, onnx, openvino)
+    name = 'ultralytics'
+
+    def __init__(self, model_path, config):
+        super().__init__(config)
+        import torch
+        from ultralytics import YOLO
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        self.format = config.get('format', 'torch')
+        self.name = f"ultralytics-{self.format}"
+        self.model = YOLO(str(model_path), task='detect')
+        if self.format == 'torch':
+            self.model.to('cuda' if torch.cuda.is_available() else 'cpu')
+        self.names = self.model.names
+
+    def predict(self, images, imgsz, conf, **kwargs):
+        return self.model.predict(images, save=False, imgsz=imgsz, conf=conf, **kwargs)
+
+
+class NativeExportBackend(InferenceBackend):
+    # Runs an exported YOLOv8-style detector ((1, 4 + classes, anchors) output) directly on
+    # its runtime, which gives control over threads and skips the torch preprocessing path.
+    # Letterboxing, decoding and NMS mirror what ultralytics does for the same export.
+    iou = 0.7
+    pad_value = 114
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.iou = config.get('iou', self.iou)
+        self._buffers = {}
+
+    def predict(self, images, imgsz, conf, **kwargs):
+        if isinstance(images, np.ndarray):
+            images = [images]
+        shape = (imgsz, imgsz) if isinstance(imgsz, int) else tuple(imgsz)
+        results = []
+        for image in images:
+            start = time.perf_counter()
+            blob, ratio, pad = self._letterbox(image, shape)
+            output = self._run(blob)
+            data = self._decode(output, conf, ratio, pad, image.shape)
+            elapsed = (time.perf_counter() - start) * 1000
+            results += build_results(image, self.names, data, speed={'preprocess': 0.0, 'inference': elapsed,
+                                                                     'postprocess': 0.0})
+        return results
+
+    def _run(self, blob):
+        raise NotImplementedError
+
+    def _letterbox(self, image, shape):
+        height, width = image.shape[:2]
+        ratio = min(shape[0] / height, shape[1] / width)
+        new_w, new_h = int(round(width * ratio)), int(round(height * ratio))
+        pad_x, pad_y = (shape[1] - new_w) // 2, (shape[0] - new_h) // 2
+
+        canvas, blob = self._buffers.get(shape, (None, None))
+        if canvas is None:
+            canvas = np.empty((*shape, 3), np.uint8)
+            blob = np.empty((1, 3, *shape), np.float32)
+            self._buffers[shape] = (canvas, blob)
+        canvas.fill(self.pad_value)
+        target = canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w]
+        resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        target[...] = resized[:, :, None] if resized.ndim == 2 else resized
+
+        np.divide(canvas.transpose(2, 0, 1), 255.0, out=blob[0], casting='unsafe')
+        return blob, ratio, (pad_x, pad_y)
+
+    def _decode(self, output, conf, ratio, pad, frame_shape):
+        preds = np.asarray(output)[0].T  # (anchors, 4 + classes)
+        scores = preds[:, 4:]
+        class_ids = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+        keep = confidences >= conf
+        if not keep.any():
+            return np.zeros((0, 6), np.float32)
+
+        cx, cy, w, h = preds[keep, :4].T
+        data = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2,
+                         confidences[keep], class_ids[keep]], axis=1).astype(np.float32)
+        data = merge_boxes(data, self.iou, 'iou', 'nms')
+        data[:, [0, 2]] = ((data[:, [0, 2]] - pad[0]) / ratio).clip(0, frame_shape[1])
+        data[:, [1, 3]] = ((data[:, [1, 3]] - pad[1]) / ratio).clip(0, frame_shape[0])
+        return data
+
+
+class OnnxRuntimeBackend(NativeExportBackend):
+    name = 'onnxruntime'
+
+    def __init__(self, model_path, config):
+        super().__init__(config)
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(model_path), options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata['names']) if 'names' in metadata else config.get('names', {})
+
+    def _run(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OpenVINOBackend(NativeExportBackend):
+    name = 'openvino'
+
+    def __init__(self, model_path, config):
+        super().__init__(config)
+        import openvino as ov
+        model_path = Path(model_path)
+        xml = model_path if model_path.suffix == '.xml' else next(model_path.glob('*.xml'))
+        core = ov.Core()
+        ov_config = {'PERFORMANCE_HINT': 'LATENCY'}
+        if self.threads:
+            ov_config['INFERENCE_NUM_THREADS'] = self.threads
+        self.compiled = core.compile_model(core.read_model(xml), 'CPU', ov_config)
+        metadata = xml.parent / 'metadata.yaml'
+        if metadata.exists():
+            with open(metadata) as f:
+                self.names = yaml.safe_load(f).get('names', {})
+        else:
+            self.names = config.get('names', {})
+
+    def _run(self, blob):
+        return self.compiled(blob)[0]
+
+
+def export_model(model_path, fmt, imgsz, int8=False, calibration_data=None):
+    # Exports a .pt checkpoint once and reuses the artifact on later starts
+    model_path = Path(model_path)
+    if fmt == 'torch' or model_path.suffix != '.pt':
+        return model_path
+
+    suffix = '_int8' if int8 else ''
+    expected = {
+        'torchscript': model_path.with_suffix('.torchscript'),
+        'onnx': model_path.with_name(f"{model_path.stem}{suffix}.onnx"),
+        'openvino': model_path.with_name(f"{model_path.stem}{suffix}_openvino_model"),
+    }[fmt]
+    if expected.exists():
+        return expected
+
+    from ultralytics import YOLO
+    print(f"Exporting {model_path.name} to {fmt}{' (int8)' if int8 else ''}, this only happens once")
+    if fmt == 'onnx':
+        exported = Path(YOLO(str(model_path)).export(format='onnx', imgsz=imgsz, dynamic=True))
+        if int8:
+            # Dynamic INT8 weights, no calibration set needed
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(str(exported), str(expected), weight_type=QuantType.QUInt8)
+            return expected
+        return exported
+    options = {'data': calibration_data} if int8 and calibration_data else {}
+    exported = Path(YOLO(str(model_path)).export(format=fmt, imgsz=imgsz, int8=int8, dynamic=fmt == 'openvino',
+                                                 **options))
+    if exported != expected and not expected.exists():
+        os.replace(exported, expected)
+    return expected
+
+
+def load_backend(config):
+    # config is the yolo section, the backend options live under yolo.backend
+    backend_config = dict(config.get('backend', {}))
+    fmt = backend_config.get('format', 'torch')
+    runtime = backend_config.get('runtime', 'ultralytics')
+    model_path = export_model(
+        config['model_path'], fmt, config.get('imgsz', 2048),
+        int8=backend_config.get('int8', False), calibration_data=backend_config.get('calibration_data')
+    )
+
+    if runtime == 'native' and fmt == 'onnx':
+        backend = OnnxRuntimeBackend(model_path, backend_config)
+    elif runtime == 'native' and fmt == 'openvino':
+        backend = OpenVINOBackend(model_path, backend_config)
+    elif runtime in ('ultralytics', 'native'):
+        if runtime == 'native':
+            print(f"No native runtime for {fmt}, using ultralytics")
+        backend = UltralyticsBackend(model_path, backend_config)
+    else:
+        raise ValueError(f"Unknown inference runtime: {runtime}")
+
+    backend.warmup(config.get('imgsz', 2048), backend_config.get('warmup_runs', 1))
+    return backend
@@ -0,0 +1,316 @@
+import os
+import sys
+import json
+import socket
+import struct
+import threading
+import socketserver
+from pathlib import Path
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from utils.monitoring.detections import boxes_array, build_results
+from utils.monitoring.inference_backends import load_backend
+from utils.monitoring.yolo_inference import YOLOInference
+
+DEFAULT_SOCKET = '/tmp/champ-inference.sock'
+
+# Frames travel through shared memory, only small JSON messages go over the socket:
+#   hello  {"op": "hello", "config": yolo config}     -> {"names": {...}, "pid": ...}
+#   infer  {"op": "infer", "frames": [frame handle], "profile": name}  -> {"results": [{"boxes": [[x1, y1, x2, y2, conf, cls]], "speed": {...}}]}
+# A frame handle is {"shm": name, "offset", "shape", "dtype", "roi"}. Errors come back as {"error": message}.
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode()
+    sock.sendall(struct.pack('>I', len(data)) + data)
+
+
+def recv_message(sock):
+    header = _recv_exactly(sock, 4)
+    if header is None:
+        return None
+    return json.loads(_recv_exactly(sock, struct.unpack('>I', header)[0]))
+
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            if data:
+                raise ConnectionError("Connection closed mid-message")
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def model_key(config):
+    # The daemon reloads its model when a client's yolo settings differ, daemon settings aside
+    return json.dumps({key: value for key, value in config.items() if key != 'daemon'}, sort_keys=True, default=str)
+
+
+class SharedFrameSlot:
+    def __init__(self, size):
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.memory = np.ndarray((size,), np.uint8, buffer=self.shm.buf)
+        # Every frame view handed out adds to the count, see in_use
+        self.baseline = sys.getrefcount(self.memory)
+
+    def in_use(self):
+        return sys.getrefcount(self.memory) > self.baseline
+
+    def view(self, shape, dtype):
+        return self.memory[:int(np.prod(shape)) * np.dtype(dtype).itemsize].view(dtype).reshape(shape)
+
+    def close(self):
+        self.memory = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # a frame is still referenced, the mapping goes when it does
+        self.shm.unlink()
+
+
+class SharedFramePool:
+    # Frame buffers in shared memory, owned by the monitor. The mask stage writes masked frames
+    # straight into one, so the daemon reads them in place. A buffer is reused once nothing
+    # refers to the frame in it any more, the same rule as FrameBufferPool.
+    def __init__(self, slots=8):
+        self.slots = slots
+        self._slots = []
+        self._lock = threading.Lock()
+
+    def acquire(self, shape, dtype=np.uint8):
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with self._lock:
+            for slot in self._slots:
+                if slot.memory.nbytes >= size and not slot.in_use():
+                    return slot.view(shape, dtype)
+            # Too small free slots are replaced, otherwise the pool grows past its size
+            for i, slot in enumerate(self._slots):
+                if not slot.in_use():
+                    slot.close()
+                    self._slots[i] = SharedFrameSlot(size)
+                    return self._slots[i].view(shape, dtype)
+            if len(self._slots) >= self.slots:
+                print(f"All {len(self._slots)} shared frame buffers are in use, adding another")
+            self._slots.append(SharedFrameSlot(size))
+            return self._slots[-1].view(shape, dtype)
+
+    def handle(self, array):
+        # Where a frame lives in shared memory, None when it is not in one of the slots
+        if not array.flags.c_contiguous:
+            return None
+        address = array.__array_interface__['data'][0]
+        with self._lock:
+            for slot in self._slots:
+                start = slot.memory.__array_interface__['data'][0]
+                if start <= address and address + array.nbytes <= start + slot.memory.nbytes:
+                    return {'shm': slot.shm.name, 'offset': address - start,
+                            'shape': list(array.shape), 'dtype': array.dtype.str}
+        return None
+
+    def close(self):
+        with self._lock:
+            for slot in self._slots:
+                slot.close()
+            self._slots = []
+
+
+class _DaemonHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.attached = {}  # shm name -> SharedMemory, mapped once per connection
+
+    def handle(self):
+        while True:
+            message = recv_message(self.request)
+            if message is None:
+                return
+            try:
+                reply = self.server.daemon.dispatch(message, self.attach)
+            except Exception as exc:
+                reply = {'error': f"{type(exc).__name__}: {exc}"}
+            send_message(self.request, reply)
+
+    def attach(self, name):
+        shm = self.attached.get(name)
+        if shm is None:
+            shm = shared_memory.SharedMemory(name=name)
+            # The monitor owns the segment, keep this process's tracker from unlinking it on exit
+            resource_tracker.unregister(shm._name, 'shared_memory')
+            self.attached[name] = shm
+        return shm
+
+    def finish(self):
+        for shm in self.attached.values():
+            try:
+                shm.close()
+            except BufferError:
+                pass
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class InferenceDaemon:
+    # Keeps the model loaded between monitor restarts. Monitors connect over a Unix socket and
+    # point it at frames in their shared memory, one model call runs at a time.
+    def __init__(self, config, socket_path=DEFAULT_SOCKET):
+        self.socket_path = Path(socket_path)
+        self._lock = threading.Lock()
+        self._key = None
+        self.yolo_inference = None
+        self._load(config)
+
+    def _load(self, config):
+        key = model_key(config)
+        if key != self._key:
+            print("Loading model" if self._key is None else "Model settings changed, reloading")
+            self.yolo_inference = YOLOInference(config, output_path=Path.cwd())
+            self._key = key
+
+    def dispatch(self, message, attach):
+        op = message.get('op')
+        if op == 'hello':
+            with self._lock:
+                self._load(message['config'])
+                return {'names': {str(k): v for k, v in self.yolo_inference.names.items()}, 'pid': os.getpid()}
+        if op == 'infer':
+            images, rois = [], []
+            for frame in message['frames']:
+                shm = attach(frame['shm'])
+                images.append(np.ndarray(frame['shape'], np.dtype(frame['dtype']), buffer=shm.buf,
+                                         offset=frame['offset']))
+                rois.append(tuple(frame['roi']) if frame.get('roi') is not None else None)
+            # The monitor picks the profile for its deadline, the daemon only runs it
+            profile = message.get('profile')
+            with self._lock:
+                if len(images) == 1:
+                    batch = [self.yolo_inference.infer(images[0], rois[0], profile=profile)]
+                else:
+                    batch = self.yolo_inference.infer_batch(images, rois, profile=profile)
+                return {'results': [
+                    {'boxes': boxes_array(results).tolist(), 'speed': getattr(results[0], 'speed', None)}
+                    for results in batch
+                ]}
+        raise ValueError(f"Unknown op {op!r}")
+
+    def serve_forever(self):
+        if self.socket_path.exists():
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                    probe.connect(str(self.socket_path))
+                raise RuntimeError(f"An inference daemon is already listening on {self.socket_path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                self.socket_path.unlink()  # left behind by a daemon that did not shut down cleanly
+        self.server = _UnixServer(str(self.socket_path), _DaemonHandler)
+        self.server.daemon = self
+        print(f"Inference daemon listening on {self.socket_path}")
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.socket_path.unlink(missing_ok=True)
+
+    def shutdown(self):
+        self.server.shutdown()
+
+
+class InferenceClient(YOLOInference):
+    # YOLOInference for the monitor that runs the model in the daemon when one is listening,
+    # and loads it in this process otherwise or once the daemon goes away. Results are rebuilt
+    # around the monitor's own frame, so process_results and the overlays work unchanged.
+    def __init__(self, config, output_path: Path):
+        daemon_config = config.get('daemon', {})
+        self.output_path = output_path
+        self.socket_path = daemon_config.get('socket', DEFAULT_SOCKET)
+        self.frames = SharedFramePool(daemon_config.get('frame_buffers', 8))
+        self.sock = None
+        self.backend = None
+        self._lock = threading.Lock()
+        try:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(daemon_config.get('connect_timeout', 1.0))
+            self.sock.connect(self.socket_path)
+            self.sock.settimeout(None)
+            reply = self._request({'op': 'hello', 'config': config})
+            names = {int(k): v for k, v in reply['names'].items()}
+            print(f"Using the inference daemon at {self.socket_path} (pid {reply['pid']})")
+            self._configure(config, names)
+        except (OSError, ConnectionError, RuntimeError) as exc:
+            # RuntimeError is the daemon answering hello with an error, e.g. it could not load the model
+            print(f"Inference daemon not available at {self.socket_path} ({exc}), loading the model here")
+            self._fallback(config)
+
+    def _fallback(self, config=None):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.backend = load_backend(config or self.config)
+        self._configure(config or self.config, self.backend.names)
+        self._load_profiles()
+
+    def _request(self, message):
+        send_message(self.sock, message)
+        reply = recv_message(self.sock)
+        if reply is None:
+            raise ConnectionError("Inference daemon closed the connection")
+        if 'error' in reply:
+            raise RuntimeError(f"Inference daemon: {reply['error']}")
+        return reply
+
+    def frame_buffer(self, shape, dtype=np.uint8):
+        if self.sock is None:
+            return None
+        return self.frames.acquire(shape, dtype)
+
+    def _infer(self, image, roi=None, profile=None):
+        return self._remote([image], [roi], profile)[0]
+
+    def _infer_batch(self, images, rois, profile):
+        return self._remote(images, rois, profile)
+
+    def _remote(self, images, rois, profile=None):
+        with self._lock:
+            if self.sock is not None:
+                try:
+                    return self._send_frames(images, rois, profile)
+                except (OSError, ConnectionError) as exc:
+                    print(f"Lost the inference daemon ({exc}), loading the model here")
+                    self._fallback()
+        if len(images) == 1:
+            return [YOLOInference._infer(self, images[0], rois[0], profile)]
+        return YOLOInference._infer_batch(self, images, rois, profile)
+
+    def _send_frames(self, images, rois, profile=None):
+        frames, held = [], []
+        for image, roi in zip(images, rois):
+            handle = self.frames.handle(image)
+            if handle is None:
+                # Not written into shared memory by the mask stage, so copied in once
+                buffer = self.frames.acquire(image.shape, image.dtype)
+                buffer[...] = image
+                held.append(buffer)
+                handle = self.frames.handle(buffer)
+            handle['roi'] = [int(v) for v in roi] if roi is not None else None
+            frames.append(handle)
+        reply = self._request({'op': 'infer', 'frames': frames, 'profile': profile})
+        return [
+            build_results(image, self.names, np.asarray(result['boxes'], np.float32).reshape(-1, 6),
+                          speed=result['speed'])
+            for image, result in zip(images, reply['results'])
+        ]
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.frames.close()
+
+# Usage example:
+# daemon (once per host):  python inference_daemon.py --config config.yaml
+# monitor:                 yolo.daemon.enabled: true in config.yaml, ProcessMonitor then builds
+#                          InferenceClient(config['yolo'], output_path) instead of YOLOInference
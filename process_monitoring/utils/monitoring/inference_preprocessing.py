@@ -0,0 +1,82 @@
+import math
+
+import cv2
+import numpy as np
+
+STRIDE = 32
+
+
+class PreparedFrame:
+    def __init__(self, image, scale, offset, frame_shape):
+        self.image = image  # view into the preprocessor's buffer, valid until the next prepare()
+        self.scale = scale  # (sx, sy) model pixels per frame pixel
+        self.offset = offset  # (x0, y0) of the crop in the full frame
+        self.frame_shape = frame_shape
+
+    @property
+    def imgsz(self):
+        return self.image.shape[:2]
+
+
+class RoiPreprocessor:
+    # Crops the frame to the layer's toolpath bounding box plus a margin and resizes it
+    # straight into preallocated buffers, so the model sees the part at a higher effective
+    # resolution and no full-frame RGB copy is made per layer.
+    def __init__(self, imgsz=2048, margin=64):
+        self.imgsz = imgsz
+        self.margin = margin
+        # Flat buffers, a contiguous (h, w) prefix is reshaped out of them for each frame
+        self._gray = np.empty(imgsz * imgsz, np.uint8)
+        self._rgb = np.empty(imgsz * imgsz * 3, np.uint8)
+
+    def roi(self, frame_shape, bbox=None):
+        height, width = frame_shape[:2]
+        if bbox is None:
+            return 0, 0, width, height
+        x0, y0, x1, y1 = bbox
+        return (max(x0 - self.margin, 0), max(y0 - self.margin, 0),
+                min(x1 + self.margin, width), min(y1 + self.margin, height))
+
+    def prepare(self, image, bbox=None, imgsz=None):
+        # imgsz below the buffers' size gives a smaller model input, e.g. for a faster profile
+        imgsz = min(imgsz or self.imgsz, self.imgsz)
+        height, width = image.shape[:2]
+        x0, y0, x1, y1 = self.roi(image.shape, bbox)
+        scale = min(imgsz / (x1 - x0), imgsz / (y1 - y0), 1.0)
+
+        # Output sides are stride multiples. Rather than padding, the crop grows to cover
+        # the extra model pixels, so the scale stays uniform and the letterbox is a no-op.
+        out_w = min(_round_up(math.ceil((x1 - x0) * scale)), imgsz)
+        out_h = min(_round_up(math.ceil((y1 - y0) * scale)), imgsz)
+        x0, x1 = _grow(x0, x1, round(out_w / scale), width)
+        y0, y1 = _grow(y0, y1, round(out_h / scale), height)
+
+        crop = image[y0:y1, x0:x1]
+        sx = out_w / (x1 - x0)
+        sy = out_h / (y1 - y0)
+        rgb = self._rgb[:out_h * out_w * 3].reshape(out_h, out_w, 3)
+        if crop.ndim == 2:
+            gray = self._gray[:out_h * out_w].reshape(out_h, out_w)
+            _resize_into(crop, gray)
+            cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB, dst=rgb)
+        else:
+            _resize_into(crop, rgb)
+        return PreparedFrame(rgb, (sx, sy), (x0, y0), (height, width))
+
+
+def _round_up(value, stride=STRIDE):
+    return max(stride, int(math.ceil(value / stride)) * stride)
+
+
+def _grow(start, end, size, limit):
+    # Widen [start, end) to size around its centre, shifting it back inside [0, limit)
+    size = min(size, limit)
+    start = max(0, min(start - (size - (end - start)) // 2, limit - size))
+    return start, start + size
+
+
+def _resize_into(src, dst):
+    if src.shape[:2] == dst.shape[:2]:
+        np.copyto(dst, src)
+    else:
+        cv2.resize(src, (dst.shape[1], dst.shape[0]), dst=dst, interpolation=cv2.INTER_AREA)
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from utils.monitoring.tiled_inference import tile_grid
+from utils.telemetry import metrics
+
+
+class InferenceProfile:
+    def __init__(self, name, imgsz, conf, tiling=True, backend=None, cost=None):
+        self.name = name
+        self.imgsz = imgsz
+        self.conf = conf
+        self.tiling = tiling  # False runs the whole frame at imgsz even when yolo.tiling is on
+        self.backend_config = backend  # merged over yolo.backend, None for the main backend
+        self.backend = None
+        self.cost = cost  # relative run time, see InferenceProfiles
+
+
+class InferenceProfiles:
+    # The settings inference runs with, most accurate first. With yolo.adaptive enabled the
+    # profile for a layer is the most accurate one expected to finish before its deadline.
+    # Every profile has a relative cost (configured, measured at start-up with calibrate, or
+    # the pixel count against the first profile) and every inference is divided by the cost of
+    # the profile it ran with. The median of that over the last `window` layers is how loaded
+    # the host is right now, so one slow layer at any resolution moves every estimate, and a
+    # faster profile picked while the host was busy gives way again once it has calmed down.
+    def __init__(self, config):
+        adaptive = config.get('adaptive', {})
+        self.enabled = adaptive.get('enabled', False)
+        self.margin = adaptive.get('margin', 0.1)  # seconds kept for the decision and GPIO signal
+        self.calibrate_runs = adaptive.get('calibrate', 0)
+        self.calibration_shape = tuple(adaptive.get('calibration_shape', [3648, 5472]))
+        imgsz = config.get('imgsz', 2048)
+        conf = config.get('conf', 0.85)
+        profiles = adaptive.get('profiles', []) if self.enabled else []
+        self.profiles = [
+            InferenceProfile(
+                profile.get('name', f"imgsz_{profile.get('imgsz', imgsz)}"),
+                profile.get('imgsz', imgsz),
+                profile.get('conf', conf),
+                tiling=profile.get('tiling', True),
+                backend=profile.get('backend'),
+                cost=profile.get('cost'),
+            )
+            for profile in profiles
+        ] or [InferenceProfile('default', imgsz, conf)]
+        tiling = config.get('tiling', {})
+        self.tile_size = tiling.get('tile_size', 1024) if tiling.get('enabled', False) else None
+        self.tile_overlap = tiling.get('overlap', 0.2)
+        self._check_tiled()
+        base = self._pixels(self.profiles[0])
+        for profile in self.profiles:
+            if profile.cost is None:
+                profile.cost = self._pixels(profile) / base
+        self._by_name = {profile.name: profile for profile in self.profiles}
+        self._load = deque(maxlen=adaptive.get('window', 10))  # seconds per unit of cost
+        self._lock = threading.Lock()
+
+    def _check_tiled(self):
+        # Tiled profiles run every tile at tile_size whatever their imgsz, two of them with the
+        # same conf and backend would be the same profile under two names
+        if self.tile_size is None:
+            return
+        seen = {}
+        for profile in self.profiles:
+            if not profile.tiling:
+                continue
+            key = (profile.conf, repr(profile.backend_config))
+            if key in seen:
+                raise ValueError(
+                    f"Inference profiles {seen[key]} and {profile.name} only differ in imgsz, which yolo.tiling "
+                    f"ignores; give one of them tiling: false, another conf or another backend"
+                )
+            seen[key] = profile.name
+
+    def _pixels(self, profile):
+        # Model input pixels per frame, the tiles covering calibration_shape when tiled
+        if self.tile_size is not None and profile.tiling:
+            height, width = self.calibration_shape
+            return len(tile_grid(width, height, self.tile_size, self.tile_overlap)) * self.tile_size ** 2
+        return profile.imgsz ** 2
+
+    @property
+    def default(self):
+        return self.profiles[0]
+
+    def get(self, name=None):
+        return self.default if name is None else self._by_name[name]
+
+    def load_backends(self, config, load_backend):
+        # Profiles with their own backend (e.g. an int8 export) load it next to the main one
+        for profile in self.profiles:
+            if profile.backend_config is not None:
+                profile.backend = load_backend({
+                    **config, 'imgsz': profile.imgsz,
+                    'backend': {**config.get('backend', {}), **profile.backend_config},
+                })
+
+    def calibrate(self, run):
+        # Times every profile on a blank frame, replacing the pixel-count costs
+        if not self.enabled or self.calibrate_runs <= 0:
+            return
+        image = np.zeros(self.calibration_shape, np.uint8)
+        timings = {}
+        for profile in self.profiles:
+            start = time.perf_counter()
+            for _ in range(self.calibrate_runs):
+                run(image, profile)
+            timings[profile.name] = (time.perf_counter() - start) / self.calibrate_runs
+        first = timings[self.default.name]
+        for profile in self.profiles:
+            profile.cost = timings[profile.name] / first
+        print("Inference profiles: " + ", ".join(f"{name} {t * 1000:.0f} ms" for name, t in timings.items()))
+
+    def estimate(self, profile):
+        # Expected seconds for one frame, None until a layer has been measured
+        with self._lock:
+            if not self._load:
+                return None
+            return float(np.median(self._load)) * profile.cost
+
+    def select(self, deadline=None):
+        # deadline is a time.perf_counter() value, the caller's decision is due by then
+        if not self.enabled or deadline is None:
+            return self.default.name
+        remaining = deadline - time.perf_counter() - self.margin
+        for profile in self.profiles:
+            estimate = self.estimate(profile)
+            if estimate is None or estimate <= remaining:
+                return profile.name
+        # Late whatever runs, the fastest profile is late by the least
+        return self.profiles[-1].name
+
+    def observe(self, name, seconds):
+        profile = self.get(name)
+        with self._lock:
+            self._load.append(seconds / profile.cost)
+        metrics.observe('inference_profile', seconds, profile=profile.name)
+
+    def summary(self):
+        return {profile.name: self.estimate(profile) for profile in self.profiles}
+
+# Usage example:
+# profiles = InferenceProfiles(config['yolo'])  # with yolo.adaptive.profiles
+# name = profiles.select(deadline=trigger_time + config['yolo']['adaptive']['deadline'])
+# profile = profiles.get(name)                  # imgsz, conf and backend to run with
+# profiles.observe(name, seconds_it_took)
@@ -0,0 +1,151 @@
+import threading
+import time
+
+from utils.telemetry import metrics
+
+
+class InferenceRequest:
+    def __init__(self, cell, image, roi, deadline, profile=None):
+        self.cell = cell
+        self.image = image
+        self.roi = roi
+        self.deadline = deadline  # time.perf_counter() by which the cell needs its decision, or None
+        self.profile = profile  # yolo.adaptive profile, only frames of the same profile share a batch
+        self.submitted = time.perf_counter()
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class CellInference:
+    # What one cell's LayerPipeline sees as its YOLOInference. infer() goes through the shared
+    # scheduler, everything else is the shared model's.
+    def __init__(self, scheduler, name):
+        self.scheduler = scheduler
+        self.name = name
+
+    def infer(self, image, roi=None, deadline=None, profile=None):
+        return self.scheduler.infer(self.name, image, roi, deadline, profile)
+
+    def close(self):
+        pass  # the shared model is closed by whoever owns the scheduler
+
+    def __getattr__(self, name):
+        return getattr(self.scheduler.yolo_inference, name)
+
+
+class InferenceScheduler:
+    # Feeds frames from several cells to one model with infer_batch. A batch goes out when it
+    # is full, when its oldest frame has waited max_wait, or when waiting any longer would make
+    # the most urgent frame miss its deadline, going by the measured time per frame. Frames are
+    # batched earliest deadline first, so a cell close to its deadline is never held behind
+    # frames that can wait.
+    def __init__(self, yolo_inference, max_batch=4, max_wait=0.05, safety_margin=0.02):
+        self.yolo_inference = yolo_inference
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.safety_margin = safety_margin
+        self.batches = 0
+        self.frames = 0
+        self._per_frame = None  # seconds per frame in a batch, exponentially averaged
+        self._pending = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='inference-scheduler', daemon=True)
+        self._thread.start()
+
+    def cell(self, name):
+        return CellInference(self, name)
+
+    def infer(self, cell, image, roi=None, deadline=None, profile=None):
+        request = self.submit(cell, image, roi, deadline, profile)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def submit(self, cell, image, roi=None, deadline=None, profile=None):
+        request = InferenceRequest(cell, image, roi, deadline, profile)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Inference scheduler has been shut down")
+            self._pending.append(request)
+            metrics.set_gauge('scheduler_pending', len(self._pending))
+            self._cond.notify()
+        return request
+
+    def estimate(self, frames):
+        # Expected seconds for a batch of this many frames, 0 until the first batch has run
+        return (self._per_frame or 0.0) * frames
+
+    def _dispatch_time(self):
+        # Latest moment the pending frames can still go out
+        due = min(request.submitted for request in self._pending) + self.max_wait
+        deadlines = [request.deadline for request in self._pending if request.deadline is not None]
+        if deadlines:
+            batch = min(len(self._pending), self.max_batch)
+            due = min(due, min(deadlines) - self.estimate(batch) - self.safety_margin)
+        return due
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                if not self._pending:
+                    if self._closed:
+                        return None
+                    self._cond.wait()
+                    continue
+                wait = self._dispatch_time() - time.perf_counter()
+                if len(self._pending) >= self.max_batch or wait <= 0 or self._closed:
+                    break
+                self._cond.wait(wait)
+            self._pending.sort(key=lambda r: (r.deadline is None, r.deadline or 0.0, r.submitted))
+            # The most urgent frame's profile decides which frames go with it
+            profile = self._pending[0].profile
+            batch = [r for r in self._pending if r.profile == profile][:self.max_batch]
+            self._pending = [r for r in self._pending if r not in batch]
+            metrics.set_gauge('scheduler_pending', len(self._pending))
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            start = time.perf_counter()
+            try:
+                results = self.yolo_inference.infer_batch(
+                    [r.image for r in batch], [r.roi for r in batch], profile=batch[0].profile
+                )
+                for request, result in zip(batch, results):
+                    request.results = result
+            except Exception as exc:
+                print(f"Batched inference of {len(batch)} frames failed: {exc}")
+                for request in batch:
+                    request.error = exc
+            finally:
+                elapsed = time.perf_counter() - start
+                per_frame = elapsed / len(batch)
+                self._per_frame = per_frame if self._per_frame is None else 0.8 * self._per_frame + 0.2 * per_frame
+                self.batches += 1
+                self.frames += len(batch)
+                metrics.observe('inference_batch', elapsed, size=str(len(batch)))
+                for request in batch:
+                    metrics.observe('scheduler_wait', start - request.submitted, cell=request.cell)
+                    request.done.set()
+
+    def close(self, timeout=30):
+        # Frames already submitted are still run
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        if self.frames:
+            print(f"Inference scheduler: {self.frames} frames in {self.batches} batches "
+                  f"({self.frames / self.batches:.2f} per batch)")
+
+# Usage example:
+# scheduler = InferenceScheduler(YOLOInference(config['yolo'], output_path), max_batch=4, max_wait=0.05)
+# cell_a = scheduler.cell('cell_a')
+# results = cell_a.infer(masked_image, roi=bbox, deadline=trigger_time + 1.5)
+# defects, layer, planarize, rework = cell_a.process_results(results, layer, filename)
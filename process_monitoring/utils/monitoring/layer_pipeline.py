@@ -0,0 +1,259 @@
+import queue
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from utils.monitoring.detections import build_results
+from utils.telemetry import metrics
+
+_STOP = object()
+
+
+class LayerJob:
+    def __init__(self, layer, trigger_time=None):
+        self.layer = layer
+        self.trigger_time = trigger_time if trigger_time is not None else time.perf_counter()
+        self.image = None
+        self.masked_image = None
+        self.timestamp = None
+        self.filepath = None
+        self.results = None
+        self.screening = None
+        self.inference_profile = None  # yolo.adaptive profile the detector ran with
+        self.defects = None
+        self.next_layer = layer
+        self.decision_time = None
+        self.planarize = False
+        self.rework = False
+        self.error = None
+        self.failed_stage = None  # stage that raised error, the later ones pass the job on
+        self.timings = {}
+        self.profile = False  # run every stage under cProfile, see Telemetry.start_profile
+        self.decided = threading.Event()
+
+    def wait_for_decision(self, timeout=None):
+        return self.decided.wait(timeout)
+
+
+class PipelineStage(threading.Thread):
+    # Takes jobs from inbox, runs func on them and hands them on to outbox.
+    # A full outbox blocks the stage, which is what gives the pipeline backpressure.
+    # A job that failed in an earlier stage is passed on in order without running func, unless
+    # the stage takes failed jobs. A job that fails here goes to on_error and is passed on too.
+    def __init__(self, name, func, inbox, outbox=None, on_error=None, takes_failed=False):
+        super().__init__(name=f"pipeline-{name}", daemon=True)
+        self.stage_name = name
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.on_error = on_error
+        self.takes_failed = takes_failed
+
+    def run(self):
+        while True:
+            job = self.inbox.get()
+            if job is _STOP:
+                if self.outbox is not None:
+                    self.outbox.put(_STOP)
+                break
+
+            if job.error is None or self.takes_failed:
+                self._run_job(job)
+            if self.outbox is not None:
+                self.outbox.put(job)
+
+    def _run_job(self, job):
+        start = time.perf_counter()
+        try:
+            with metrics.profile(job.profile, f"layer_{job.layer}_{self.stage_name}"):
+                self.func(job)
+        except Exception as exc:
+            if job.error is None:
+                job.error = exc
+                job.failed_stage = self.stage_name
+            print(f"Pipeline stage {self.stage_name} failed on layer {job.layer}: {exc}")
+            traceback.print_exc()
+            metrics.increment('stage_errors', stage=self.stage_name)
+            if self.on_error:
+                try:
+                    self.on_error(job)
+                except Exception:
+                    traceback.print_exc()
+        finally:
+            job.timings[self.stage_name] = time.perf_counter() - start
+            metrics.observe('stage', job.timings[self.stage_name], stage=self.stage_name)
+
+
+class LayerPipeline:
+    # capture -> mask -> inference -> decision -> persistence, joined by bounded queues.
+    # on_decision is where Mach4 gets signalled, the persistence stage then hands the
+    # frames and results to the artifact writer while the next layer is being printed.
+    # A layer that fails in any stage still gets a decision, on_error_action ('rework',
+    # 'planarize' or 'none') with an error record, and is persisted like any other.
+    def __init__(self, camera_handler, yolo_inference, artifact_writer, on_decision, on_persisted=None,
+                 led_controller=None, queue_size=2, persist_queue_size=8, screener=None, decision_budget=None,
+                 on_error_action='rework'):
+        if on_error_action not in ('rework', 'planarize', 'none'):
+            raise ValueError(f"Unknown pipeline.on_error {on_error_action!r}, use rework, planarize or none")
+        self.on_error_action = on_error_action
+        self.camera_handler = camera_handler
+        self.screener = screener
+        # Seconds from trigger to decision, handed to inference as a deadline when set
+        self.decision_budget = decision_budget
+        self.yolo_inference = yolo_inference
+        self.artifact_writer = artifact_writer
+        self.on_decision = on_decision
+        self.on_persisted = on_persisted
+        self.led_controller = led_controller
+
+        capture_q = queue.Queue(maxsize=queue_size)
+        mask_q = queue.Queue(maxsize=queue_size)
+        inference_q = queue.Queue(maxsize=queue_size)
+        decision_q = queue.Queue(maxsize=queue_size)
+        persist_q = queue.Queue(maxsize=persist_queue_size)
+        self.queues = {
+            'capture': capture_q,
+            'mask': mask_q,
+            'inference': inference_q,
+            'decision': decision_q,
+            'persistence': persist_q,
+        }
+        self.stages = [
+            PipelineStage('capture', self._capture, capture_q, mask_q),
+            PipelineStage('mask', self._mask, mask_q, inference_q),
+            PipelineStage('inference', self._infer, inference_q, decision_q),
+            PipelineStage('decision', self._decide, decision_q, persist_q, self._decide_failed, takes_failed=True),
+            PipelineStage('persistence', self._persist, persist_q, takes_failed=True),
+        ]
+        self._closed = False
+        for stage in self.stages:
+            stage.start()
+
+    def submit(self, layer, trigger_time=None):
+        # Blocks while the capture queue is full
+        if self._closed:
+            raise RuntimeError("Pipeline has been shut down")
+        job = LayerJob(layer, trigger_time)
+        job.profile = metrics.claim_profile()
+        self.queues['capture'].put(job)
+        self.queue_depths()
+        return job
+
+    def queue_depths(self):
+        depths = {name: q.qsize() for name, q in self.queues.items()}
+        for name, depth in depths.items():
+            metrics.set_gauge('queue_depth', depth, queue=name)
+        return depths
+
+    def close(self, timeout=30):
+        # Drains everything already submitted, then stops the stages in order
+        if self._closed:
+            return
+        self._closed = True
+        self.queues['capture'].put(_STOP)
+        deadline = time.monotonic() + timeout
+        for stage in self.stages:
+            stage.join(max(0.0, deadline - time.monotonic()))
+            if stage.is_alive():
+                print(f"Pipeline stage {stage.stage_name} did not stop within {timeout}s")
+        if self.screener is not None:
+            print(self.screener.report())
+
+    def _capture(self, job):
+        if self.led_controller:
+            self.led_controller.toggle_leds(True)
+        try:
+            job.image, job.timestamp = self.camera_handler.grab_image()
+        finally:
+            if self.led_controller:
+                self.led_controller.toggle_leds(False)
+        job.filepath = self.artifact_writer.path('raw', job.timestamp)
+
+    def _mask(self, job):
+        # An inference daemon reads the masked frame from its shared memory, so it is written there
+        out = self.yolo_inference.frame_buffer(job.image.shape, job.image.dtype)
+        job.masked_image = self.camera_handler.apply_mask(job.image, job.layer, out=out)
+
+    def _infer(self, job):
+        image = job.image if job.masked_image is None else job.masked_image
+        roi = self.camera_handler.roi(job.layer)
+        if self.screener is not None:
+            with metrics.timer('screening'):
+                # The raw frame, the masked one has nothing off the toolpath to compare
+                job.screening = self.screener.screen(job.image, self.camera_handler.toolpath_mask(job.layer), job.layer)
+            if job.screening.skip:
+                # Nominal layer, an empty detection list gives the usual 'No defects' decision
+                job.results = build_results(image, self.yolo_inference.names, np.zeros((0, 6), np.float32))
+                return
+            roi = job.screening.roi or roi
+        deadline = job.trigger_time + self.decision_budget if self.decision_budget is not None else None
+        # Picked here, after capture and masking, so time lost in the earlier stages counts against it
+        job.inference_profile = self.yolo_inference.select_profile(deadline)
+        job.results = self.yolo_inference.infer(image, roi=roi, deadline=deadline, profile=job.inference_profile)
+
+    def _decide(self, job):
+        if job.error is not None:
+            self._decide_failed(job)
+            return
+        defects, next_layer, planarize, rework = self.yolo_inference.process_results(
+            job.results, job.layer, job.filepath.name
+        )
+        if job.screening is not None:
+            self.screener.review(job.screening, defects)
+        defects["Inference profile"] = job.inference_profile
+        job.defects = defects
+        job.next_layer = next_layer
+        job.planarize = planarize
+        job.rework = rework
+
+        try:
+            self.on_decision(job)
+        finally:
+            job.decision_time = time.perf_counter()
+            job.decided.set()
+
+    def _persist(self, job):
+        try:
+            # A failed layer keeps whatever it got as far as
+            if job.image is not None:
+                self.artifact_writer.submit_frame('raw', job.timestamp, job.image, layer=job.layer)
+            if job.masked_image is not None:
+                self.artifact_writer.submit_frame('masked', job.timestamp, job.masked_image, layer=job.layer)
+            if job.results is not None and job.error is None:
+                self.artifact_writer.submit_overlay(job.timestamp, job.results, layer=job.layer)
+        finally:
+            # The writer holds its own references until the files are on disk
+            job.image = job.masked_image = None
+            if self.on_persisted:
+                self.on_persisted(job)
+
+    def _decide_failed(self, job):
+        # Also called when the decision itself raised. A job that has been signalled keeps its
+        # decision and only has the error added to its record.
+        if job.decided.is_set():
+            if job.defects is not None:
+                job.defects["Error"] = f"{type(job.error).__name__}: {job.error}"
+            return
+        action = self.on_error_action
+        job.defects = {
+            "Layer number": job.layer,
+            "Number of defects": 0,
+            "Overextrusions": 0,
+            "Underextrusions": 0,
+            "Timestamp": job.filepath.name if job.filepath is not None else None,
+            "Defect data": [],
+            "Decision": f"Error in {job.failed_stage} stage, {action}",
+            "Error": f"{type(job.error).__name__}: {job.error}",
+            "Inference profile": job.inference_profile,
+        }
+        job.planarize = action == 'planarize'
+        job.rework = action == 'rework'
+        # Planarized layers move on like clean ones, a reworked layer is printed and inspected again
+        job.next_layer = job.layer if action == 'rework' else job.layer + 1
+        try:
+            self.on_decision(job)
+        finally:
+            job.decision_time = time.perf_counter()
+            job.decided.set()
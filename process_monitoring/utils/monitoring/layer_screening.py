@@ -0,0 +1,231 @@
+import threading
+
+import cv2
+import numpy as np
+
+from utils.telemetry import metrics
+
+
+class ScreeningResult:
+    def __init__(self, nominal, stats, roi=None, audit=False):
+        self.nominal = nominal
+        self.stats = stats
+        self.roi = roi  # frame box around the suspicious tiles, None when nothing stood out
+        self.audit = audit  # nominal, but sent to the detector anyway to check the screen
+
+    @property
+    def skip(self):
+        return self.nominal and not self.audit
+
+    def summary(self):
+        return {"Nominal": self.nominal, "Skipped detector": self.skip, "Audit": self.audit, **self.stats}
+
+
+class LayerScreener:
+    # Cheap check in front of the detector. The raw frame is downsampled over the toolpath's
+    # bounding box and every pixel is compared with the others of its region (on the toolpath or
+    # off it) by a robust z-score, optionally also with the same place on the previous layer.
+    # Raw, because the masked frame is blank off the toolpath. Outliers cannot see a layer that
+    # is missing or evenly over- or underextruded, the whole path moves with its median, so the
+    # contrast between the path and the bed is checked as well, on its own and against the
+    # previous layer. Layers where nothing stands out go straight to 'No defects'. Every audit_every-th nominal
+    # layer still goes through the detector, and a detection there is counted as a miss so the
+    # thresholds can be checked against the detector's recall.
+    def __init__(self, config):
+        self.reference = config.get('reference', 'toolpath')  # toolpath, previous or both
+        self.scale = config.get('scale', 8)
+        self.tile = config.get('tile', 16)
+        self.outlier_z = config.get('outlier_z', 6.0)
+        self.max_outlier_fraction = config.get('max_outlier_fraction', 0.001)
+        self.max_tile_change = config.get('max_tile_change', 20.0)
+        self.min_contrast = config.get('min_contrast', 10.0)  # on- minus off-path median, grey levels
+        self.max_contrast_change = config.get('max_contrast_change', 0.3)  # relative to the previous layer
+        self.min_coverage = config.get('min_coverage', 1.0)  # edge pixels mix path and background
+        self.audit_every = config.get('audit_every', 20)
+        self.crop_to_suspicious = config.get('crop_to_suspicious', False)
+        self.margin = config.get('margin', 64)
+        self.log_every = config.get('log_every', 50)
+        self.screened = 0
+        self.nominal = 0
+        self.skipped = 0
+        self.audited = 0
+        self.misses = 0
+        self._previous = None  # (grid box, downsampled crop, levels) of the last screened layer
+        self._contrast = None  # of the last screened layer that passed the contrast check
+        self._lock = threading.Lock()
+
+    def screen(self, image, mask, layer):
+        # image is the raw frame, mask the layer's ToolpathMask
+        box = None if mask is None or mask.is_empty() else self._grid_box(mask.bbox, image.shape)
+        if box is None:
+            # Nothing to compare against, the detector decides
+            return self._count(ScreeningResult(False, {"Reason": "no toolpath mask"}))
+
+        gx0, gy0, gx1, gy1 = box
+        size = ((gx1 - gx0) // self.scale, (gy1 - gy0) // self.scale)
+        small = cv2.resize(image[gy0:gy1, gx0:gx1], size, interpolation=cv2.INTER_AREA).astype(np.float32)
+        # The mask over the grid box, which can reach past the bounding box on the top and left
+        # and stop short of it at the frame's bottom and right edge
+        x0, y0 = mask.bbox[:2]
+        path = np.zeros((gy1 - gy0, gx1 - gx0), np.uint8)
+        unpacked = mask.unpack()[:gy1 - y0, :gx1 - x0]
+        path[y0 - gy0:y0 - gy0 + unpacked.shape[0], x0 - gx0:x0 - gx0 + unpacked.shape[1]] = unpacked
+        coverage = cv2.resize(path, size, interpolation=cv2.INTER_AREA) * np.float32(1 / 255)
+        on_path = coverage >= self.min_coverage
+        off_path = coverage == 0
+
+        suspicious = np.zeros(small.shape, bool)
+        stats = {}
+        levels = (self._median(small, on_path), self._median(small, off_path))
+        if not self._contrast_ok(levels, stats):
+            # The whole toolpath is in question
+            suspicious |= on_path
+        if self.reference in ('toolpath', 'both'):
+            outliers = self._outliers(small, on_path, levels[0]) | self._outliers(small, off_path, levels[1])
+            fraction = float(outliers.mean())
+            stats["Outlier fraction"] = round(fraction, 6)
+            if fraction > self.max_outlier_fraction:
+                suspicious |= outliers
+        if self.reference in ('previous', 'both'):
+            change = self._change(box, small, on_path, levels)
+            if change is not None:
+                stats["Max tile change"] = round(float(change.max()), 2)
+                suspicious |= change > self.max_tile_change
+        with self._lock:
+            self._previous = (box, small, levels)
+
+        nominal = not suspicious.any()
+        roi = None if nominal else self._roi(suspicious, box, image.shape)
+        audit = False
+        if nominal and self.audit_every:
+            audit = (self.nominal + 1) % self.audit_every == 0
+        return self._count(ScreeningResult(nominal, stats, roi, audit))
+
+    def _contrast_ok(self, levels, stats):
+        on, off = levels
+        if on is None or off is None:
+            stats["Contrast"] = None
+            return False
+        contrast = on - off
+        stats["Contrast"] = round(contrast, 2)
+        with self._lock:
+            previous = self._contrast
+        if contrast < self.min_contrast:
+            return False
+        if previous is not None and abs(contrast - previous) > self.max_contrast_change * previous:
+            stats["Contrast change"] = round((contrast - previous) / previous, 3)
+            return False
+        with self._lock:
+            self._contrast = contrast
+        return True
+
+    def _grid_box(self, bbox, frame_shape):
+        # bbox widened to multiples of scale, so downsampled pixels of two layers with different
+        # boxes cover the same frame pixels. None when it holds no whole downsampled pixel.
+        s = self.scale
+        x0, y0, x1, y1 = bbox
+        box = (x0 // s * s, y0 // s * s,
+               min(-(-x1 // s) * s, frame_shape[1] // s * s), min(-(-y1 // s) * s, frame_shape[0] // s * s))
+        return box if box[2] > box[0] and box[3] > box[1] else None
+
+    @staticmethod
+    def _median(small, region):
+        values = small[region]
+        return float(np.median(values)) if values.size >= 16 else None
+
+    def _outliers(self, small, region, median):
+        if median is None:
+            return np.zeros(small.shape, bool)
+        values = small[region]
+        # MAD scaled to a standard deviation, with a floor so a flat region does not flag noise
+        spread = max(1.4826 * float(np.median(np.abs(values - median))), 1.0)
+        return region & (np.abs(small - median) > self.outlier_z * spread)
+
+    def _change(self, box, small, on_path, levels):
+        # Mean absolute change per tile on this layer's toolpath, over the part of the frame both
+        # layers' grid boxes cover, zero elsewhere
+        with self._lock:
+            previous = self._previous
+        if previous is None or levels[0] is None or previous[2][0] is None:
+            return None
+        prev_box, prev_small, (prev_on, prev_off) = previous
+        s = self.scale
+        ix0, iy0 = max(box[0], prev_box[0]), max(box[1], prev_box[1])
+        ix1, iy1 = min(box[2], prev_box[2]), min(box[3], prev_box[3])
+        if ix1 <= ix0 or iy1 <= iy0:
+            return None
+
+        def overlap(grid_box):
+            # Slices of a downsampled crop taken over grid_box that cover the intersection
+            return (slice((iy0 - grid_box[1]) // s, (iy1 - grid_box[1]) // s),
+                    slice((ix0 - grid_box[0]) // s, (ix1 - grid_box[0]) // s))
+
+        here = overlap(box)
+        current, before, region = small[here], prev_small[overlap(prev_box)], on_path[here]
+        # Exposure and lighting drift between layers, so the previous layer is first brought to
+        # this one's levels through the on- and off-path medians
+        on, off = levels
+        gain = (on - off) / (prev_on - prev_off) if None not in (off, prev_off) and prev_on != prev_off else 1.0
+        reference = (before - prev_on) * gain + on
+        diff = np.where(region, np.abs(current - reference), 0)
+        h, w = diff.shape
+        t = self.tile
+        pad = ((0, -h % t), (0, -w % t))
+        tiles = np.pad(diff, pad).reshape(-(-h // t), t, -(-w // t), t).sum(axis=(1, 3))
+        counts = np.pad(region, pad).reshape(tiles.shape[0], t, tiles.shape[1], t).sum(axis=(1, 3))
+        tile_change = np.divide(tiles, counts, out=np.zeros_like(tiles), where=counts > 0)
+        change = np.zeros(small.shape, np.float32)
+        change[here] = np.repeat(np.repeat(tile_change, t, axis=0), t, axis=1)[:h, :w]
+        return change
+
+    def _roi(self, suspicious, bbox, frame_shape):
+        if not self.crop_to_suspicious:
+            return None
+        ys, xs = np.nonzero(suspicious)
+        x0, y0 = bbox[0], bbox[1]
+        return (
+            max(0, x0 + int(xs.min()) * self.scale - self.margin),
+            max(0, y0 + int(ys.min()) * self.scale - self.margin),
+            min(frame_shape[1], x0 + (int(xs.max()) + 1) * self.scale + self.margin),
+            min(frame_shape[0], y0 + (int(ys.max()) + 1) * self.scale + self.margin),
+        )
+
+    def _count(self, result):
+        with self._lock:
+            self.screened += 1
+            self.nominal += result.nominal
+            self.skipped += result.skip
+            self.audited += result.audit
+        outcome = 'skipped' if result.skip else 'audit' if result.audit else 'detector'
+        metrics.increment('screened_layers', outcome=outcome)
+        if self.log_every and self.screened % self.log_every == 0:
+            print(self.report())
+        return result
+
+    def review(self, result, defects):
+        # Called with the detector's record of a screened layer. A clean detector result makes
+        # its contrast the reference, e.g. after a change of material.
+        contrast = result.stats.get("Contrast")
+        if defects["Number of defects"] == 0 and contrast is not None and contrast >= self.min_contrast:
+            with self._lock:
+                self._contrast = contrast
+        if result.audit and defects["Number of defects"] > 0:
+            with self._lock:
+                self.misses += 1
+            metrics.increment('screening_misses')
+            print(f"Screening passed layer {defects['Layer number']} but the detector found "
+                  f"{defects['Number of defects']} defects")
+        defects["Screening"] = result.summary()
+
+    def skip_rate(self):
+        return self.skipped / self.screened if self.screened else 0.0
+
+    def report(self):
+        return (f"Screening: {self.screened} layers, {self.skipped} skipped ({self.skip_rate():.0%}), "
+                f"{self.audited} audited, {self.misses} missed")
+
+# Usage example:
+# screener = LayerScreener({'reference': 'both', 'audit_every': 20})
+# result = screener.screen(raw_image, mask_handler.get_mask(layer), layer)
+# if not result.skip:
+#     results = yolo_inference.infer(masked_image, roi=result.roi or mask_handler.get_bbox(layer))
@@ -0,0 +1,135 @@
+import threading
+from pathlib import Path
+
+from utils.interfaces import merge_config, load_config
+from utils.monitoring.inference_scheduler import InferenceScheduler
+from utils.monitoring.process_monitor import ProcessMonitor
+from utils.monitoring.yolo_inference import YOLOInference
+from utils.monitoring.inference_daemon import InferenceClient
+from utils.startup import StartupOrchestrator
+from utils.telemetry import metrics, MetricsServer, ConfigWatcher
+
+
+def cell_config(config, cell):
+    # A cell's settings are the shared file with its own entry of `cells` merged over it
+    base = {key: value for key, value in config.items() if key not in ('cells', 'scheduler')}
+    merged = merge_config(base, cell)
+    merged.setdefault('part_name', cell['name'])
+    if 'output_path' not in cell:
+        merged['output_path'] = str(Path(config.get('output_path', '.')) / cell['name'])
+    # One metrics endpoint and config watcher for the whole host, see MultiCellMonitor
+    merged['telemetry'] = {**merged.get('telemetry', {}), 'enabled': False}
+    return merged
+
+
+class MultiCellMonitor:
+    # Several CHAMP cells from one process. Every cell is a ProcessMonitor with its own camera,
+    # GPIO pins, LEDs, layer counter, masks and output directory. They share one model, which
+    # their inference stages reach through an InferenceScheduler that batches frames across cells.
+    def __init__(self, config, config_path=None):
+        self.config = config
+        scheduler_config = config.get('scheduler', {})
+        self.startup = StartupOrchestrator(parallel=config.get('startup', {}).get('parallel', True))
+        self.startup.add('yolo', self._create_inference)
+        self.startup.add('scheduler', lambda yolo: InferenceScheduler(
+            yolo,
+            max_batch=scheduler_config.get('max_batch', len(config['cells'])),
+            max_wait=scheduler_config.get('max_wait', 0.05),
+            safety_margin=scheduler_config.get('safety_margin', 0.02),
+        ), requires=['yolo'])
+        self.startup.start()
+
+        self.cells = {}
+        for cell in config['cells']:
+            name = cell['name']
+            # The cell's 'yolo' component waits for the shared model in its own startup thread
+            self.cells[name] = ProcessMonitor(
+                cell_config(config, cell),
+                inference_factory=lambda name=name: self.startup.get('scheduler').cell(name),
+            )
+        print(f"Monitoring {len(self.cells)} cells: {', '.join(self.cells)}")
+        self._start_telemetry(config.get('telemetry', {}), config_path)
+
+    def _create_inference(self):
+        output_path = Path.home() / self.config.get('output_path', '.')
+        if self.config['yolo'].get('daemon', {}).get('enabled', False):
+            return InferenceClient(self.config['yolo'], output_path=output_path)
+        return YOLOInference(self.config['yolo'], output_path=output_path)
+
+    def _start_telemetry(self, telemetry_config, config_path):
+        metrics.profile_dir = Path.home() / self.config.get('output_path', '.') / 'profiles'
+        self.metrics_server = None
+        self.config_watcher = None
+        if not telemetry_config.get('enabled', True):
+            return
+        try:
+            self.metrics_server = MetricsServer(
+                metrics, telemetry_config.get('host', '127.0.0.1'), telemetry_config.get('port', 9108)
+            )
+        except OSError as exc:
+            print(f"Metrics endpoint not started: {exc}")
+        if telemetry_config.get('profile_layers', 0):
+            metrics.start_profile(telemetry_config['profile_layers'])
+        if config_path is not None:
+            self.config_watcher = ConfigWatcher(
+                config_path, self._reload_telemetry, load_config, telemetry_config.get('config_poll', 2.0)
+            )
+
+    def _reload_telemetry(self, config):
+        telemetry_config = config.get('telemetry', {})
+        layers = telemetry_config.get('profile_layers', 0)
+        if layers != self.config.get('telemetry', {}).get('profile_layers', 0):
+            metrics.start_profile(layers)
+        self.config = {**self.config, 'telemetry': telemetry_config}
+
+    def run(self):
+        # Each cell waits for its own triggers, run() returns once every cell has been told to exit
+        threads = [
+            threading.Thread(target=self._run_cell, args=(name, monitor), name=f"cell-{name}", daemon=True)
+            for name, monitor in self.cells.items()
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1.0)
+        except KeyboardInterrupt:
+            print("Stopping all cells")
+            for monitor in self.cells.values():
+                monitor.running = False
+            for thread in threads:
+                thread.join()
+            raise
+
+    def _run_cell(self, name, monitor):
+        try:
+            monitor.run()
+        except Exception as exc:
+            # One cell failing leaves the others printing
+            print(f"Cell {name} stopped: {exc}")
+
+    def cleanup(self):
+        for name, monitor in self.cells.items():
+            try:
+                monitor.cleanup()
+            except Exception as exc:
+                print(f"Cleanup of cell {name} failed: {exc}")
+        scheduler = self.startup.peek('scheduler', timeout=0)
+        if scheduler is not None:
+            scheduler.close()
+        yolo = self.startup.peek('yolo', timeout=0)
+        if yolo is not None:
+            yolo.close()
+        if self.config_watcher:
+            self.config_watcher.close()
+        if self.metrics_server:
+            self.metrics_server.close()
+
+# Usage example:
+# config = load_config('config.yaml')  # with a `cells` list
+# monitor = MultiCellMonitor(config, config_path='config.yaml')
+# try:
+#     monitor.run()
+# finally:
+#     monitor.cleanup()
@@ -0,0 +1,264 @@
+import os
+import json
+import time
+from pathlib import Path
+from datetime import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from utils.data_processing.defect_journal import DefectJournal
+from utils.data_processing.frame_archive import FrameArchiveReader, INDEX_FILE
+from utils.data_processing.gcode_parser import ColumnarGCodeParser
+from utils.data_processing.mask_cache import MaskCache
+from utils.monitoring.camera_handler import load_cad_file, camera_mask_handler
+
+TIMESTAMP_FORMAT = "%d_%m_%y_%H_%M_%S"  # CameraHandler.grab_image
+IMAGE_SUFFIXES = ('.bmp', '.png', '.tiff', '.jpeg', '.jpg', '.webp')
+ARCHIVE_SUFFIX = '.archive'  # ArtifactWriter's frames.archive
+
+
+class ReplayFrame:
+    def __init__(self, path: Path, layer):
+        self.path = path
+        self.layer = layer
+
+    @property
+    def timestamp(self):
+        return self.path.stem[len('image_'):]
+
+    def __repr__(self):
+        return f"ReplayFrame({self.path.name!r}, layer={self.layer})"
+
+
+class FileCameraSource:
+    # Stands in for the camera when replaying a finished print: walks the raw image_* frames
+    # of a Camera/ directory in capture order and tells which layer each one was taken on.
+    # Layers come from the print's defect report or journal, without either every frame is
+    # taken to be the next layer from start_layer on.
+    def __init__(self, print_dir: Path, start_layer=0):
+        self.print_dir = Path(print_dir)
+        self.camera_dir = self.print_dir / 'Camera'
+        self.part_name, self.layer_map = self._load_layer_map()
+        paths = sorted(self._raw_frames(), key=self._capture_time)
+        if self.layer_map:
+            missing = [path.name for path in paths if path.name not in self.layer_map]
+            if missing:
+                print(f"{len(missing)} frames in {self.camera_dir} are not in the defect report, skipping them")
+            self.frames = [ReplayFrame(path, self.layer_map[path.name]) for path in paths
+                           if path.name in self.layer_map]
+        else:
+            print(f"No defect report in {self.print_dir}, numbering layers from {start_layer} in capture order")
+            self.frames = [ReplayFrame(path, start_layer + i) for i, path in enumerate(paths)]
+        self._next = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def grab_image(self):
+        # Same return as CameraHandler.grab_image, for code that pulls frames one at a time
+        if self._next >= len(self.frames):
+            raise StopIteration("No frames left to replay")
+        frame = self.frames[self._next]
+        self._next += 1
+        return read_frame(frame.path), frame.timestamp
+
+    def _raw_frames(self):
+        seen = set()
+        for path in self.camera_dir.glob('image_*'):
+            if path.suffix.lower() in IMAGE_SUFFIXES and not path.stem.endswith('_predictions'):
+                seen.add(path.name)
+                yield path
+        # Archived frames are addressed as <archive>/<file name they would have had>
+        for archive in self.camera_dir.glob(f'*{ARCHIVE_SUFFIX}'):
+            for record in FrameArchiveReader.read_index(archive / INDEX_FILE):
+                if record['kind'] == 'raw' and record['name'] not in seen:
+                    seen.add(record['name'])
+                    yield archive / record['name']
+
+    @staticmethod
+    def _capture_time(path):
+        try:
+            return dt.strptime(path.stem[len('image_'):], TIMESTAMP_FORMAT).timestamp(), path.name
+        except ValueError:
+            return (path.stat().st_mtime if path.exists() else 0.0), path.name
+
+    def _load_layer_map(self):
+        # "Timestamp" in the report is the raw frame's file name
+        for report in sorted(self.print_dir.glob('*_defects.json')):
+            if report.stem.endswith('_replay'):
+                continue
+            with open(report) as f:
+                records = json.load(f)
+            return report.stem[:-len('_defects')], {r['Timestamp']: r['Layer number'] for r in records}
+        for journal in sorted(self.print_dir.glob('*_defects.jsonl')):
+            records = DefectJournal.read(journal)
+            return journal.stem[:-len('_defects')], {r['Timestamp']: r['Layer number'] for r in records}
+        return self.print_dir.name, {}
+
+
+_archives = {}
+
+
+def read_frame(path):
+    # Mono8 frames, as the camera delivered them
+    path = Path(path)
+    if path.parent.suffix == ARCHIVE_SUFFIX:
+        reader = _archives.get(path.parent)
+        if reader is None:
+            reader = _archives[path.parent] = FrameArchiveReader(path.parent)
+        return reader.read_name(path.name)
+    image = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise IOError(f"Could not read {path}")
+    return image
+
+
+def load_toolpath(path):
+    # Layer -> moves from either the camera's CAD JSON or the G-code itself
+    path = Path(path)
+    if path.suffix.lower() == '.json':
+        return load_cad_file(path)
+    parser = ColumnarGCodeParser()
+    parser.parse_file(path)
+    return parser.get_layers()
+
+
+class ReplayWorker:
+    # Everything one process needs to turn frames into defect records. The model is loaded
+    # once per process, mask handlers once per toolpath.
+    def __init__(self, config, output_path):
+        from utils.monitoring.yolo_inference import YOLOInference
+        self.config = config
+        self.yolo_inference = YOLOInference(config['yolo'], output_path=Path(output_path))
+        self.mask_cache = MaskCache(config['mask_cache_dir']) if config.get('mask_cache_dir') else None
+        self._mask_handlers = {}
+
+    def mask_handler(self, toolpath):
+        if toolpath is None:
+            return None
+        handler = self._mask_handlers.get(toolpath)
+        if handler is None:
+            handler = camera_mask_handler(self.config['camera'], load_toolpath(toolpath), self.mask_cache,
+                                          source=toolpath)
+            handler.generate_masks()
+            self._mask_handlers[toolpath] = handler
+        return handler
+
+    def process(self, frames, toolpath=None):
+        # frames: [(path, layer)]. Returns one defect record per frame, in order.
+        handler = self.mask_handler(toolpath)
+        images, rois = [], []
+        for path, layer in frames:
+            image = read_frame(path)
+            if handler is not None:
+                rois.append(handler.get_bbox(layer))
+                image = handler.apply_mask_to_image(image, layer)
+            else:
+                rois.append(None)
+            images.append(image)
+
+        records = []
+        for (path, layer), results in zip(frames, self.yolo_inference.infer_batch(images, rois)):
+            defects, _, _, _ = self.yolo_inference.process_results(results, layer, Path(path).name)
+            records.append(defects)
+        return records
+
+    def close(self):
+        for handler in self._mask_handlers.values():
+            handler.close()
+
+
+_worker = None
+
+
+def _init_worker(config, output_path):
+    global _worker
+    _worker = ReplayWorker(config, output_path)
+
+
+def _process_batch(frames, toolpath):
+    return _worker.process(frames, toolpath)
+
+
+class BatchReplay:
+    # Reprocesses finished prints with the current model and thresholds. Frames are split into
+    # batches of batch_size and spread over a pool of worker processes, each with its own model.
+    # workers=0 runs everything in this process.
+    def __init__(self, config, workers=None, batch_size=8, output_path=None):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        # Split the cores between the workers unless the config pins the model's thread count
+        backend = dict(config['yolo'].get('backend', {}))
+        if self.workers > 1 and not backend.get('threads'):
+            backend['threads'] = max(1, (os.cpu_count() or 1) // self.workers)
+        self.config = {**config, 'yolo': {**config['yolo'], 'backend': backend}}
+        self.batch_size = batch_size
+        self.output_path = Path(output_path or Path.cwd())
+        self._pool = None
+        self._local = None
+
+    def start(self):
+        if self.workers > 0:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_worker, initargs=(self.config, self.output_path)
+            )
+        else:
+            self._local = ReplayWorker(self.config, self.output_path)
+        return self
+
+    def replay(self, print_dir, toolpath=None, output=None, start_layer=0):
+        source = FileCameraSource(print_dir, start_layer)
+        if toolpath is not None:
+            toolpath = str(Path(toolpath).resolve())
+            self._warm_masks(toolpath)
+        batches = [
+            [(str(frame.path), frame.layer) for frame in source.frames[start:start + self.batch_size]]
+            for start in range(0, len(source), self.batch_size)
+        ]
+
+        print(f"Replaying {len(source)} frames of {source.part_name} in {len(batches)} batches")
+        start = time.perf_counter()
+        records = []
+        if self._pool is not None:
+            futures = [self._pool.submit(_process_batch, batch, toolpath) for batch in batches]
+            for i, future in enumerate(futures, 1):
+                records += future.result()
+                print(f"  {i}/{len(batches)} batches done")
+        else:
+            for i, batch in enumerate(batches, 1):
+                records += self._local.process(batch, toolpath)
+                print(f"  {i}/{len(batches)} batches done")
+        elapsed = time.perf_counter() - start
+        print(f"Replayed {len(records)} frames in {elapsed:.1f}s ({len(records) / max(elapsed, 1e-9):.2f} frames/s)")
+
+        output = Path(output) if output else Path(print_dir) / f"{source.part_name}_defects_replay.json"
+        with open(output, "w+") as f:
+            f.write(json.dumps(records, indent=4))
+        return output, records
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._local is not None:
+            self._local.close()
+            self._local = None
+
+    def _warm_masks(self, toolpath):
+        # Build the persistent mask cache once here, so the workers only memory-map it
+        if not self.config.get('mask_cache_dir'):
+            return
+        handler = camera_mask_handler(self.config['camera'], load_toolpath(toolpath),
+                                      MaskCache(self.config['mask_cache_dir'], self.config.get('mask_workers')),
+                                      source=toolpath)
+        handler.generate_masks()
+        handler.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
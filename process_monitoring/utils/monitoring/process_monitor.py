@@ -1,16 +1,30 @@
 import time
 from utils.data_processing.gcode_parser import GCodeParser
 from utils.data_processing.mask_handler import MaskHandler
+from utils.data_processing.mask_cache import MaskCache
+from utils.data_processing.defect_journal import DefectJournal
+from utils.data_processing.defect_database import DefectDatabase, layer_heights
+from utils.data_processing.segment_index import ToolpathIndex
+from utils.data_processing.mask_handler import CoordinateTransformer
 from utils.monitoring.camera_handler import CameraHandler
 from utils.monitoring.yolo_inference import YOLOInference
+from utils.monitoring.inference_daemon import InferenceClient
+from utils.monitoring.layer_pipeline import LayerPipeline
+from utils.monitoring.layer_screening import LayerScreener
+from utils.monitoring.artifact_writer import ArtifactWriter
+from utils.monitoring.sensor_ingest import SensorIngest
 from utils.interfaces import LEDController
-from utils.interfaces import GPIOManager
+from utils.interfaces import GPIOManager, GPIOEventMonitor, load_config
+from utils.simulation import SimulatedBoard
+from utils.startup import StartupOrchestrator
+from utils.telemetry import metrics, MetricsServer, ConfigWatcher
 from datetime import datetime as dt
 from pathlib import Path
 import json
 
 class ProcessMonitor:
-    def __init__(self, config):
+    def __init__(self, config, config_path=None, inference_factory=None):
+        # inference_factory builds this monitor's model, MultiCellMonitor hands in a shared one
         self.config = config
         self.part_name = config.get("part_name", "unknown_part")
         self.output_path: Path = (
@@ -21,15 +35,183 @@ class ProcessMonitor:
         )
         self.output_path.mkdir(exist_ok=True, parents=True)
         self.gcode_parser = GCodeParser()
-        self.mask_handler = MaskHandler(**config['mask_handler'])
-        self.camera_handler = CameraHandler(config=config['camera'], output_path=self.output_path)
-        self.yolo_inference = YOLOInference(config['yolo'], output_path=self.output_path)
-        self.led_controller = LEDController()
-        self.gpio_manager = GPIOManager()
+        # One on-disk mask cache shared by both mask handlers
+        self.mask_cache = MaskCache(
+            config.get('mask_cache_dir', Path.home() / config.get("output_path", ".") / "mask_cache"),
+            workers=config.get('mask_workers')
+        )
+        self.trigger_latencies = []
         self.defect_summaries = []
+        # Seconds from trigger to the Mach4 signal, yolo.adaptive.deadline unless the pipeline sets its own
+        adaptive_config = config.get('yolo', {}).get('adaptive', {})
+        self.decision_budget = config.get('pipeline', {}).get('decision_budget')
+        if self.decision_budget is None and adaptive_config.get('enabled', False):
+            self.decision_budget = adaptive_config.get('deadline')
         self.current_layer = 0
         self.running = False
+        self.artifact_writer = ArtifactWriter(self.output_path / 'Camera', config.get('artifacts', {}))
+        journal_config = config.get('journal', {})
+        self.journal = DefectJournal(
+            self.output_path / f"{self.part_name}_defects.jsonl",
+            fsync_every=journal_config.get('fsync_every', 10),
+            fsync_interval=journal_config.get('fsync_interval', 5.0),
+        )
+        self._start_telemetry(config.get('telemetry', {}), config_path)
+
+        # Slow subsystems come up in parallel, run() only waits for the ones it uses
+        self.startup = StartupOrchestrator(parallel=config.get('startup', {}).get('parallel', True))
+        self.startup.add('led', lambda: LEDController(**config.get('led', {})))
+        self.startup.add('gpio', self._create_gpio)
+        self.startup.add('gpio_events', self._create_gpio_events, requires=['gpio'])
+        self.startup.add('mask_handler', lambda: MaskHandler(**config['mask_handler'], mask_cache=self.mask_cache))
+        self.startup.add('camera', self._create_camera, requires=['led'])
+        self.startup.add('camera_masks', self._setup_camera_masks, requires=['camera'])
+        self.startup.add('camera_connect', self._connect_camera, requires=['camera'])
+        self.startup.add('yolo', inference_factory or self._create_inference)
+        self.startup.add('pipeline', self._create_pipeline, requires=['camera_masks', 'camera_connect', 'yolo'])
+        if config.get('segment_index', {}).get('enabled', False):
+            self.startup.add('toolpath_index', self._create_toolpath_index)
+        if config.get('database', {}).get('enabled', False):
+            self.startup.add('database', self._create_database)
+        if config.get('sensors', {}).get('enabled', False):
+            self.startup.add('sensors', lambda: SensorIngest(config['sensors']))
+        self.startup.start()
+
+    @property
+    def led_controller(self):
+        return self.startup.get('led')
+
+    @property
+    def gpio_manager(self):
+        return self.startup.get('gpio')
+
+    @property
+    def gpio_events(self):
+        return self.startup.get('gpio_events')
+
+    @property
+    def mask_handler(self):
+        return self.startup.get('mask_handler')
 
+    @property
+    def camera_handler(self):
+        return self.startup.get('camera_connect')
+
+    @property
+    def yolo_inference(self):
+        return self.startup.get('yolo')
+
+    @property
+    def pipeline(self):
+        return self.startup.get('pipeline')
+
+    def _start_telemetry(self, telemetry_config, config_path):
+        metrics.profile_dir = self.output_path / 'profiles'
+        self.metrics_server = None
+        self.config_watcher = None
+        if not telemetry_config.get('enabled', False):
+            return
+        try:
+            self.metrics_server = MetricsServer(
+                metrics, telemetry_config.get('host', '127.0.0.1'), telemetry_config.get('port', 9108)
+            )
+        except OSError as exc:
+            print(f"Metrics endpoint not started: {exc}")
+        if telemetry_config.get('profile_layers', 0):
+            metrics.start_profile(telemetry_config['profile_layers'])
+        if config_path is not None:
+            # Raising telemetry.profile_layers in the file profiles that many upcoming layers
+            self.config_watcher = ConfigWatcher(
+                config_path, self._reload_telemetry, load_config, telemetry_config.get('config_poll', 2.0)
+            )
+
+    def _reload_telemetry(self, config):
+        telemetry_config = config.get('telemetry', {})
+        layers = telemetry_config.get('profile_layers', 0)
+        if layers != self.config.get('telemetry', {}).get('profile_layers', 0):
+            metrics.start_profile(layers)
+        self.config = {**self.config, 'telemetry': telemetry_config}
+
+    def _create_inference(self):
+        # With yolo.daemon.enabled the model stays loaded in inference_daemon.py across restarts
+        if self.config['yolo'].get('daemon', {}).get('enabled', False):
+            return InferenceClient(self.config['yolo'], output_path=self.output_path)
+        return YOLOInference(self.config['yolo'], output_path=self.output_path)
+
+    def _create_gpio(self):
+        gpio_config = self.config.get('gpio', {})
+        return GPIOManager(
+            backend=SimulatedBoard() if gpio_config.get('simulated', False) else None, pins=gpio_config.get('pins')
+        )
+
+    def _create_gpio_events(self, gpio):
+        gpio_config = self.config.get('gpio', {})
+        return GPIOEventMonitor(
+            gpio,
+            poll_interval=gpio_config.get('poll_interval', 0.005),
+            debounce=gpio_config.get('debounce'),
+        )
+
+    def _create_camera(self, led):
+        # One LED handle shared with the camera instead of opening SPI twice
+        return CameraHandler(
+            config=self.config['camera'], output_path=self.output_path, mask_cache=self.mask_cache,
+            led_controller=led, defer_setup=True
+        )
+
+    def _setup_camera_masks(self, camera):
+        camera.setup_camera()
+        return camera
+
+    def _connect_camera(self, camera):
+        camera.connect_camera()
+        return camera
+
+    def _create_toolpath_index(self):
+        # Same pixel mapping as the camera masks, so defect boxes line up with the toolpath
+        camera_config = self.config['camera']
+        transformer = CoordinateTransformer(
+            camera_config.get('pix_per_mm', 56),
+            camera_config.get('image_width', 5472),
+            camera_config.get('image_height', 3648),
+        )
+        index_config = self.config['segment_index']
+        return ToolpathIndex(self.config['gcode_file'], transformer,
+                             cell_size=index_config.get('cell_size', 64),
+                             layer_offset=index_config.get('layer_offset', 1))
+
+    def _create_database(self):
+        database_config = self.config['database']
+        path = database_config.get('path') or Path.home() / self.config.get('output_path', '.') / 'defects.sqlite'
+        database = DefectDatabase(path, synchronous=database_config.get('synchronous', 'NORMAL'))
+        heights = {}
+        if database_config.get('layer_heights', True) and self.config.get('gcode_file'):
+            try:
+                heights = layer_heights(self.config['gcode_file'])
+            except OSError as exc:
+                print(f"No layer heights for the defect database: {exc}")
+        # Keyed like the report cleanup() writes, so importing the output tree later skips this print
+        # Same mapping from monitor to G-code layers as the segment index
+        layer_offset = self.config.get('segment_index', {}).get('layer_offset', 1)
+        database.begin_print(self.part_name, self.output_path / f"{self.part_name}_defects.json", heights=heights,
+                             layer_offset=layer_offset)
+        return database
+
+    def _create_pipeline(self, camera_masks, camera_connect, yolo):
+        pipeline_config = self.config.get('pipeline', {})
+        screening_config = self.config.get('screening', {})
+        return LayerPipeline(
+            camera_connect,
+            yolo,
+            self.artifact_writer,
+            on_decision=self.handle_decision,
+            on_persisted=self.handle_persisted,
+            queue_size=pipeline_config.get('queue_size', 2),
+            persist_queue_size=pipeline_config.get('persist_queue_size', 8),
+            screener=LayerScreener(screening_config) if screening_config.get('enabled', False) else None,
+            decision_budget=self.decision_budget,
+            on_error_action=pipeline_config.get('on_error', 'rework'),
+        )
 
     def setup(self):
         # Initialize and setup components
@@ -39,30 +221,83 @@ class ProcessMonitor:
 
     def run(self):
         self.running = True
-        while self.running:
-            if self.gpio_manager.should_capture_image():
-                self.process_layer()
-
-            if self.gpio_manager.should_exit():
-                print("GPIO manager says we should exit")
-                self.running = False
+        gpio_events = self.gpio_events
+        gpio_events.start()
+        try:
+            while self.running:
+                # Blocks until a debounced rising edge, a held photo line only fires once
+                event = gpio_events.wait_for(('photo', 'exit'), timeout=1.0)
+                if event is None:
+                    continue
+                if event.name == 'photo':
+                    self.process_layer(trigger=event)
+                else:
+                    print("GPIO manager says we should exit")
+                    self.running = False
+        finally:
+            gpio_events.stop()
 
-            time.sleep(0.01)  
+    def process_layer(self, trigger=None):
+        # The first trigger waits here for the camera, masks and model if they are still starting
+        pipeline = self.pipeline
+        if not self.camera_handler.camera.IsConnected():
+            raise ConnectionError("Camera is not connected")
+        # Returns once Mach4 has been signalled, images are written in the background
+        job = pipeline.submit(self.current_layer, trigger.timestamp if trigger else None)
+        job.wait_for_decision()
+        return job
 
-    def process_layer(self):
-        self.led_controller.toggle_leds(True)
-        image, filepath = self.camera_handler.capture_image(self.current_layer)
-        self.led_controller.toggle_leds(False)
+    def handle_decision(self, job):
+        self.handle_corrections(job.planarize, job.rework)
+        latency = time.perf_counter() - job.trigger_time
+        metrics.observe('trigger_to_decision', latency)
+        self.trigger_latencies.append((job.layer, latency))
+        job.defects["Trigger to decision (ms)"] = round(latency * 1000, 2)
+        print(f"Layer {job.layer}: trigger to decision {latency * 1000:.1f} ms")
+        budget = self.decision_budget
+        job.defects["Deadline met"] = None if budget is None else latency <= budget
+        if budget is not None and latency > budget:
+            metrics.increment('decision_deadline_misses', part=self.part_name)
+            print(f"Layer {job.layer}: decision {(latency - budget) * 1000:.1f} ms past its {budget * 1000:.0f} ms budget "
+                  f"({job.inference_profile} profile)")
 
-        results, plotted_img = self.yolo_inference.predict(image, filepath=filepath)
-        defects, updated_layer, planarize, rework = self.yolo_inference.process_results(
-            results, self.current_layer, filepath.name
-        )
+        self.current_layer = job.next_layer
+        self.defect_summaries.append(job.defects)
 
-        self.handle_corrections(planarize, rework)
-        self.current_layer = updated_layer
-        self.defect_summaries.append(defects)
-        # Save results, update logs, etc.
+    def handle_persisted(self, job):
+        # Journalled from the persistence stage so the fsync stays off the decision path
+        record = {
+            "Layer number": job.layer,
+            "Timestamp": job.timestamp,
+            "Stage timings (ms)": {stage: round(t * 1000, 2) for stage, t in job.timings.items()},
+            "Trigger to decision (ms)": (
+                round((job.decision_time - job.trigger_time) * 1000, 2) if job.decision_time else None
+            ),
+            "Profiled": job.profile,
+            "Inference profile": job.inference_profile,
+        }
+        metrics.record_layer(record)
+        metrics.set_gauge('artifact_writes_pending', self.artifact_writer.pending())
+        # Pressure and laser readings while this layer was printed, up to its photo trigger.
+        # Failed layers come through here too, with an error record, so the next layer's
+        # window starts at the right place.
+        sensors = self.startup.peek('sensors', timeout=0)
+        sensor_record = sensors.layer_aggregates(end=job.trigger_time) if sensors is not None else None
+        if job.defects is not None:
+            job.defects["Stage timings (ms)"] = record["Stage timings (ms)"]
+            # Off the decision path, building a layer's segment index is not cheap. Not waited for,
+            # layers persisted while the index is still loading are not annotated.
+            toolpath_index = self.startup.peek('toolpath_index', timeout=0)
+            if toolpath_index is not None and job.defects["Number of defects"]:
+                toolpath_index.annotate(job.defects)
+            if sensor_record is not None:
+                job.defects["Sensors"] = sensor_record
+            self.journal.append(job.defects)
+            # Not waited for, layers persisted before the database is open are only in the report
+            database = self.startup.peek('database', timeout=0)
+            if database is not None:
+                action = 'planarize' if job.planarize else 'rework' if job.rework else 'none'
+                database.record_layer(job.defects, action)
 
     def handle_corrections(self, planarize, rework):
         if planarize:
@@ -71,8 +306,25 @@ class ProcessMonitor:
             self.gpio_manager.signal_rework()
 
     def cleanup(self):
-        # Perform any necessary cleanup
-        self.led_controller.cleanup()
-        self.gpio_manager.cleanup()
+        # Perform any necessary cleanup, skipping components that never came up
+        self.startup.wait_all(timeout=self.config.get('startup', {}).get('cleanup_timeout', 30))
+        print(self.startup.report())
+        pipeline = self.startup.peek('pipeline', timeout=0)
+        if pipeline:
+            pipeline.close()
+        self.artifact_writer.close()
+        self.journal.close()
+        if self.config_watcher:
+            self.config_watcher.close()
+        if self.metrics_server:
+            self.metrics_server.close()
+        for name in ('yolo', 'mask_handler', 'camera_connect', 'sensors', 'database', 'led', 'gpio'):
+            component = self.startup.peek(name, timeout=0)
+            if component is None:
+                continue
+            if name in ('yolo', 'mask_handler', 'camera_connect', 'sensors', 'database'):
+                component.close()
+            else:
+                component.cleanup()
         with open(self.output_path / f"{self.part_name}_defects.json", "w+") as f:
             f.write(json.dumps(self.defect_summaries, indent=4))
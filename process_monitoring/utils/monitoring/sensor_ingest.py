@@ -0,0 +1,199 @@
+import threading
+import time
+
+import numpy as np
+
+from static import ARDUINO_PORT, ARDUINO_BAUD, DataTypes
+from utils.telemetry import metrics
+
+
+def serial_opener():
+    # Imported here so the monitor runs without pyserial when sensors are disabled. Called from
+    # SensorIngest.__init__, so a missing pyserial fails the sensors component at start-up.
+    import serial
+    return lambda port, baud, timeout: serial.Serial(port, baud, timeout=timeout)
+
+
+class SensorRingBuffer:
+    # Fixed-size history of timestamped samples, one column per channel. Allocated once, the
+    # reader thread overwrites the oldest samples and window() copies out a time range.
+    def __init__(self, channels, capacity=262144):
+        self.channels = list(channels)
+        self.capacity = capacity
+        self.times = np.zeros(capacity, np.float64)  # time.perf_counter() of each sample
+        self.values = np.zeros((capacity, len(self.channels)), np.float64)
+        self.count = 0  # samples written since the start, the next one goes to count % capacity
+        self._lock = threading.Lock()
+
+    def extend(self, times, values):
+        times = np.asarray(times, np.float64)[-self.capacity:]
+        values = np.asarray(values, np.float64).reshape(-1, len(self.channels))[-self.capacity:]
+        n = len(times)
+        with self._lock:
+            start = self.count % self.capacity
+            first = min(n, self.capacity - start)
+            self.times[start:start + first] = times[:first]
+            self.values[start:start + first] = values[:first]
+            self.times[:n - first] = times[first:]
+            self.values[:n - first] = values[first:]
+            self.count += n
+
+    def window(self, start, end):
+        # (times, values) of the samples with start < t <= end, and whether older ones were overwritten
+        with self._lock:
+            head = self.count % self.capacity
+            if self.count <= self.capacity:
+                segments = [(0, self.count)]
+            else:
+                segments = [(head, self.capacity), (0, head)]
+            times, values = [], []
+            for lo, hi in segments:
+                # Each segment is in time order, so the range is found by bisection
+                segment = self.times[lo:hi]
+                first = lo + np.searchsorted(segment, start, side='right')
+                last = lo + np.searchsorted(segment, end, side='right')
+                times.append(self.times[first:last].copy())
+                values.append(self.values[first:last].copy())
+            oldest = self.times[segments[0][0]] if self.count else None
+            truncated = self.count > self.capacity and oldest > start
+        return np.concatenate(times), np.concatenate(values), truncated
+
+    def latest(self):
+        with self._lock:
+            if not self.count:
+                return None
+            return self.values[(self.count - 1) % self.capacity].copy()
+
+
+class SensorIngest:
+    # Reads the Arduino's pressure and laser stream on a background thread. Every line is one
+    # sample, comma-separated values in the order of `fields`. Samples are timestamped on
+    # arrival, spread evenly over the time since the previous read, so they line up with the
+    # photo triggers, and go into a SensorRingBuffer. The layer loop never touches the port,
+    # it only asks for the aggregates of the window since the previous layer.
+    def __init__(self, config, serial_factory=None):
+        # serial_factory(port, baud, timeout) opens the port, pyserial unless given
+        self.port = config.get('port') or ARDUINO_PORT
+        self.baud = config.get('baud') or ARDUINO_BAUD
+        self.fields = config.get('fields', [DataTypes.PRESSURE.value, DataTypes.LASER.value])
+        self.channels = [field for field in self.fields if field is not None]  # None skips a column
+        # Out-of-band limits per channel, [low, high] with null for no limit
+        self.bands = {name: band for name, band in config.get('bands', {}).items() if name in self.channels}
+        self.timeout = config.get('timeout', 0.05)
+        self.reconnect = config.get('reconnect', 1.0)
+        self.buffer = SensorRingBuffer(self.channels, config.get('capacity', 262144))
+        self.serial_factory = serial_factory or serial_opener()
+        self.samples = 0
+        self.parse_errors = 0
+        self._columns = [i for i, field in enumerate(self.fields) if field is not None]
+        self._layer_start = time.perf_counter()
+        self._layer_errors = 0
+        self._serial = None
+        self._running = True
+        self._connected = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sensor-ingest', daemon=True)
+        self._thread.start()
+
+    def wait_connected(self, timeout=None):
+        return self._connected.wait(timeout)
+
+    def _run(self):
+        while self._running:
+            try:
+                self._serial = self.serial_factory(self.port, self.baud, self.timeout)
+                print(f"Reading sensors from {self.port} at {self.baud} baud")
+                self._connected.set()
+                self._read(self._serial)
+            except Exception as exc:
+                # pyserial's SerialException (an OSError) when the Arduino is unplugged, anything
+                # else is logged too, the reader keeps retrying rather than dying silently
+                if self._running:
+                    print(f"Sensor port {self.port}: {type(exc).__name__}: {exc}, retrying in {self.reconnect}s")
+            finally:
+                self._connected.clear()
+                if self._serial is not None:
+                    self._serial.close()
+                    self._serial = None
+            if self._running:
+                time.sleep(self.reconnect)
+
+    def _read(self, port):
+        pending = b''
+        last = time.perf_counter()
+        while self._running:
+            data = port.read(port.in_waiting or 1)
+            if not data:
+                last = time.perf_counter()
+                continue
+            *lines, pending = (pending + data).split(b'\n')
+            now = time.perf_counter()
+            if lines:
+                self._ingest(lines, last, now)
+                last = now
+
+    def _ingest(self, lines, last, now):
+        rows = []
+        for line in lines:
+            parts = line.strip().split(b',')
+            if len(parts) != len(self.fields):
+                self.parse_errors += 1
+                continue
+            try:
+                rows.append([float(parts[i]) for i in self._columns])
+            except ValueError:
+                self.parse_errors += 1
+        if not rows:
+            return
+        times = np.linspace(last, now, len(rows) + 1)[1:]
+        self.buffer.extend(times, rows)
+        self.samples += len(rows)
+        metrics.increment('sensor_samples', len(rows))
+        for name, value in zip(self.channels, rows[-1]):
+            metrics.set_gauge('sensor_value', value, channel=name)
+
+    def layer_aggregates(self, end=None):
+        # Statistics of everything read since the previous call, e.g. one printed layer between
+        # two photo triggers. end is a time.perf_counter() value, now by default.
+        end = time.perf_counter() if end is None else end
+        start, self._layer_start = self._layer_start, end
+        times, values, truncated = self.buffer.window(start, end)
+        errors, self._layer_errors = self.parse_errors - self._layer_errors, self.parse_errors
+        record = {
+            "Samples": len(times),
+            "Window (s)": round(end - start, 3),
+            "Truncated": bool(truncated),  # the ring buffer no longer held the start of the layer
+            "Parse errors": errors,
+        }
+        for i, name in enumerate(self.channels):
+            column = values[:, i]
+            if not len(column):
+                record[name] = None
+                continue
+            stats = {
+                "Min": round(float(column.min()), 4),
+                "Max": round(float(column.max()), 4),
+                "Mean": round(float(column.mean()), 4),
+                "Std": round(float(column.std()), 4),
+            }
+            if name in self.bands:
+                low, high = self.bands[name]
+                outside = np.zeros(len(column), bool)
+                if low is not None:
+                    outside |= column < low
+                if high is not None:
+                    outside |= column > high
+                stats["Out of band"] = int(outside.sum())
+                stats["Out of band fraction"] = round(float(outside.mean()), 6)
+            record[name] = stats
+        return record
+
+    def close(self):
+        self._running = False
+        self._thread.join(self.timeout + self.reconnect + 1.0)
+        print(f"Sensor ingest: {self.samples} samples, {self.parse_errors} unparsable lines")
+
+# Usage example:
+# sensors = SensorIngest({'port': '/dev/ttyACM0', 'bands': {'Pressure': [20.0, 80.0]}})
+# ...                                       # printing, the reader fills the ring buffer
+# defects["Sensors"] = sensors.layer_aggregates(end=trigger_time)
+# sensors.close()
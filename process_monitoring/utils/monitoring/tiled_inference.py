@@ -0,0 +1,121 @@
+import numpy as np
+
+from utils.monitoring.detections import boxes_array
+
+
+def tile_starts(length, tile, overlap):
+    # Start offsets along one axis, the last tile is pushed back so it ends on the edge
+    if length <= tile:
+        return [0]
+    step = max(1, int(tile * (1 - overlap)))
+    starts = list(range(0, length - tile, step))
+    starts.append(length - tile)
+    return starts
+
+
+def tile_grid(width, height, tile, overlap):
+    return [
+        (x, y, min(x + tile, width), min(y + tile, height))
+        for y in tile_starts(height, tile, overlap)
+        for x in tile_starts(width, tile, overlap)
+    ]
+
+
+def box_overlap(box, boxes, metric='iou'):
+    ix1 = np.maximum(box[0], boxes[:, 0])
+    iy1 = np.maximum(box[1], boxes[:, 1])
+    ix2 = np.minimum(box[2], boxes[:, 2])
+    iy2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    if metric == 'ios':
+        # Intersection over the smaller box, catches a box cut in half by a tile edge
+        denom = np.minimum(area, areas)
+    else:
+        denom = area + areas - inter
+    return inter / np.maximum(denom, 1e-9)
+
+
+def merge_boxes(data, threshold=0.5, metric='ios', method='nms'):
+    # Greedy, class-aware merge of (N, 6) [x1, y1, x2, y2, conf, cls] rows.
+    # 'nms' keeps the most confident box of each cluster, 'wbf' averages the cluster's
+    # coordinates weighted by confidence and keeps the highest confidence.
+    data = np.asarray(data, dtype=np.float32).reshape(-1, 6)
+    if len(data) < 2:
+        return data
+    remaining = np.argsort(-data[:, 4], kind='stable')
+    merged = []
+    while remaining.size:
+        best, rest = remaining[0], remaining[1:]
+        matches = (data[rest, 5] == data[best, 5]) & (box_overlap(data[best], data[rest], metric) >= threshold)
+        cluster = np.concatenate(([best], rest[matches]))
+        if method == 'wbf' and cluster.size > 1:
+            weights = data[cluster, 4:5]
+            fused = data[best].copy()
+            fused[:4] = (data[cluster, :4] * weights).sum(axis=0) / weights.sum()
+            merged.append(fused)
+        else:
+            merged.append(data[best])
+        remaining = rest[~matches]
+    return np.stack(merged)
+
+
+class TiledInference:
+    # Runs the detector at native resolution on overlapping tiles, batch_size tiles per
+    # model call, and merges the per-tile boxes back into one set in frame coordinates.
+    def __init__(self, predict_batch, tile_size=1024, overlap=0.2, batch_size=4,
+                 merge='nms', match_metric='ios', match_threshold=0.5, margin=64):
+        self.predict_batch = predict_batch  # list of HxWx3 uint8 -> ultralytics results list
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.merge = merge
+        self.match_metric = match_metric
+        self.match_threshold = match_threshold
+        self.margin = margin
+        self._batch = np.zeros((batch_size, tile_size, tile_size, 3), np.uint8)
+
+    def roi(self, frame_shape, bbox=None):
+        height, width = frame_shape[:2]
+        if bbox is None:
+            return 0, 0, width, height
+        x0, y0, x1, y1 = bbox
+        return (max(x0 - self.margin, 0), max(y0 - self.margin, 0),
+                min(x1 + self.margin, width), min(y1 + self.margin, height))
+
+    def predict(self, image, bbox=None, predict_batch=None):
+        # predict_batch overrides the one given at construction, e.g. with another profile's conf
+        predict_batch = predict_batch or self.predict_batch
+        rx0, ry0, rx1, ry1 = self.roi(image.shape, bbox)
+        tiles = [
+            (x0 + rx0, y0 + ry0, x1 + rx0, y1 + ry0)
+            for x0, y0, x1, y1 in tile_grid(rx1 - rx0, ry1 - ry0, self.tile_size, self.overlap)
+        ]
+
+        found = []
+        for start in range(0, len(tiles), self.batch_size):
+            batch_tiles = tiles[start:start + self.batch_size]
+            inputs = [self._fill_slot(i, image, tile) for i, tile in enumerate(batch_tiles)]
+            for (x0, y0, x1, y1), result in zip(batch_tiles, predict_batch(inputs)):
+                data = boxes_array([result])
+                if len(data):
+                    data[:, [0, 2]] = (data[:, [0, 2]] + x0).clip(x0, x1)
+                    data[:, [1, 3]] = (data[:, [1, 3]] + y0).clip(y0, y1)
+                    found.append(data)
+
+        if not found:
+            return np.zeros((0, 6), np.float32)
+        return merge_boxes(np.concatenate(found), self.match_threshold, self.match_metric, self.merge)
+
+    def _fill_slot(self, slot_index, image, tile):
+        x0, y0, x1, y1 = tile
+        slot = self._batch[slot_index]
+        h, w = y1 - y0, x1 - x0
+        src = image[y0:y1, x0:x1]
+        # Gray frames are broadcast into the three channels without an RGB copy of the frame
+        slot[:h, :w] = src[:, :, None] if src.ndim == 2 else src
+        if h < self.tile_size or w < self.tile_size:
+            slot[h:] = 0
+            slot[:h, w:] = 0
+        return slot
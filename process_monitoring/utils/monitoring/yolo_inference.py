@@ -1,35 +1,161 @@
-import torch
-from ultralytics import YOLO
+import time
+
 import cv2
 import numpy as np
 from typing import Dict, List, Tuple
 from pathlib import Path
+from utils.monitoring.detections import boxes_array, build_results, remap_boxes, render_overlay
+from utils.monitoring.inference_preprocessing import RoiPreprocessor
+from utils.monitoring.tiled_inference import TiledInference
+from utils.monitoring.inference_backends import load_backend
+from utils.monitoring.inference_profiles import InferenceProfiles
+from utils.telemetry import metrics
 
 
 class YOLOInference:
     def __init__(self, config: Dict, output_path: Path):
-        self.model = YOLO(config["model_path"])
-        self.model.to('cuda' if torch.cuda.is_available() else 'cpu')
+        # torch, torchscript, onnx or openvino, chosen with yolo.backend
+        self.backend = load_backend(config)
+        self._configure(config, self.backend.names)
+        self._load_profiles()
+
+    def _load_profiles(self):
+        # Backends of adaptive profiles, then their start-up timing when yolo.adaptive.calibrate is set
+        self.profiles.load_backends(self.config, load_backend)
+        self.profiles.calibrate(lambda image, profile: self._infer(image, None, profile.name))
+
+    def _configure(self, config: Dict, names):
+        # Everything but the model, InferenceClient sets up the same without loading it
         self.config = config
-        self.names = self.model.names
+        self.names = names
         self.correction_enabled = config.get('correction_enabled', True)
         self.remove_underextrusions = config.get('remove_underextrusions', True)
+        self.imgsz = config.get('imgsz', 2048)
+        self.conf = config.get('conf', 0.85)
+        self.profiles = InferenceProfiles(config)
+        roi_config = config.get('roi', {})
+        # Buffers sized for the largest profile, smaller ones use a prefix of them
+        largest = max(profile.imgsz for profile in self.profiles.profiles)
+        self.preprocessor = (
+            RoiPreprocessor(largest, roi_config.get('margin', 64)) if roi_config.get('enabled', False) else None
+        )
+        self.tiler = self._make_tiler(config.get('tiling', {}), roi_config)
+
+    def _make_tiler(self, tiling_config, roi_config):
+        if not tiling_config.get('enabled', False):
+            return None
+        tile_size = tiling_config.get('tile_size', 1024)
+        return TiledInference(
+            lambda batch: self.backend.predict(batch, imgsz=tile_size, conf=self.conf, verbose=False),
+            tile_size=tile_size,
+            overlap=tiling_config.get('overlap', 0.2),
+            batch_size=tiling_config.get('batch_size', 4),
+            merge=tiling_config.get('merge', 'nms'),
+            match_metric=tiling_config.get('match_metric', 'ios'),
+            match_threshold=tiling_config.get('match_threshold', 0.5),
+            # Without ROI cropping the tiles cover the whole frame
+            margin=roi_config.get('margin', 64),
+        )
 
     def predict(self, image: np.ndarray, filepath: Path) -> Tuple[List, np.ndarray]:
+        results = self.infer(image)
+        return results, self.save_plot(results, filepath)
+
+    def select_profile(self, deadline=None) -> str:
+        return self.profiles.select(deadline)
+
+    def infer(self, image: np.ndarray, roi=None, deadline=None, profile=None) -> List:
+        # profile is a name from yolo.adaptive.profiles, chosen for the deadline when not given
+        profile = profile or self.select_profile(deadline)
+        start = time.perf_counter()
+        with metrics.timer('inference'):
+            results = self._infer(image, roi, profile)
+        self.profiles.observe(profile, time.perf_counter() - start)
+        # The backend's own preprocess/inference/postprocess split, in ms
+        for phase, ms in (getattr(results[0], 'speed', None) or {}).items():
+            if ms is not None:
+                metrics.observe('model', ms / 1000, phase=phase)
+        return results
+
+    def _infer(self, image: np.ndarray, roi=None, profile=None) -> List:
+        profile = self.profiles.get(profile)
+        backend = profile.backend or self.backend
+        if self.tiler is not None and profile.tiling:
+            # Tiles always run at tile_size, the profile picks the backend and conf
+            data = self.tiler.predict(
+                image, roi if self.preprocessor is not None else None,
+                lambda batch: backend.predict(batch, imgsz=self.tiler.tile_size, conf=profile.conf, verbose=False),
+            )
+            return build_results(image, self.names, data)
+
+        if self.preprocessor is None:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)#yolo model takes RGB input, need to adjust later
+            return backend.predict(image, imgsz=profile.imgsz, conf=profile.conf)
+
+        # Crop to the toolpath, run the model on the crop and put the boxes back in frame coordinates
+        frame = self.preprocessor.prepare(image, roi, profile.imgsz)
+        results = backend.predict(frame.image, imgsz=list(frame.imgsz), conf=profile.conf)
+        data = remap_boxes(boxes_array(results), frame.scale, frame.offset, frame.frame_shape)
+        return build_results(image, self.names, data, speed=results[0].speed)
+
+    def infer_batch(self, images: List[np.ndarray], rois=None, profile=None) -> List[List]:
+        # Several frames per model call for offline reprocessing, one infer()-style results list per frame
+        rois = rois if rois is not None else [None] * len(images)
+        profile = profile or self.profiles.default.name
+        start = time.perf_counter()
+        batched = self._infer_batch(images, rois, profile)
+        self.profiles.observe(profile, (time.perf_counter() - start) / max(1, len(images)))
+        return batched
+
+    def _infer_batch(self, images, rois, profile):
+        settings = self.profiles.get(profile)
+        backend = settings.backend or self.backend
+        if self.tiler is not None and settings.tiling:
+            # Tiles are already batched inside each frame
+            return [self._infer(image, roi, profile) for image, roi in zip(images, rois)]
+
+        if self.preprocessor is None:
+            batch = [cv2.cvtColor(image, cv2.COLOR_GRAY2RGB) for image in images]
+            return [[result] for result in backend.predict(batch, imgsz=settings.imgsz, conf=settings.conf)]
+
+        # prepare() reuses its buffers, so each crop is copied out before the next one is made.
+        # Crops differ in shape between layers and are letterboxed to imgsz by the backend.
+        frames, crops = [], []
+        for image, roi in zip(images, rois):
+            frame = self.preprocessor.prepare(image, roi, settings.imgsz)
+            frames.append(frame)
+            crops.append(frame.image.copy())
+        results = backend.predict(crops, imgsz=settings.imgsz, conf=settings.conf)
+        batched = []
+        for image, frame, result in zip(images, frames, results):
+            data = remap_boxes(boxes_array([result]), frame.scale, frame.offset, frame.frame_shape)
+            batched.append(build_results(image, self.names, data, speed=result.speed))
+        return batched
+
+    def frame_buffer(self, shape, dtype=np.uint8):
+        # Where the mask stage should write the frame for this model, None for any buffer
+        return None
+
+    def close(self):
+        pass
+
+    def save_plot(self, results, filepath: Path) -> np.ndarray:
         output_path = filepath.parent / filepath.name.replace(".bmp", "_predictions.jpeg")
-        image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)#yolo model takes RGB input, need to adjust later
-        results = self.model.predict(image, save=False, imgsz=2048, conf=0.85)
-        cv2.imwrite(output_path, results[0].plot())
-        return results, results[0].plot()
+        plotted_img = render_overlay(results[0])
+        cv2.imwrite(output_path, plotted_img)
+        return plotted_img
 
     def process_results(self, results, layer: int, filename: str) -> Tuple[Dict, int, bool, bool]:
-        boxes = results[0].boxes.data
-        num_defects = len(boxes)
+        with metrics.timer('postprocess'):
+            return self._process_results(results, layer, filename)
+
+    def _process_results(self, results, layer: int, filename: str) -> Tuple[Dict, int, bool, bool]:
         decision = ''
         planarize = False
         rework = False
 
         defects = self.summarize_defects(results, layer, filename, decision)
+        num_defects = defects['Number of defects']
 
         if num_defects > 0 and self.correction_enabled:
             over_extrusions = defects['Overextrusions']
@@ -47,35 +173,33 @@ class YOLOInference:
         return defects, layer, planarize, rework
 
     def summarize_defects(self, results, layer: int, filename: str, decision: str) -> Dict:
-        boxes = results[0].boxes.data
-        num_defects = len(boxes)
-        total_defects = []
-        over_extrusions = 0
-        under_extrusions = 0
-
-        for box in results[0].boxes:
-            class_id = self.names[box.cls[0].item()]
-            if class_id == 'Overextrusion':
-                over_extrusions += 1
-            else:
-                under_extrusions += 1
-
-            cords = box.xyxy[0].tolist()
-            cords = [round(x) for x in cords]
-            width = cords[2] - cords[0]
-            height = cords[3] - cords[1]
-            aspect_ratio = width / height
-            area = width * height
-            conf = round(box.conf[0].item(), 2)
-
-            defect_data = {
+        # One host transfer for all boxes, then whole-array arithmetic
+        data = boxes_array(results)
+        num_defects = len(data)
+
+        cords = np.rint(data[:, :4]).astype(np.int64)
+        widths = cords[:, 2] - cords[:, 0]
+        heights = cords[:, 3] - cords[:, 1]
+        areas = widths * heights
+        aspect_ratios = np.divide(widths, heights, out=np.full(num_defects, np.nan), where=heights != 0)
+        confidences = np.round(data[:, 4].astype(np.float64), 2)
+        class_names = [self.names[class_id] for class_id in data[:, 5].astype(np.int64).tolist()]
+
+        over_extrusions = class_names.count('Overextrusion')
+        under_extrusions = num_defects - over_extrusions
+
+        total_defects = [
+            {
                 "Class": class_id,
                 "Confidence": conf,
-                "Defect coordinates": cords,
+                "Defect coordinates": box,
                 "Box area (px)": area,
-                "Box aspect ratio": aspect_ratio
+                "Box aspect ratio": None if aspect_ratio != aspect_ratio else aspect_ratio
             }
-            total_defects.append(defect_data)
+            for class_id, conf, box, area, aspect_ratio in zip(
+                class_names, confidences.tolist(), cords.tolist(), areas.tolist(), aspect_ratios.tolist()
+            )
+        ]
 
         defect_layer = {
             "Layer number": layer,
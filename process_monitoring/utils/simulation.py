@@ -0,0 +1,447 @@
+import os
+import sys
+import select
+import time
+import threading
+from types import SimpleNamespace
+
+# In-process stand-ins for the CHAMP hardware, used to exercise the monitor without a board attached
+
+
+class SimulatedPin:
+    def __init__(self, name, on_write=None):
+        self.name = name
+        self.value = False
+        self.history = []  # (time.perf_counter(), value) for every write
+        self.on_write = on_write
+
+    def write(self, value):
+        self.value = bool(value)
+        self.history.append((time.perf_counter(), self.value))
+        if self.on_write is not None:
+            self.on_write()
+
+
+class SimulatedDigitalInOut:
+    # Mirrors the parts of digitalio.DigitalInOut that GPIOManager uses
+    def __init__(self, pin):
+        self.pin = pin
+        self.direction = None
+
+    @property
+    def value(self):
+        return self.pin.value
+
+    @value.setter
+    def value(self, value):
+        self.pin.write(value)
+
+
+class SimulatedBoard:
+    # Scriptable replacement for the blinka board/digitalio pair.
+    # GPIOManager(backend=SimulatedBoard()) reads and writes these pins instead of hardware.
+    def __init__(self):
+        self.pins = {}
+        self.board = _SimulatedBoardModule(self)
+        self.digitalio = SimpleNamespace(
+            DigitalInOut=SimulatedDigitalInOut,
+            Direction=SimpleNamespace(INPUT='input', OUTPUT='output'),
+        )
+        self._timers = []
+        self.changes = 0  # pin writes so far, see wait_for_change
+        self._changed = threading.Condition()
+
+    def pin(self, name):
+        if name not in self.pins:
+            self.pins[name] = SimulatedPin(name, self._notify)
+        return self.pins[name]
+
+    def _notify(self):
+        with self._changed:
+            self.changes += 1
+            self._changed.notify_all()
+
+    def wait_for_change(self, seen, timeout=None):
+        # Blocks until a pin was written after the caller read changes == seen, like a pin interrupt
+        with self._changed:
+            self._changed.wait_for(lambda: self.changes != seen, timeout)
+            return self.changes
+
+    def set_input(self, name, value):
+        self.pin(name).write(value)
+
+    def pulse(self, name, width=0.05, delay=0.0, bounce=0):
+        # Raise name after delay for width seconds, optionally chattering bounce times first
+        events = []
+        for i in range(bounce):
+            events += [(delay + i * 0.0004, name, True), (delay + i * 0.0004 + 0.0002, name, False)]
+        start = delay + bounce * 0.0004
+        events += [(start, name, True), (start + width, name, False)]
+        return self.run_script(events)
+
+    def run_script(self, events):
+        # events: iterable of (seconds from now, pin name, value), played on a background thread
+        events = sorted(events, key=lambda event: event[0])
+
+        def play():
+            start = time.perf_counter()
+            for at, name, value in events:
+                delay = at - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+                self.set_input(name, value)
+
+        thread = threading.Thread(target=play, name='simulated-board', daemon=True)
+        thread.start()
+        self._timers.append(thread)
+        return thread
+
+    def wait_for_output(self, name, value=True, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        pin = self.pin(name)
+        while pin.value != value:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.0005)
+        return True
+
+
+class _SimulatedBoardModule:
+    # board.C0, board.D4, ... all resolve to SimulatedPin objects
+    def __init__(self, simulated_board):
+        self._simulated_board = simulated_board
+
+    def __getattr__(self, name):
+        return self._simulated_board.pin(name)
+
+    def SPI(self):
+        return SimpleNamespace(name='SPI')
+
+
+class SimulatedImage:
+    # Like a neoapi image, a user buffer goes back to the camera when the image is released
+    def __init__(self, array, buffer=None, on_release=None):
+        self._array = array
+        self._buffer = buffer
+        self._on_release = on_release
+
+    def GetNPArray(self):
+        return self._array
+
+    def GetUserBuffer(self):
+        return self._buffer
+
+    def IsEmpty(self):
+        return self._array is None
+
+    def __del__(self):
+        if self._on_release is not None and self._buffer is not None:
+            self._on_release(self._buffer)
+
+
+class SimulatedFeature:
+    # Any neoapi feature (ExposureTime, UserSetLoad, ...), remembers the last value written
+    def __init__(self, value=None):
+        self.value = value
+
+    def Get(self):
+        return self.value
+
+    def Set(self, value):
+        self.value = value
+
+    def GetString(self):
+        return str(self.value)
+
+    def SetString(self, value):
+        self.value = value
+
+    def Execute(self):
+        pass
+
+
+class SimulatedCommand(SimulatedFeature):
+    def __init__(self, action):
+        super().__init__()
+        self.action = action
+
+    def Execute(self):
+        self.action()
+
+
+class SimulatedFeatureList:
+    def __init__(self, **features):
+        self._features = dict(features)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._features.setdefault(name, SimulatedFeature())
+
+
+class SimulatedBufferBase:
+    # neoapi.BufferBase stand-in
+    def __init__(self):
+        self.memory = None
+        self.size = 0
+
+    def RegisterMemory(self, memory, size):
+        self.memory = memory
+        self.size = size
+
+
+class SimulatedCam:
+    # neoapi.Cam stand-in that hands out the given frames round robin. With TriggerMode On a
+    # frame is only produced for a software trigger or fire_line_trigger(), after TriggerDelay
+    # plus ExposureTime (both in us) and readout_time. exposures records each exposure window
+    # in time.perf_counter() seconds. User buffers are filled and lent out like the real
+    # camera does, and come back when the image is released.
+    def __init__(self, frames, connected=True, readout_time=0.0):
+        self.frames = frames
+        height, width = frames[0].shape[:2] if frames else (0, 0)
+        self.f = SimulatedFeatureList(
+            Width=SimulatedFeature(width),
+            Height=SimulatedFeature(height),
+            PayloadSize=SimulatedFeature(frames[0].nbytes if frames else 0),
+            ExposureTime=SimulatedFeature(0),
+            TriggerMode=SimulatedFeature('Off'),
+            TriggerSource=SimulatedFeature('Software'),
+            TriggerDelay=SimulatedFeature(0),
+            TriggerSoftware=SimulatedCommand(self.fire_line_trigger),
+        )
+        self.readout_time = readout_time
+        self.grabbed = 0
+        self.dropped = 0
+        self.exposures = []
+        self.user_buffer_mode = False
+        self.image_buffer_count = 10
+        self._free_buffers = []
+        self._triggers = []
+        self._cond = threading.Condition()
+        self._connected = False
+        self._can_connect = connected
+        self.identifier = None  # serial the camera was connected by
+
+    def Connect(self, identifier=None):
+        self.identifier = identifier
+        self._connected = self._can_connect
+        return self
+
+    def Disconnect(self):
+        self._connected = False
+        return self
+
+    def IsConnected(self):
+        return self._connected
+
+    def SetImageBufferCount(self, count):
+        self.image_buffer_count = count
+        return self
+
+    def SetUserBufferMode(self, enabled=True):
+        self.user_buffer_mode = enabled
+        return self
+
+    def AddUserBuffer(self, buffer):
+        with self._cond:
+            self._free_buffers.append(buffer)
+        return self
+
+    def RevokeUserBuffer(self, buffer):
+        with self._cond:
+            if buffer in self._free_buffers:
+                self._free_buffers.remove(buffer)
+        return self
+
+    def fire_line_trigger(self):
+        with self._cond:
+            self._triggers.append(time.perf_counter())
+            self._cond.notify_all()
+
+    def GetImage(self, timeout=400):
+        if self.f.TriggerMode.GetString() == 'On':
+            deadline = time.perf_counter() + timeout / 1000
+            with self._cond:
+                while not self._triggers:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        return SimulatedImage(None)
+                    self._cond.wait(remaining)
+                triggered = self._triggers.pop(0)
+            start = triggered + (self.f.TriggerDelay.Get() or 0) / 1e6
+            end = start + (self.f.ExposureTime.Get() or 0) / 1e6
+            delay = end + self.readout_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.exposures.append((start, end))
+
+        frame = self.frames[self.grabbed % len(self.frames)] if self.frames else None
+        self.grabbed += 1
+        if not self.user_buffer_mode or frame is None:
+            return SimulatedImage(frame)
+        with self._cond:
+            buffer = self._free_buffers.pop(0) if self._free_buffers else None
+        if buffer is None:
+            self.dropped += 1  # no buffer to stream into
+            return SimulatedImage(None)
+        array = buffer.memory[:frame.size].reshape(frame.shape)
+        array[...] = frame
+        return SimulatedImage(array, buffer, on_release=self.AddUserBuffer)
+
+
+class SimulatedNeoAPI:
+    # Module-like replacement for neoapi, every Cam() shares the same frames
+    BufferBase = SimulatedBufferBase
+
+    def __init__(self, frames=None, connected=True, readout_time=0.0):
+        self.frames = list(frames) if frames is not None else []
+        self.connected = connected
+        self.readout_time = readout_time
+        self.cameras = []
+
+    def Cam(self):
+        camera = SimulatedCam(self.frames, self.connected, self.readout_time)
+        self.cameras.append(camera)
+        return camera
+
+
+class SimulatedNeoPixels:
+    # neopixel_spi.NeoPixel_SPI stand-in, history holds (time.perf_counter(), color) for every fill
+    def __init__(self, spi, num_pixels, pixel_order=None, auto_write=True):
+        self.spi = spi
+        self.num_pixels = num_pixels
+        self.pixel_order = pixel_order
+        self.auto_write = auto_write
+        self.color = (0, 0, 0)
+        self.history = []
+        self.deinitialized = False
+
+    def fill(self, color):
+        self.color = tuple(color)
+        self.history.append((time.perf_counter(), self.color))
+
+    def deinit(self):
+        self.deinitialized = True
+
+
+class SimulatedNeoPixelSPI:
+    # Module-like replacement for neopixel_spi
+    RGB = 'RGB'
+    GRB = 'GRB'
+
+    def __init__(self):
+        self.strips = []
+
+    def NeoPixel_SPI(self, spi, num_pixels, pixel_order=None, auto_write=True):
+        strip = SimulatedNeoPixels(spi, num_pixels, pixel_order, auto_write)
+        self.strips.append(strip)
+        return strip
+
+
+class SimulatedArduino:
+    # The sensor Arduino on a pseudo-terminal. port is a device path that SensorIngest opens
+    # through pyserial like the real one, and rate times a second a line of comma-separated
+    # values from sample(t) is written to it, t in seconds since start(). Lines the reader
+    # does not take in time are dropped, like a UART overrun.
+    def __init__(self, sample, rate=500.0):
+        # Imported here, termios does not exist on Windows where the monitor also has to import
+        import tty
+        self.sample = sample
+        self.rate = rate
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)  # no echo or newline translation
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self.written = 0
+        self.dropped = 0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._play, name='simulated-arduino', daemon=True)
+        self._thread.start()
+        return self
+
+    def _play(self):
+        start = time.perf_counter()
+        while self._running:
+            # Every line that is due by now, so the rate holds whatever the sleep granularity
+            due = int((time.perf_counter() - start) * self.rate)
+            lines = [
+                ','.join(str(value) for value in self.sample(i / self.rate))
+                for i in range(self.written + self.dropped, due)
+            ]
+            if lines:
+                self.write(''.join(line + '\n' for line in lines), len(lines))
+            time.sleep(0.002)
+
+    def write(self, text, lines=1):
+        # Also for raw or malformed input in tests. os.write on the pty can take only part of
+        # the buffer, the rest is written after it. A batch that finds the buffer full is
+        # dropped whole, one that is already partly out is finished once the reader makes
+        # room, so the reader never sees half a line followed by the next one.
+        data = memoryview(text.encode())
+        sent = 0
+        deadline = None
+        while sent < len(data):
+            try:
+                sent += os.write(self.master, data[sent:])
+            except BlockingIOError:
+                if sent == 0:
+                    self.dropped += lines
+                    return
+                deadline = deadline or time.perf_counter() + 1.0
+                if time.perf_counter() > deadline:
+                    # The reader has stopped, count what did not go out as dropped
+                    done = bytes(data[:sent]).count(b'\n')
+                    self.written += done
+                    self.dropped += lines - done
+                    return
+                select.select([], [self.master], [], 0.01)
+        self.written += lines
+
+    def close(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class SimulatedHardware:
+    # Puts stand-ins for neoapi, board, digitalio and neopixel_spi into sys.modules, so the
+    # unmodified CameraHandler, GPIOManager and LEDController code paths import them.
+    MODULES = ('neoapi', 'board', 'digitalio', 'neopixel_spi')
+
+    def __init__(self, frames=None, board=None):
+        self.board = board if board is not None else SimulatedBoard()
+        self.neoapi = SimulatedNeoAPI(frames)
+        self.neopixel_spi = SimulatedNeoPixelSPI()
+        self._saved = None
+
+    def install(self):
+        self._saved = {name: sys.modules.get(name) for name in self.MODULES}
+        sys.modules.update({
+            'neoapi': self.neoapi,
+            'board': self.board.board,
+            'digitalio': self.board.digitalio,
+            'neopixel_spi': self.neopixel_spi,
+        })
+        return self
+
+    def uninstall(self):
+        if self._saved is None:
+            return
+        for name, module in self._saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+        self._saved = None
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
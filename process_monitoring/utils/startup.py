@@ -0,0 +1,97 @@
+import time
+import threading
+import traceback
+
+
+class _Component:
+    def __init__(self, name, factory, requires):
+        self.name = name
+        self.factory = factory
+        self.requires = requires
+        self.value = None
+        self.error = None
+        self.started = None
+        self.elapsed = None
+        self.done = threading.Event()
+
+
+class StartupOrchestrator:
+    # Runs independent start-up steps on their own threads. A factory waits for the
+    # components it requires, and callers only block in get() on what they actually use.
+    def __init__(self, parallel=True):
+        self.parallel = parallel
+        self._components = {}
+        self._started = False
+
+    def add(self, name, factory, requires=()):
+        # factory gets the required components' values as keyword arguments
+        if self._started:
+            raise RuntimeError("Components must be added before start()")
+        self._components[name] = _Component(name, factory, tuple(requires))
+
+    def start(self):
+        self._started = True
+        for component in self._components.values():
+            if self.parallel:
+                threading.Thread(target=self._build, args=(component,), name=f"startup-{component.name}",
+                                 daemon=True).start()
+            else:
+                self._build(component)
+
+    def get(self, name, timeout=None):
+        component = self._components[name]
+        if not component.done.wait(timeout):
+            raise TimeoutError(f"{name} was not ready within {timeout}s")
+        if component.error is not None:
+            raise component.error
+        return component.value
+
+    def peek(self, name, timeout=None):
+        # Value if the component came up, None if it failed or is still starting
+        component = self._components.get(name)
+        if component is None or not component.done.wait(timeout) or component.error is not None:
+            return None
+        return component.value
+
+    def is_ready(self, name):
+        return self._components[name].done.is_set()
+
+    def wait_all(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for component in self._components.values():
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            component.done.wait(remaining)
+        return {name: c.error for name, c in self._components.items() if c.error is not None}
+
+    @property
+    def timings(self):
+        return {name: c.elapsed for name, c in self._components.items() if c.elapsed is not None}
+
+    def report(self):
+        lines = []
+        for name, component in self._components.items():
+            if component.error is not None:
+                status = f"failed: {component.error}"
+            elif component.elapsed is None:
+                status = "pending"
+            else:
+                status = f"{component.elapsed:.2f}s"
+            lines.append(f"  {name:<16}{status}")
+        return "Startup timings:\n" + "\n".join(lines)
+
+    def _build(self, component):
+        # Timed from when the dependencies are ready, so the numbers are per component
+        component.started = time.perf_counter()
+        try:
+            dependencies = {name: self.get(name) for name in component.requires}
+            component.started = time.perf_counter()
+            component.value = component.factory(**dependencies)
+        except Exception as exc:
+            component.error = exc
+            print(f"Startup of {component.name} failed: {exc}")
+            traceback.print_exc()
+        finally:
+            component.elapsed = time.perf_counter() - component.started
+            if component.error is None:
+                print(f"{component.name} ready in {component.elapsed:.2f}s")
+            component.done.set()
@@ -0,0 +1,289 @@
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Process-wide metrics. Components time themselves with metrics.timer('stage') and the
+# monitor serves everything in the Prometheus text format from MetricsServer.
+
+# Seconds, from a GPIO write to a full-frame inference on the CPU
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+class Telemetry:
+    def __init__(self, layer_history=200):
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.gauges = {}  # (name, labels) -> value
+        self.counters = {}  # (name, labels) -> value
+        self.layers = deque(maxlen=layer_history)  # per-layer timing records, newest last
+        self.started = time.time()
+        self.profile_dir = None
+        self._frames = deque()  # capture times of the last hour
+        self._profile_remaining = 0
+        self._profile_lock = threading.Lock()  # one cProfile at a time, see profile()
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def frame(self):
+        now = time.time()
+        with self._lock:
+            self._frames.append(now)
+            while self._frames and self._frames[0] < now - 3600:
+                self._frames.popleft()
+        self.increment('frames_total')
+
+    def frames_per_hour(self):
+        # Frames over the last hour, or extrapolated from a shorter run
+        with self._lock:
+            window = min(3600.0, max(time.time() - self.started, 1.0))
+            return len(self._frames) * 3600.0 / window
+
+    def record_layer(self, record):
+        with self._lock:
+            self.layers.append(record)
+
+    def memory(self):
+        # Current and peak resident set size in bytes, None where the platform does not say
+        current = peak = None
+        try:
+            with open('/proc/self/statm') as f:
+                current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            pass
+        if resource is not None:
+            # ru_maxrss is KiB on Linux and bytes on macOS
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        return current, peak
+
+    def start_profile(self, layers):
+        # Profile the next `layers` layers submitted to the pipeline
+        with self._lock:
+            self._profile_remaining = max(0, int(layers))
+        if layers:
+            print(f"Profiling the next {layers} layers into {self.profile_dir}")
+
+    def claim_profile(self):
+        with self._lock:
+            if self._profile_remaining <= 0:
+                return False
+            self._profile_remaining -= 1
+            return True
+
+    def profile(self, enabled, name):
+        # cProfile context for one stage of a profiled layer. Since Python 3.12 only one profiler
+        # can be active at a time, so profiled stages run one after another.
+        if not enabled or self.profile_dir is None:
+            return nullcontext()
+        return self._profiled(name)
+
+    @contextmanager
+    def _profiled(self, name):
+        with self._profile_lock:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                self.profile_dir.mkdir(exist_ok=True, parents=True)
+                path = self.profile_dir / f"{name}.prof"
+                profiler.dump_stats(path)
+                with open(path.with_suffix('.txt'), 'w') as f:
+                    pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(30)
+
+    def prometheus(self, prefix='champ'):
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            gauges = sorted(self.gauges.items())
+            counters = sorted(self.counters.items())
+
+        seen = set()
+        for (name, labels), histogram in histograms:
+            metric = f"{prefix}_{name}_seconds"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{metric}_sum{_labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{metric}_count{_labels(labels)} {histogram.count}")
+        for (name, labels), value in counters:
+            metric = f"{prefix}_{name}"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_labels(labels)} {value}")
+
+        current, peak = self.memory()
+        gauges += [
+            (('frames_per_hour', ()), self.frames_per_hour()),
+            (('uptime_seconds', ()), time.time() - self.started),
+        ]
+        if current is not None:
+            gauges.append((('memory_rss_bytes', ()), current))
+        if peak is not None:
+            gauges.append((('memory_peak_rss_bytes', ()), peak))
+        for (name, labels), value in gauges:
+            metric = f"{prefix}_{name}"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+
+metrics = Telemetry()
+
+
+class MetricsServer:
+    # GET /metrics   Prometheus text format
+    # GET /layers    the last per-layer timing records as JSON
+    # POST /profile?layers=N   profile the next N layers
+    def __init__(self, telemetry, host='127.0.0.1', port=9108):
+        telemetry_ref = telemetry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path == '/metrics':
+                    self._reply(200, telemetry_ref.prometheus(), 'text/plain; version=0.0.4')
+                elif path == '/layers':
+                    self._reply(200, json.dumps(list(telemetry_ref.layers)), 'application/json')
+                else:
+                    self._reply(404, 'not found\n', 'text/plain')
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                if url.path != '/profile':
+                    self._reply(404, 'not found\n', 'text/plain')
+                    return
+                try:
+                    layers = int(parse_qs(url.query, keep_blank_values=True).get('layers', ['1'])[0])
+                except ValueError:
+                    layers = -1
+                # layers=0 cancels a running profile
+                if layers < 0:
+                    self.send_error(400, 'layers must be a non-negative integer')
+                    return
+                telemetry_ref.start_profile(layers)
+                self._reply(200, f"profiling {layers} layers\n", 'text/plain')
+
+            def _reply(self, status, body, content_type):
+                data = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True)
+        self.thread.start()
+        print(f"Metrics on http://{host}:{self.server.server_port}/metrics")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ConfigWatcher:
+    # Calls on_change with the freshly loaded config whenever the file's mtime changes
+    def __init__(self, path, on_change, load, interval=2.0):
+        self.path = Path(path)
+        self.on_change = on_change
+        self.load = load
+        self.interval = interval
+        self._mtime = self._stat()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, name='config-watcher', daemon=True)
+        self._thread.start()
+
+    def _stat(self):
+        try:
+            return self.path.stat().st_mtime
+        except OSError:
+            return None
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            mtime = self._stat()
+            if mtime is None or mtime == self._mtime:
+                continue
+            self._mtime = mtime
+            try:
+                config = self.load(self.path)
+                if config:
+                    self.on_change(config)
+            except Exception as exc:
+                print(f"Could not reload {self.path}: {exc}")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()